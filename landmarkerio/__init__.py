@@ -8,8 +8,12 @@ class CacheFile(object):
     texture = "texture.jpg"
     image = "image.json"
     thumbnail = "thumbnail.jpg"
-    mesh_tmp = "mesh.raw.tmp"
+    tiles = "tiles.json"
+    tiles_dir = "tiles"
+    mesh_raw = "mesh.raw"  # stored with the suffix of the codec used
     mesh = "mesh.raw.gz"
+    mesh_indexed_raw = "mesh_indexed.raw"
+    mesh_lods = "mesh_lods.json"
 
 
 class Server(object):
@@ -36,17 +40,37 @@ class Endpoints(object):
     thumbnail = "thumbnails"
 
 
+class MeshFormat(object):
+    expanded = "expanded"  # the legacy per-triangle format
+    indexed = "indexed"
+
+
 class Mimetype(object):
     json = "application/json"
     jpeg = "image/jpeg"
     binary = "application/octet-stream"
+    # length-prefixed (asset id, file) pairs, see landmarkerio.batch
+    batch = "application/x-lmio-batch"
 
 
 LM_DIRNAME = "lmiolandmarks"
 TEMPLATE_DINAME = ".lmiotemplates"
+MANIFEST_FILENAME = ".lmiomanifest.json"
+SHARD_MANIFEST_GLOB = ".lmiomanifest.*-of-*.json"
+FAILURES_FILENAME = ".lmiofailures.json"
+DISCOVERY_FILENAME = ".lmiodiscovery.json"
+INDEX_FILENAME = ".lmioindex.sqlite"
+PACK_INDEX_FILENAME = "lmiopack.sqlite"
+ATLASES_DIRNAME = ".lmioatlases"
+ATLAS_INDEX_FILENAME = "atlas.json"
+STAGING_DIRNAME = ".lmiostaging"
+LOCKS_DIRNAME = ".lmiolocks"
 
 ALL_COLLECTION_ID = "all"
 
-dirs_in_dir = lambda path: sorted([p for p in path.iterdir() if p.is_dir()])
+# hidden directories are used for bookkeeping (e.g. staging and lock files)
+dirs_in_dir = lambda path: sorted(
+    [p for p in path.iterdir() if p.is_dir() and not p.name.startswith(".")]
+)
 
 from ._version import __version__
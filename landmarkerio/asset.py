@@ -1,45 +1,168 @@
 import abc
+import json
 import os
 from pathlib import Path
-from typing import Sequence
+from typing import Any, Dict, List, Mapping, Optional, Sequence
 
-from landmarkerio import CacheFile
-from landmarkerio.types import PathLike
+from landmarkerio import CacheFile, MeshFormat
+from landmarkerio.codec import CODECS
+from landmarkerio.image import variant_file
+from landmarkerio.index import CacheIndex
+from landmarkerio.lazy import LazyCacher
+from landmarkerio.mesh import lod_file
+from landmarkerio.page import Page, PageQuery, paginate
+from landmarkerio.pack import Pack
+from landmarkerio.pyramid import tile_file
+from landmarkerio.types import AssetFile, PathLike
+from landmarkerio.utils import updated_asset_ids
 
 
 class ImageAdapter(abc.ABC):
     @abc.abstractmethod
-    def texture_path(self, asset_id: str) -> Path:
+    def texture_path(self, asset_id: str) -> AssetFile:
         pass
 
     @abc.abstractmethod
-    def thumbnail_path(self, asset_id: str) -> Path:
+    def thumbnail_path(self, asset_id: str) -> AssetFile:
         pass
 
     @abc.abstractmethod
     def asset_ids(self) -> Sequence[str]:
         pass
 
+    def asset_ids_page(self, query: PageQuery) -> Page:
+        return paginate(self.asset_ids(), query)
+
+    def texture_variant_path(self, asset_id: str, variant: str) -> AssetFile:
+        r"""
+        The texture in another format (e.g. webp), for adapters that provide
+        one.
+        """
+        raise FileNotFoundError(f"No {variant} texture available for {asset_id}")
+
+    def thumbnail_variant_path(self, asset_id: str, variant: str) -> AssetFile:
+        raise FileNotFoundError(f"No {variant} thumbnail available for {asset_id}")
+
+    def tile_pyramid(self, asset_id: str) -> Dict[str, Any]:
+        r"""
+        Metadata describing the tiled pyramid of a large image, for adapters
+        that provide one.
+        """
+        raise FileNotFoundError(f"No tile pyramid available for {asset_id}")
+
+    def tile_path(self, asset_id: str, level: int, x: int, y: int) -> AssetFile:
+        raise FileNotFoundError(f"No tile pyramid available for {asset_id}")
+
+    async def prepare(self, asset_id: str) -> None:
+        r"""
+        Called before any of the files of asset_id are served, so that
+        adapters can produce them on demand.
+        """
+        pass
+
+    def revision(self) -> Optional[int]:
+        r"""
+        A number that changes whenever asset_ids does, or None if the adapter
+        can't tell.
+        """
+        return None
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        r"""
+        Called when assets are added to (with the paths of their source
+        files) or removed from a running server.
+        """
+        pass
+
 
 class MeshAdapter(abc.ABC):
     @abc.abstractmethod
     def asset_ids(self) -> Sequence[str]:
         pass
 
+    def asset_ids_page(self, query: PageQuery) -> Page:
+        return paginate(self.asset_ids(), query)
+
     @abc.abstractmethod
-    def mesh_path(self, asset_id: str) -> Path:
+    def mesh_path(self, asset_id: str) -> AssetFile:
+        pass
+
+    def indexed_mesh_path(self, asset_id: str) -> AssetFile:
+        r"""
+        The mesh in the indexed (vertex + trilist) format, for adapters that
+        provide it.
+        """
+        raise FileNotFoundError(f"No indexed mesh available for {asset_id}")
+
+    def mesh_lods(self, asset_id: str) -> Sequence[Dict[str, Any]]:
+        r"""
+        The levels of detail available for a mesh, from coarsest to finest.
+        """
+        raise FileNotFoundError(f"No levels of detail available for {asset_id}")
+
+    def lod_mesh_path(
+        self, asset_id: str, lod: int, mesh_format: str = MeshFormat.expanded
+    ) -> AssetFile:
+        r"""
+        A level of detail of a mesh, numbered as in mesh_lods, in either
+        format.
+        """
+        lods = self.mesh_lods(asset_id)
+        if not 0 <= lod < len(lods):
+            raise FileNotFoundError(f"{asset_id} has no level of detail {lod}")
+        if mesh_format == MeshFormat.indexed:
+            raw_name = CacheFile.mesh_indexed_raw
+        else:
+            raw_name = CacheFile.mesh_raw
+        if lods[lod]["fraction"] < 1:
+            raw_name = lod_file(raw_name, lod)
+        return self._encoded_path(asset_id, raw_name)
+
+    def _encoded_path(self, asset_id: str, raw_name: str) -> AssetFile:
+        r"""
+        The file of an asset that raw_name is stored in, compressed with
+        whichever codec the cache was built with.
+        """
+        raise FileNotFoundError(f"No {raw_name} available for {asset_id}")
+
+    async def prepare(self, asset_id: str) -> None:
+        r"""
+        Called before any of the files of asset_id are served, so that
+        adapters can produce them on demand.
+        """
+        pass
+
+    def revision(self) -> Optional[int]:
+        return None
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        r"""
+        Called when assets are added to (with the paths of their source
+        files) or removed from a running server.
+        """
         pass
 
 
 class CacheAdapter:
     def __init__(self, cache_dir: PathLike) -> None:
         self.cache_dir = Path(os.path.abspath(os.path.expanduser(cache_dir)))
+        # bumped by update_assets
+        self._revision = 0
+
+    def revision(self) -> Optional[int]:
+        return self._revision
 
 
 class ImageCacheAdapter(CacheAdapter, ImageAdapter):
     def __init__(self, cache_dir):
         CacheAdapter.__init__(self, cache_dir)
-        self._image_asset_ids = [
+        self._image_asset_ids = self._cached_asset_ids()
+
+    def _cached_asset_ids(self) -> List[str]:
+        index = CacheIndex.open(self.cache_dir)
+        if index is not None:
+            return index.image_asset_ids()
+        return [
             a.parent.name
             for a in self.cache_dir.glob(os.path.join("*", CacheFile.image))
             if a.parent.parent == self.cache_dir
@@ -51,21 +174,200 @@ class ImageCacheAdapter(CacheAdapter, ImageAdapter):
     def thumbnail_path(self, asset_id: str) -> Path:
         return self.cache_dir / asset_id / CacheFile.thumbnail
 
+    def texture_variant_path(self, asset_id: str, variant: str) -> Path:
+        return self._variant_path(asset_id, CacheFile.texture, variant)
+
+    def thumbnail_variant_path(self, asset_id: str, variant: str) -> Path:
+        return self._variant_path(asset_id, CacheFile.thumbnail, variant)
+
+    def _variant_path(self, asset_id: str, cache_file: str, variant: str) -> Path:
+        # variants are optional, so have to be looked for
+        path = self.cache_dir / asset_id / variant_file(cache_file, variant)
+        if not path.is_file():
+            raise FileNotFoundError(path)
+        return path
+
+    def tile_pyramid(self, asset_id: str) -> Dict[str, Any]:
+        with (self.cache_dir / asset_id / CacheFile.tiles).open("rt") as f:
+            return json.load(f)
+
+    def tile_path(self, asset_id: str, level: int, x: int, y: int) -> Path:
+        return self.cache_dir / asset_id / CacheFile.tiles_dir / tile_file(level, x, y)
+
     def asset_ids(self) -> Sequence[str]:
         return self._image_asset_ids
 
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        # in mesh mode only textured meshes have images
+        added = [a for a in added if (self.cache_dir / a / CacheFile.image).is_file()]
+        if added or removed:
+            self._image_asset_ids = updated_asset_ids(
+                self._image_asset_ids, added, removed
+            )
+            self._revision += 1
+
 
 class MeshCacheAdapter(CacheAdapter, MeshAdapter):
     def __init__(self, cache_dir: PathLike) -> None:
         CacheAdapter.__init__(self, cache_dir)
-        self._mesh_asset_ids = [
-            a.parent.name
-            for a in self.cache_dir.glob(os.path.join("*", CacheFile.mesh))
-            if a.parent.parent == self.cache_dir
-        ]
+        self._mesh_asset_ids = self._cached_asset_ids()
+
+    def _cached_asset_ids(self) -> List[str]:
+        index = CacheIndex.open(self.cache_dir)
+        if index is not None:
+            return index.mesh_asset_ids()
+        mesh_glob = os.path.join("*", CacheFile.mesh_raw + ".*")
+        return list(
+            dict.fromkeys(
+                a.parent.name
+                for a in sorted(self.cache_dir.glob(mesh_glob))
+                if a.parent.parent == self.cache_dir
+            )
+        )
 
     def mesh_path(self, asset_id: str) -> Path:
-        return self.cache_dir / asset_id / CacheFile.mesh
+        return self._encoded_path(asset_id, CacheFile.mesh_raw)
+
+    def indexed_mesh_path(self, asset_id: str) -> Path:
+        return self._encoded_path(asset_id, CacheFile.mesh_indexed_raw)
+
+    def mesh_lods(self, asset_id: str) -> Sequence[Dict[str, Any]]:
+        with (self.cache_dir / asset_id / CacheFile.mesh_lods).open("rt") as f:
+            return json.load(f)
+
+    def _encoded_path(self, asset_id: str, raw_name: str) -> Path:
+        # meshes are stored with the suffix of whichever codec was used
+        asset_cache_dir = self.cache_dir / asset_id
+        for codec in CODECS.values():
+            path = asset_cache_dir / (raw_name + codec.suffix)
+            if path.is_file():
+                return path
+        raise FileNotFoundError(asset_cache_dir / raw_name)
+
+    def asset_ids(self) -> Sequence[str]:
+        return self._mesh_asset_ids
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        # in image mode there are no meshes
+        added = [a for a in added if self._has_mesh(a)]
+        if added or removed:
+            self._mesh_asset_ids = updated_asset_ids(
+                self._mesh_asset_ids, added, removed
+            )
+            self._revision += 1
+
+    def _has_mesh(self, asset_id: str) -> bool:
+        try:
+            self._encoded_path(asset_id, CacheFile.mesh_raw)
+        except FileNotFoundError:
+            return False
+        return True
+
+
+class LazyCacheAdapter:
+    r"""
+    Caches each asset of a LazyCacher the first time it is requested. Every
+    asset of the cacher is of the kind of the server's mode, whether it has
+    been cached yet or not, so is listed up front. Whether a mesh has a
+    texture is only known once it has been cached, so images are listed in
+    mesh mode as they are by the cache adapters - from the cache, and as
+    the cacher and the watcher report them.
+    """
+
+    cacher: LazyCacher
+
+    async def prepare(self, asset_id: str) -> None:
+        await self.cacher.ensure(asset_id)
+
+
+class LazyImageCacheAdapter(LazyCacheAdapter, ImageCacheAdapter):
+    def __init__(self, cache_dir: PathLike, cacher: LazyCacher, mode: str) -> None:
+        CacheAdapter.__init__(self, cache_dir)
+        self.cacher = cacher
+        if mode == "image":
+            self._image_asset_ids = list(cacher.asset_ids)
+        else:
+            self._image_asset_ids = self._cached_asset_ids()
+            # textured meshes are listed as soon as they have been cached
+            cacher.on_cached(self.update_assets)
+
+
+class LazyMeshCacheAdapter(LazyCacheAdapter, MeshCacheAdapter):
+    def __init__(self, cache_dir: PathLike, cacher: LazyCacher, mode: str) -> None:
+        CacheAdapter.__init__(self, cache_dir)
+        self.cacher = cacher
+        if mode == "mesh":
+            self._mesh_asset_ids = list(cacher.asset_ids)
+        else:
+            self._mesh_asset_ids = self._cached_asset_ids()
+
+
+class PackAdapter:
+    def __init__(self, pack_dir: PathLike) -> None:
+        self.pack = Pack(pack_dir)
+
+    def revision(self) -> Optional[int]:
+        # packs don't change under a running server
+        return 0
+
+
+class PackedImageAdapter(PackAdapter, ImageAdapter):
+    r"""
+    Serves images from a packed cache, as written by ``lmiopack``.
+    """
+
+    def __init__(self, pack_dir: PathLike) -> None:
+        PackAdapter.__init__(self, pack_dir)
+        self._image_asset_ids = self.pack.asset_ids_with(CacheFile.image)
+
+    def texture_path(self, asset_id: str) -> AssetFile:
+        return self.pack.locate(asset_id, CacheFile.texture)
+
+    def thumbnail_path(self, asset_id: str) -> AssetFile:
+        return self.pack.locate(asset_id, CacheFile.thumbnail)
+
+    def texture_variant_path(self, asset_id: str, variant: str) -> AssetFile:
+        return self.pack.locate(asset_id, variant_file(CacheFile.texture, variant))
+
+    def thumbnail_variant_path(self, asset_id: str, variant: str) -> AssetFile:
+        return self.pack.locate(asset_id, variant_file(CacheFile.thumbnail, variant))
+
+    def tile_pyramid(self, asset_id: str) -> Dict[str, Any]:
+        return json.loads(self.pack.read(asset_id, CacheFile.tiles))
+
+    def tile_path(self, asset_id: str, level: int, x: int, y: int) -> AssetFile:
+        name = f"{CacheFile.tiles_dir}/{tile_file(level, x, y)}"
+        return self.pack.locate(asset_id, name)
+
+    def asset_ids(self) -> Sequence[str]:
+        return self._image_asset_ids
+
+
+class PackedMeshAdapter(PackAdapter, MeshAdapter):
+    r"""
+    Serves meshes from a packed cache, as written by ``lmiopack``.
+    """
+
+    def __init__(self, pack_dir: PathLike) -> None:
+        PackAdapter.__init__(self, pack_dir)
+        self._mesh_asset_ids = self.pack.asset_ids_with(CacheFile.mesh_raw + ".%")
+
+    def mesh_path(self, asset_id: str) -> AssetFile:
+        return self._encoded_path(asset_id, CacheFile.mesh_raw)
+
+    def indexed_mesh_path(self, asset_id: str) -> AssetFile:
+        return self._encoded_path(asset_id, CacheFile.mesh_indexed_raw)
+
+    def mesh_lods(self, asset_id: str) -> Sequence[Dict[str, Any]]:
+        return json.loads(self.pack.read(asset_id, CacheFile.mesh_lods))
+
+    def _encoded_path(self, asset_id: str, raw_name: str) -> AssetFile:
+        for codec in CODECS.values():
+            try:
+                return self.pack.locate(asset_id, raw_name + codec.suffix)
+            except FileNotFoundError:
+                pass
+        raise FileNotFoundError(f"{asset_id}/{raw_name} is not in the pack")
 
     def asset_ids(self) -> Sequence[str]:
         return self._mesh_asset_ids
@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os.path import abspath, expanduser
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from loguru import logger
+from PIL import Image
+
+from landmarkerio import ATLAS_INDEX_FILENAME, ATLASES_DIRNAME, CacheFile
+from landmarkerio.collection import CollectionAdapter
+from landmarkerio.publish import AssetLocked, asset_lock
+from landmarkerio.types import PathLike
+
+# Thumbnails are scaled to fit cells of this size, which is plenty for a grid
+DEFAULT_ATLAS_CELL_SIZE = 160
+# The largest side of a sheet, as WebGL only allows textures up to 4096
+DEFAULT_ATLAS_SHEET_SIZE = 4096
+ATLAS_JPEG_QUALITY = 60
+
+# (asset id, signature of its thumbnail or None if it has none)
+ThumbnailSource = Tuple[str, Optional[str]]
+
+
+def atlases_dir(cache_dir: PathLike) -> Path:
+    return Path(abspath(expanduser(cache_dir))) / ATLASES_DIRNAME
+
+
+def atlas_dir(cache_dir: PathLike, collection_id: str) -> Path:
+    return atlases_dir(cache_dir) / collection_id
+
+
+def sheet_file(key: str) -> str:
+    # named by content, so a rebuilt sheet never replaces one in use
+    return f"{key}.jpg"
+
+
+def load_atlas_index(path: PathLike) -> Optional[Dict[str, Any]]:
+    try:
+        with (Path(path) / ATLAS_INDEX_FILENAME).open("rt") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _thumbnail_source(cache_dir: Path, asset_id: str) -> ThumbnailSource:
+    # recached assets are published as new directories, so new inodes
+    try:
+        st = os.stat(cache_dir / asset_id / CacheFile.thumbnail)
+    except OSError:
+        return asset_id, None
+    return asset_id, f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _sheet_key(sources: Sequence[ThumbnailSource], cell_size: int) -> str:
+    data = json.dumps([cell_size, sources], separators=(",", ":")).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def _render_sheet(
+    cache_dir: Path,
+    asset_ids: Sequence[str],
+    path: Path,
+    cell_size: int,
+    columns: int,
+) -> Tuple[Dict[str, Dict[str, int]], Tuple[int, int]]:
+    r"""
+    Draw the thumbnails of asset_ids into a grid of cells, saved to path.
+    Returns the rectangle of each asset (that has a thumbnail) in the sheet,
+    and the size of the sheet.
+    """
+    n = max(len(asset_ids), 1)
+    width, height = min(n, columns) * cell_size, -(-n // columns) * cell_size
+    sheet = Image.new("RGB", (width, height))
+    rects = {}
+    for i, asset_id in enumerate(asset_ids):
+        try:
+            with Image.open(cache_dir / asset_id / CacheFile.thumbnail) as im:
+                # decode at a fraction of the thumbnail's size where possible
+                im.draft("RGB", (cell_size, cell_size))
+                im = im.convert("RGB")
+                im.thumbnail((cell_size, cell_size))
+        except OSError as e:
+            logger.warning("Unable to add {} to an atlas - {}", asset_id, e)
+            continue
+        x, y = (i % columns) * cell_size, (i // columns) * cell_size
+        sheet.paste(im, (x, y))
+        rects[asset_id] = {"x": x, "y": y, "width": im.width, "height": im.height}
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        sheet.save(f, format="jpeg", quality=ATLAS_JPEG_QUALITY)
+    os.replace(tmp, path)
+    return rects, (width, height)
+
+
+def build_atlas(
+    cache_dir: PathLike,
+    collection_id: str,
+    asset_ids: Sequence[str],
+    cell_size: Optional[int] = None,
+    sheet_size: Optional[int] = None,
+) -> Dict[str, Any]:
+    r"""
+    Pack the thumbnails of a collection into a few large sprite sheets, plus
+    an index of the sheet and rectangle of each asset.
+
+    Each sheet holds a run of the collection in order, and is only redrawn
+    if the assets in it (or their thumbnails) have changed since the atlas
+    was last built. The cell and sheet sizes default to those the atlas was
+    last built with.
+    """
+    cache_dir = Path(abspath(expanduser(cache_dir)))
+    path = atlas_dir(cache_dir, collection_id)
+    path.mkdir(parents=True, exist_ok=True)
+    old = load_atlas_index(path) or {}
+    if cell_size is None:
+        cell_size = old.get("cell_size", DEFAULT_ATLAS_CELL_SIZE)
+    if sheet_size is None:
+        sheet_size = old.get("sheet_size", DEFAULT_ATLAS_SHEET_SIZE)
+    columns = max(sheet_size // cell_size, 1)
+    per_sheet = columns * columns
+
+    old_sheets = {s["key"]: s for s in old.get("sheets", [])}
+    old_assets = old.get("assets", {})
+    sources = [_thumbnail_source(cache_dir, a) for a in asset_ids]
+    sheets: List[Dict[str, Any]] = []
+    assets: Dict[str, Dict[str, int]] = {}
+    to_render = []
+    for start in range(0, len(sources), per_sheet):
+        chunk = sources[start : start + per_sheet]
+        key = _sheet_key(chunk, cell_size)
+        sheet = len(sheets)
+        if key in old_sheets and (path / sheet_file(key)).is_file():
+            sheets.append(old_sheets[key])
+            for asset_id, source in chunk:
+                if source is not None and asset_id in old_assets:
+                    assets[asset_id] = {**old_assets[asset_id], "sheet": sheet}
+        else:
+            sheets.append({"key": key})
+            to_render.append((sheet, [a for a, source in chunk if source]))
+
+    def render(job: Tuple[int, Sequence[str]]) -> None:
+        sheet, sheet_asset_ids = job
+        key = sheets[sheet]["key"]
+        rects, (width, height) = _render_sheet(
+            cache_dir, sheet_asset_ids, path / sheet_file(key), cell_size, columns
+        )
+        sheets[sheet] = {"key": key, "width": width, "height": height}
+        for asset_id, rect in rects.items():
+            assets[asset_id] = {"sheet": sheet, **rect}
+
+    # decoding and resizing release the GIL, so sheets are drawn in parallel
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(render, to_render))
+
+    index = {
+        "cell_size": cell_size,
+        "sheet_size": sheet_size,
+        "sheets": sheets,
+        "assets": {a: assets[a] for a, _ in sources if a in assets},
+    }
+    fd, tmp = tempfile.mkstemp(dir=path, prefix=".", suffix=".tmp")
+    with os.fdopen(fd, "wt") as f:
+        json.dump(index, f)
+    os.replace(tmp, path / ATLAS_INDEX_FILENAME)
+
+    # only once the new index is in place are the sheets it replaced removed
+    in_use = {sheet_file(s["key"]) for s in sheets}
+    for p in path.glob("*.jpg"):
+        if p.name not in in_use:
+            p.unlink()
+    logger.debug(
+        "atlas:     {} - {} sheets ({} redrawn) of {} assets",
+        collection_id,
+        len(sheets),
+        len(to_render),
+        len(index["assets"]),
+    )
+    return index
+
+
+def build_atlases(
+    cache_dir: PathLike,
+    collections: Mapping[str, Sequence[str]],
+    cell_size: Optional[int] = None,
+    sheet_size: Optional[int] = None,
+) -> None:
+    r"""
+    Bring the atlases of a cache directory in line with collections (a
+    mapping of collection id to asset ids), removing those of collections
+    that no longer exist. A collection whose atlas is being built by another
+    process (e.g. another server worker) is left to it.
+    """
+    root = atlases_dir(cache_dir)
+    root.mkdir(exist_ok=True)
+    for collection_id, asset_ids in collections.items():
+        try:
+            with asset_lock(cache_dir, f"{ATLASES_DIRNAME}.{collection_id}"):
+                build_atlas(
+                    cache_dir,
+                    collection_id,
+                    asset_ids,
+                    cell_size=cell_size,
+                    sheet_size=sheet_size,
+                )
+        except AssetLocked as e:
+            logger.debug("atlas:     skipped, as {}", e)
+    for path in root.iterdir():
+        if path.is_dir() and path.name not in collections:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def collection_assets(
+    collection_adapter: CollectionAdapter,
+) -> Dict[str, Sequence[str]]:
+    return {
+        c: list(collection_adapter.collection(c))
+        for c in collection_adapter.collection_ids()
+    }
+
+
+class AtlasAdapter:
+    r"""
+    Serves the thumbnail atlases built by ``lmiocache --atlases``.
+
+    If given the collection adapter of the server, the atlases are rebuilt
+    in the background whenever the collections (or the assets in them)
+    change. Only the sheets affected are redrawn.
+    """
+
+    def __init__(
+        self,
+        cache_dir: PathLike,
+        collection_adapter: Optional[CollectionAdapter] = None,
+    ) -> None:
+        self.cache_dir = Path(abspath(expanduser(cache_dir)))
+        self.collection_adapter = collection_adapter
+        self._indexes: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._rebuilding: Optional["asyncio.Future[None]"] = None
+        self._stale = False
+
+    def atlas(self, collection_id: str) -> Dict[str, Any]:
+        path = atlas_dir(self.cache_dir, collection_id)
+        try:
+            mtime = os.stat(path / ATLAS_INDEX_FILENAME).st_mtime_ns
+        except OSError:
+            raise FileNotFoundError(f"No atlas available for {collection_id}")
+        cached = self._indexes.get(collection_id)
+        if cached is None or cached[0] != mtime:
+            index = load_atlas_index(path)
+            if index is None:
+                raise FileNotFoundError(f"No atlas available for {collection_id}")
+            cached = self._indexes[collection_id] = (mtime, index)
+        return cached[1]
+
+    def sheet_path(self, collection_id: str, sheet: int) -> Path:
+        sheets = self.atlas(collection_id)["sheets"]
+        if not 0 <= sheet < len(sheets):
+            raise FileNotFoundError(f"No sheet {sheet} in the atlas of {collection_id}")
+        return atlas_dir(self.cache_dir, collection_id) / sheet_file(
+            sheets[sheet]["key"]
+        )
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        # atlases are only maintained for caches that were built with them
+        if self.collection_adapter is None or not atlases_dir(self.cache_dir).is_dir():
+            return
+        self._stale = True
+        if self._rebuilding is None:
+            self._rebuilding = asyncio.ensure_future(self._rebuild())
+
+    async def _rebuild(self) -> None:
+        assert self.collection_adapter is not None
+        loop = asyncio.get_running_loop()
+        try:
+            # changes that arrive during a rebuild are picked up by another
+            while self._stale:
+                self._stale = False
+                collections = collection_assets(self.collection_adapter)
+                try:
+                    await loop.run_in_executor(
+                        None, partial(build_atlases, self.cache_dir, collections)
+                    )
+                except Exception:
+                    logger.exception("Unable to rebuild atlases")
+        finally:
+            self._rebuilding = None
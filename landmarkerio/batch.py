@@ -0,0 +1,69 @@
+import asyncio
+import struct
+from collections import deque
+from itertools import islice
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# The most assets that can be asked for in one batch
+MAX_BATCH_SIZE = 1000
+# How many of the files of a batch are read at once
+BATCH_CONCURRENCY = 16
+
+# Each item of a batch is the asset id then the file, each prefixed with its
+# length as a big-endian uint32. A missing file has a length of zero.
+_LENGTH = struct.Struct(">I")
+
+
+def encode_batch_item(asset_id: str, data: Optional[bytes]) -> bytes:
+    encoded_id = asset_id.encode("utf-8")
+    data = data or b""
+    return b"".join(
+        [_LENGTH.pack(len(encoded_id)), encoded_id, _LENGTH.pack(len(data)), data]
+    )
+
+
+def decode_batch(body: bytes) -> Iterator[Tuple[str, bytes]]:
+    offset = 0
+    while offset < len(body):
+        fields = []
+        for _ in range(2):
+            (length,) = _LENGTH.unpack_from(body, offset)
+            offset += _LENGTH.size
+            fields.append(body[offset : offset + length])
+            offset += length
+        yield fields[0].decode("utf-8"), fields[1]
+
+
+async def ordered_map(
+    f: Callable[[T], Awaitable[R]], items: Iterable[T], n_concurrent: int
+) -> AsyncIterator[R]:
+    r"""
+    Yield f of each of items in order, running up to n_concurrent at once.
+    """
+    items = iter(items)
+    pending: Deque["asyncio.Future[R]"] = deque(
+        asyncio.ensure_future(f(item)) for item in islice(items, n_concurrent)
+    )
+    try:
+        while pending:
+            result = await pending.popleft()
+            for item in islice(items, 1):
+                pending.append(asyncio.ensure_future(f(item)))
+            yield result
+    finally:
+        # e.g. the client has gone away
+        for future in pending:
+            future.cancel()
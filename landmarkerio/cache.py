@@ -1,28 +1,82 @@
-import gzip
+import json
 import os
 import os.path as p
 import shutil
-import struct
 import time
 from functools import partial
 from os.path import abspath, expanduser
 from pathlib import Path
-from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple, cast
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
 import menpo
 import menpo3d
 import numpy as np
 from loguru import logger
-
-from landmarkerio import CacheFile
+from PIL import Image, UnidentifiedImageError
+
+from landmarkerio import DISCOVERY_FILENAME, FAILURES_FILENAME, CacheFile
+from landmarkerio.codec import DEFAULT_CODEC, get_codec, open_compressed
+from landmarkerio.discovery import discover_paths, matches_glob
+from landmarkerio.image import (
+    ImageProbe,
+    allow_large_images,
+    get_image_variant,
+    open_image,
+    probe_image,
+    save_image_variant,
+    variant_file,
+)
+from landmarkerio.index import invalidate_index, sync_index
+from landmarkerio.manifest import CacheManifest, with_content_hash
+from landmarkerio.mesh import (
+    RawMesh,
+    as_raw_mesh,
+    decimate,
+    lod_file,
+    write_expanded_mesh,
+    write_indexed_mesh,
+)
 from landmarkerio.mode import UnexpectedMode
+from landmarkerio.pool import default_max_inflight_bytes, pool_cacher
+from landmarkerio.publish import DEFAULT_LOCK_TIMEOUT, asset_lock, publish, staging_dir
+from landmarkerio.pyramid import (
+    DEFAULT_PYRAMID_MIN_SIZE,
+    DEFAULT_TILE_SIZE,
+    build_pyramid,
+    build_pyramid_from_file,
+)
+from landmarkerio.shard import Shard
 from landmarkerio.types import PathLike
 
 PathAssetIDT = Sequence[Tuple[PathLike, str]]
 IdentifierF = Callable[[PathLike], str]
+# (asset_dir, glob, index_path=None) -> paths of the assets
+AssetPathF = Callable[..., Sequence[Path]]
 CacheF = Callable[[PathLike, str], None]
 DirCacheF = Callable[[PathLike, PathLike, str], None]
-CacherF = Callable[[CacheF, PathAssetIDT], None]
+# Cachers yield the id of each asset as soon as it has been cached
+CacherF = Callable[[CacheF, PathAssetIDT], Iterable[str]]
+
+# How often the manifest is checkpointed while a cache is being built
+MANIFEST_SAVE_INTERVAL = 30.0
+
+# Source images with these suffixes are served as the texture as-is
+JPEG_SUFFIXES = (".jpg", ".jpeg")
+
+# The files that must be present for an asset to be considered cached
+IMAGE_CACHE_FILES = (CacheFile.image, CacheFile.texture, CacheFile.thumbnail)
 
 
 def filename_as_asset_id(fp: PathLike) -> str:
@@ -33,11 +87,12 @@ def filename_as_asset_id(fp: PathLike) -> str:
 def filepath_as_asset_id_under_dir(asset_dir: PathLike) -> IdentifierF:
     # find the filepath under asset_dir and return the full path as an asset id
     asset_dir = Path(abspath(expanduser(asset_dir)))
+    # a partial rather than a closure, so that it can be sent to the server
+    return partial(path_as_asset_id_under_dir, asset_dir)
 
-    def path_as_asset_id(fp: PathLike) -> str:
-        return "__".join(Path(fp).relative_to(asset_dir).parts)
 
-    return path_as_asset_id
+def path_as_asset_id_under_dir(asset_dir: Path, fp: PathLike) -> str:
+    return "__".join(Path(fp).relative_to(asset_dir).parts)
 
 
 def build_asset_mapping(
@@ -55,12 +110,36 @@ def build_asset_mapping(
     return asset_mapping
 
 
-def mesh_paths(asset_dir: PathLike, glob_pattern: str) -> Sequence[Path]:
-    return menpo3d.io.mesh_paths(Path(asset_dir) / glob_pattern)
+def mesh_extensions() -> Sequence[str]:
+    from menpo3d.io.input.extensions import mesh_types
+
+    return list(mesh_types)
+
+
+def image_extensions() -> Sequence[str]:
+    from menpo.io.input.extensions import image_types
+
+    return list(image_types)
+
+
+def mesh_paths(
+    asset_dir: PathLike, glob_pattern: str, index_path: Optional[PathLike] = None
+) -> Sequence[Path]:
+    paths = discover_paths(asset_dir, glob_pattern, mesh_extensions(), index_path)
+    if paths is None:
+        # a custom glob that is too complex for the parallel walker
+        paths = list(menpo3d.io.mesh_paths(Path(asset_dir) / glob_pattern))
+    return paths
 
 
-def image_paths(asset_dir: PathLike, glob_pattern: str) -> Sequence[Path]:
-    return menpo.io.image_paths(Path(asset_dir) / glob_pattern)
+def image_paths(
+    asset_dir: PathLike, glob_pattern: str, index_path: Optional[PathLike] = None
+) -> Sequence[Path]:
+    paths = discover_paths(asset_dir, glob_pattern, image_extensions(), index_path)
+    if paths is None:
+        # a custom glob that is too complex for the parallel walker
+        paths = list(menpo.io.image_paths(Path(asset_dir) / glob_pattern))
+    return paths
 
 
 def build_glob_pattern(ext_str: str, recursive: bool) -> str:
@@ -71,6 +150,76 @@ def build_glob_pattern(ext_str: str, recursive: bool) -> str:
         return file_glob
 
 
+def resolve_glob_pattern(
+    recursive: bool = False, ext: Optional[str] = None, glob: Optional[str] = None
+) -> str:
+    if recursive:
+        logger.debug("assets dir will be searched recursively.")
+
+    if ext is not None:
+        ext_str = "." + ext
+        logger.debug("only assets of type {} will be " "loaded.", ext_str)
+    else:
+        ext_str = ""
+
+    if glob is None:
+        # Figure out the glob pattern and save it
+        glob_ptn = build_glob_pattern(ext_str, recursive)
+    else:
+        glob_ptn = glob
+
+    logger.debug('Using glob: "{}"', glob_ptn)
+    return glob_ptn
+
+
+def asset_paths_f(mode: str) -> AssetPathF:
+    if mode == "image":
+        return image_paths
+    elif mode == "mesh":
+        return mesh_paths
+    else:
+        raise UnexpectedMode(mode)
+
+
+def asset_extensions(mode: str) -> Sequence[str]:
+    if mode == "image":
+        return image_extensions()
+    elif mode == "mesh":
+        return mesh_extensions()
+    else:
+        raise UnexpectedMode(mode)
+
+
+def identify_asset(
+    identifier_f: IdentifierF,
+    asset_dir: PathLike,
+    glob_ptn: str,
+    extensions: Sequence[str],
+    path: PathLike,
+) -> Optional[str]:
+    r"""
+    The id of the asset whose source file is at path, or None if it isn't a
+    file that discovering the assets of asset_dir would find.
+    """
+    if not matches_glob(asset_dir, glob_ptn, path, extensions):
+        return None
+    return identifier_f(path)
+
+
+def discover_assets(
+    asset_path_f: AssetPathF,
+    identifier_f: IdentifierF,
+    asset_dir: PathLike,
+    glob_ptn: str,
+    index_path: Optional[PathLike] = None,
+    asset_paths: Optional[Iterable[PathLike]] = None,
+) -> Dict[str, Path]:
+    if asset_paths is None:
+        asset_paths = asset_path_f(asset_dir, glob_ptn, index_path=index_path)
+    # Construct a mapping from id's to file paths
+    return build_asset_mapping(identifier_f, asset_paths)
+
+
 def ensure_asset_dir(asset_dir: PathLike) -> Path:
     asset_dir = Path(p.abspath(p.expanduser(asset_dir)))
     if not asset_dir.is_dir():
@@ -84,40 +233,77 @@ def cache_asset(
     cache_f: Callable[[PathLike, PathLike, str], None],
     path: PathLike,
     asset_id: str,
+    lock_timeout: float = DEFAULT_LOCK_TIMEOUT,
+) -> None:
+    r"""
+    Cache an asset from scratch in a staging directory and then publish it
+    with a rename, so the server (or another machine sharing the cache) never
+    sees a half written asset. Raises AssetLocked if another process is
+    caching the same asset.
+    """
+    cache_dir = Path(cache_dir)
+    with asset_lock(cache_dir, asset_id, timeout=lock_timeout):
+        with staging_dir(cache_dir) as staging:
+            (staging / asset_id).mkdir()
+            cache_f(staging, path, asset_id)
+            publish(staging / asset_id, cache_dir / asset_id)
+
+
+def cache_image(
+    cache_dir: PathLike,
+    path: PathLike,
+    asset_id: str,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    pyramid_min_size: Optional[int] = DEFAULT_PYRAMID_MIN_SIZE,
+    image_variants: Sequence[str] = (),
 ) -> None:
-    asset_cache_dir = Path(cache_dir) / asset_id
-    asset_cache_dir.mkdir(parents=True, exist_ok=True)
-    cache_f(cache_dir, path, asset_id)
-
-
-def cache_image(cache_dir: PathLike, path: PathLike, asset_id: str) -> None:
     r"""Actually cache this asset_id."""
-    img = menpo.io.import_image(path)
-    _cache_image_for_id(cache_dir, asset_id, img)
+    try:
+        probe: Optional[ImageProbe] = probe_image(path)
+    except UnidentifiedImageError:
+        probe = None
+    if probe is not None and probe.decodable:
+        _cache_probed_image_for_id(
+            cache_dir,
+            asset_id,
+            path,
+            probe,
+            tile_size=tile_size,
+            pyramid_min_size=pyramid_min_size,
+            image_variants=image_variants,
+        )
+        return
+    # Not something PIL can turn into a texture directly - let menpo do it
+    with allow_large_images():
+        img = menpo.io.import_image(path)
+    _cache_image_for_id(
+        cache_dir,
+        asset_id,
+        img,
+        tile_size=tile_size,
+        pyramid_min_size=pyramid_min_size,
+        image_variants=image_variants,
+    )
 
 
 def _cache_image_for_id(
-    cache_dir: PathLike, asset_id: str, img: menpo.image.Image
+    cache_dir: PathLike,
+    asset_id: str,
+    img: menpo.image.Image,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    pyramid_min_size: Optional[int] = DEFAULT_PYRAMID_MIN_SIZE,
+    image_variants: Sequence[str] = (),
 ) -> None:
     asset_cache_dir = Path(cache_dir) / asset_id
     texture_path = asset_cache_dir / CacheFile.texture
     thumbnail_path = asset_cache_dir / CacheFile.thumbnail
     img_path: Path = getattr(img, "path")
 
-    # WebGL only allows textures of maximum dimension 4096
-    ratio = 4096.0 / np.array(img.shape)
-    if np.any(ratio < 1):
-        # the largest axis of the img could be too big for older browsers.
-        # Give a warning.
-        logger.warning(
-            "Warning: {} has shape {}. Dims larger than 4096 may have "
-            "issues rendering in older browsers.",
-            asset_id,
-            img.shape,
-        )
+    _warn_if_too_big(asset_id, img.shape)
+    save_image_json(asset_cache_dir, img.width, img.height)
 
     # 2. Save out the image
-    if img_path.suffix == ".jpg":
+    if img_path.suffix.lower() in JPEG_SUFFIXES:
         # Original was a jpg that was suitable, save it
         shutil.copyfile(img_path, texture_path)
     else:
@@ -127,127 +313,380 @@ def _cache_image_for_id(
     # 3. Save out the thumbnail
     save_jpg_thumbnail_file(img, thumbnail_path)
 
+    # 4. Save out the texture and thumbnail in any other formats asked for
+    if image_variants:
+        save_image_variants(img.as_PILImage(), asset_cache_dir, image_variants)
+
+    # 5. Cut images too big to view as one texture into a tile pyramid
+    if pyramid_min_size and max(img.shape) > pyramid_min_size:
+        metadata = build_pyramid(img.as_PILImage(), asset_cache_dir, tile_size)
+        logger.debug("{} tiled into {} levels", asset_id, metadata["levels"])
+
+
+def _cache_probed_image_for_id(
+    cache_dir: PathLike,
+    asset_id: str,
+    path: PathLike,
+    probe: ImageProbe,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    pyramid_min_size: Optional[int] = DEFAULT_PYRAMID_MIN_SIZE,
+    image_variants: Sequence[str] = (),
+) -> None:
+    # The probe tells us everything about the image short of its pixels, so
+    # they are decoded only if a stage actually needs them, and then only
+    # once (as 8-bit, never as a float menpo Image).
+    asset_cache_dir = Path(cache_dir) / asset_id
+    texture_path = asset_cache_dir / CacheFile.texture
+    thumbnail_path = asset_cache_dir / CacheFile.thumbnail
+
+    _warn_if_too_big(asset_id, probe.shape)
+    save_image_json(asset_cache_dir, probe.width, probe.height)
+    needs_pyramid = bool(pyramid_min_size) and max(probe.shape) > pyramid_min_size
+
+    if probe.servable_as_is:
+        shutil.copyfile(path, texture_path)
+        if not image_variants:
+            # the thumbnail alone can come from a reduced resolution decode,
+            # and the pyramid is read a strip at a time, so a gigapixel JPEG
+            # is never decoded whole
+            with open_image(path) as ip:
+                save_jpg_thumbnail_file_from_jpeg(ip, thumbnail_path)
+            if needs_pyramid:
+                metadata = build_pyramid_from_file(path, asset_cache_dir, tile_size)
+                logger.debug("{} tiled into {} levels", asset_id, metadata["levels"])
+            return
+
+    with open_image(path) as ip:
+        if ip.mode not in ("RGB", "L"):
+            ip = ip.convert("RGB")
+        if not probe.servable_as_is:
+            # saved without the source's EXIF, so never rotated by a browser
+            ip.save(texture_path, format="jpeg")
+        _save_pil_thumbnail(ip, thumbnail_path)
+        if image_variants:
+            save_image_variants(ip, asset_cache_dir, image_variants)
+        if needs_pyramid:
+            metadata = build_pyramid(ip, asset_cache_dir, tile_size)
+            logger.debug("{} tiled into {} levels", asset_id, metadata["levels"])
+
+
+def save_image_json(asset_cache_dir: PathLike, width: int, height: int) -> None:
+    with (Path(asset_cache_dir) / CacheFile.image).open("wt") as f:
+        json.dump({"width": width, "height": height}, f)
+
+
+def _warn_if_too_big(asset_id: str, shape: Sequence[int]) -> None:
+    # WebGL only allows textures of maximum dimension 4096
+    ratio = 4096.0 / np.array(shape)
+    if np.any(ratio < 1):
+        # the largest axis of the img could be too big for older browsers.
+        # Give a warning.
+        logger.warning(
+            "Warning: {} has shape {}. Dims larger than 4096 may have "
+            "issues rendering in older browsers.",
+            asset_id,
+            tuple(shape),
+        )
+
 
 def save_jpg_thumbnail_file(
     img: menpo.image.Image, path: PathLike, width: int = 640
 ) -> None:
-    ip = img.as_PILImage()
+    _save_pil_thumbnail(img.as_PILImage(), path, width=width)
+
+
+def save_jpg_thumbnail_file_from_jpeg(
+    ip: Image.Image, path: PathLike, width: int = 640
+) -> None:
+    r"""
+    Thumbnail an opened (but not yet loaded) JPEG, letting the decoder scale
+    the image down by up to 8x as it decodes rather than decoding every pixel.
+    """
     w, h = ip.size
+    ip.draft("RGB", (width, int(h * 1.0 / w * width)))
+    _save_pil_thumbnail(ip, path, width=width, size=(w, h))
+
+
+def _pil_thumbnail(
+    ip: Image.Image, width: int = 640, size: Optional[Tuple[int, int]] = None
+) -> Image.Image:
+    # size is the full size of the image, if ip is a reduced draft of it
+    w, h = size if size is not None else ip.size
     h2w = h * 1.0 / w
     ips = ip.resize((width, int(h2w * width)))
-    ips.save(path, quality=20, format="jpeg")
+    if ips.mode not in ("RGB", "L"):
+        ips = ips.convert("RGB")
+    return ips
 
 
-def cache_mesh(cache_dir: PathLike, path: PathLike, asset_id: str) -> None:
+def _save_pil_thumbnail(
+    ip: Image.Image,
+    path: PathLike,
+    width: int = 640,
+    size: Optional[Tuple[int, int]] = None,
+) -> None:
+    _pil_thumbnail(ip, width=width, size=size).save(path, quality=20, format="jpeg")
+
+
+def save_image_variants(
+    ip: Image.Image, asset_cache_dir: PathLike, image_variants: Sequence[str]
+) -> None:
+    r"""
+    Save the texture and thumbnail in each of image_variants (e.g. webp),
+    which are served instead of the JPEGs to clients that accept them.
+    """
+    asset_cache_dir = Path(asset_cache_dir)
+    if ip.mode not in ("RGB", "L"):
+        ip = ip.convert("RGB")
+    thumbnail = _pil_thumbnail(ip)
+    for name in image_variants:
+        variant = get_image_variant(name)
+        save_image_variant(
+            ip, asset_cache_dir / variant_file(CacheFile.texture, name), variant
+        )
+        save_image_variant(
+            thumbnail,
+            asset_cache_dir / variant_file(CacheFile.thumbnail, name),
+            variant,
+            thumbnail=True,
+        )
+
+
+def image_cache_files(image_variants: Sequence[str] = ()) -> Tuple[str, ...]:
+    variants = tuple(
+        variant_file(f, v)
+        for v in image_variants
+        for f in (CacheFile.texture, CacheFile.thumbnail)
+    )
+    return IMAGE_CACHE_FILES + variants
+
+
+def mesh_cache_files(codec: str = DEFAULT_CODEC) -> Tuple[str, str, str]:
+    suffix = get_codec(codec).suffix
+    return (
+        CacheFile.mesh_raw + suffix,
+        CacheFile.mesh_indexed_raw + suffix,
+        CacheFile.mesh_lods,
+    )
+
+
+def cache_mesh(
+    cache_dir: PathLike,
+    path: PathLike,
+    asset_id: str,
+    codec: str = DEFAULT_CODEC,
+    level: Optional[int] = None,
+    lods: Sequence[float] = (),
+) -> None:
     mesh = menpo3d.io.import_mesh(path)
     if isinstance(mesh, menpo.shape.mesh.TexturedTriMesh):
         _cache_image_for_id(cache_dir, asset_id, mesh.texture)
-    _cache_mesh_for_id(cache_dir, asset_id, mesh)
+    _cache_mesh_for_id(cache_dir, asset_id, mesh, codec=codec, level=level, lods=lods)
 
 
 def _cache_mesh_for_id(
-    cache_dir: PathLike, asset_id: str, mesh: menpo.shape.TriMesh
+    cache_dir: PathLike,
+    asset_id: str,
+    mesh: menpo.shape.TriMesh,
+    codec: str = DEFAULT_CODEC,
+    level: Optional[int] = None,
+    lods: Sequence[float] = (),
 ) -> None:
     asset_cache_dir = Path(cache_dir) / asset_id
-    mesh_tmp_path = asset_cache_dir / CacheFile.mesh_tmp
-    mesh_path = asset_cache_dir / CacheFile.mesh
-    _export_raw_mesh(mesh_tmp_path, mesh)
+    raw_mesh = as_raw_mesh(mesh)
+
+    # levels of detail run from coarsest to the full mesh, which is always last
+    fractions = sorted(f for f in lods if 0 < f < 1) + [1.0]
+    levels: List[Dict[str, Any]] = []
+    for fraction in fractions:
+        lod = len(levels)
+        if fraction < 1:
+            lod_mesh = decimate(raw_mesh, fraction)
+            if lod_mesh.n_tris == 0:
+                logger.debug(
+                    "{} can't be decimated to {} of its triangles - skipping",
+                    asset_id,
+                    fraction,
+                )
+                continue
+            _write_mesh_files(asset_cache_dir, lod_mesh, codec, level, lod=lod)
+        else:
+            lod_mesh = raw_mesh
+            _write_mesh_files(asset_cache_dir, lod_mesh, codec, level)
+        levels.append(
+            {
+                "lod": lod,
+                "fraction": fraction,
+                "n_points": lod_mesh.n_points,
+                "n_tris": lod_mesh.n_tris,
+            }
+        )
+
+    with (asset_cache_dir / CacheFile.mesh_lods).open("wt") as f:
+        json.dump(levels, f)
 
-    with mesh_tmp_path.open("rb") as f_in:
-        with gzip.open(mesh_path, "wb", compresslevel=1) as f_out:
-            f_out.writelines(f_in)
 
-    mesh_tmp_path.unlink()
+def _write_mesh_files(
+    asset_cache_dir: Path,
+    raw_mesh: RawMesh,
+    codec: str,
+    level: Optional[int],
+    lod: Optional[int] = None,
+) -> None:
+    for raw_name, writer in (
+        (CacheFile.mesh_raw, write_expanded_mesh),
+        (CacheFile.mesh_indexed_raw, write_indexed_mesh),
+    ):
+        if lod is not None:
+            raw_name = lod_file(raw_name, lod)
+        path = asset_cache_dir / (raw_name + get_codec(codec).suffix)
+        # the raw mesh is encoded straight into the compressor - an interrupted
+        # write is caught by the manifest, so no temporary file is needed.
+        with open_compressed(path, get_codec(codec), level) as f:
+            writer(f, raw_mesh)
 
 
-def _export_raw_mesh(path: PathLike, m: menpo.shape.TriMesh) -> None:
-    normals = False  # for now we are just not exporting normals.
-    is_textured = hasattr(m, "tcoords")
-    with Path(path).open("wb") as f:
-        f.write(struct.pack("IIII", m.n_tris, is_textured, normals, False))
-        m.points[m.trilist].astype(np.float32).tofile(f)
-        if normals:
-            m.vertex_normals[m.trilist].astype(np.float32).tofile(f)
-        if is_textured:
-            m.tcoords.points[m.trilist].astype(np.float32).tofile(f)
+def discovery_index_path(cache_dir: PathLike) -> Path:
+    return Path(p.abspath(p.expanduser(cache_dir))) / DISCOVERY_FILENAME
 
 
 def ensure_cache_dir(cache_dir: PathLike) -> Path:
     cache_dir = Path(p.abspath(p.expanduser(cache_dir)))
-    if cache_dir.is_dir():
+    if not cache_dir.is_dir():
         logger.warning("Warning the cache dir does not exist - creating...")
         cache_dir.mkdir(parents=True, exist_ok=True)
     logger.debug("cache:     {}", cache_dir)
     return cache_dir
 
 
-def serial_cacher(cache: CacheF, path_asset_id: PathAssetIDT) -> None:
+def serial_cacher(cache: CacheF, path_asset_id: PathAssetIDT) -> Iterator[str]:
     for i, (path, asset_id) in enumerate(path_asset_id):
         logger.debug("Caching {}/{} - {}", i + 1, len(path_asset_id), asset_id)
         cache(path, asset_id)
+        yield asset_id
 
 
 def parallel_cacher(
     cache: CacheF, path_asset_id: PathAssetIDT, n_jobs: int = -1
-) -> None:
+) -> Iterator[str]:
     from joblib import Parallel, delayed
 
     Parallel(n_jobs=n_jobs, verbose=5)(
         delayed(cache)(path, asset_id) for path, asset_id in path_asset_id
     )
+    yield from (asset_id for _, asset_id in path_asset_id)
+
+
+def failures_report_path(cache_dir: PathLike, shard: Optional[Shard] = None) -> Path:
+    filename = FAILURES_FILENAME
+    if shard is not None:
+        stem, ext = p.splitext(filename)
+        filename = f"{stem}.{shard.index}-of-{shard.count}{ext}"
+    return Path(p.abspath(p.expanduser(cache_dir))) / filename
+
+
+def default_cacher(
+    cache_dir: PathLike, parallel: bool = True, shard: Optional[Shard] = None
+) -> CacherF:
+    if not parallel:
+        return serial_cacher
+    return cast(
+        CacherF,
+        partial(
+            pool_cacher,
+            max_inflight_bytes=default_max_inflight_bytes(),
+            report_path=failures_report_path(cache_dir, shard=shard),
+        ),
+    )
 
 
 def build_cache(
     cacher_f: CacherF,
-    asset_path_f: Callable[[PathLike, str], Sequence[Path]],
+    asset_path_f: AssetPathF,
     cache_f: DirCacheF,
     identifier_f: IdentifierF,
     asset_dir: PathLike,
     cache_dir: PathLike,
+    required_files: Sequence[str],
     recursive: bool = False,
     ext: Optional[str] = None,
     glob: Optional[str] = None,
+    content_hash: bool = False,
+    prune: bool = False,
+    options: Optional[Dict[str, Any]] = None,
+    shard: Optional[Shard] = None,
+    asset_paths: Optional[Sequence[PathLike]] = None,
 ) -> Tuple[Path, Dict[str, Path]]:
     # 1. Ensure the asset_dir and cache_dir are present.
     asset_dir = ensure_asset_dir(asset_dir)
     cache_dir = ensure_cache_dir(cache_dir)
 
-    if recursive:
-        logger.debug("assets dir will be searched recursively.")
-
-    if ext is not None:
-        ext_str = "." + ext
-        logger.debug("only assets of type {} will be " "loaded.", ext_str)
-    else:
-        ext_str = ""
-
-    if glob is None:
-        # Figure out the glob pattern and save it
-        glob_ptn = build_glob_pattern(ext_str, recursive)
-    else:
-        glob_ptn = glob
-
-    logger.debug('Using glob: "{}"', glob_ptn)
-
-    # Construct a mapping from id's to file paths
-    asset_id_to_paths = build_asset_mapping(
-        identifier_f, asset_path_f(asset_dir, glob_ptn)
+    glob_ptn = resolve_glob_pattern(recursive, ext, glob)
+    asset_id_to_paths = discover_assets(
+        asset_path_f,
+        identifier_f,
+        asset_dir,
+        glob_ptn,
+        index_path=discovery_index_path(cache_dir),
+        asset_paths=asset_paths,
     )
 
-    # Check cache for what needs to be updated
-    asset_ids = set(asset_id_to_paths.keys())
-    cached = set(os.listdir(cache_dir))
-    uncached = asset_ids - cached
-
+    # Only consider our own part of the assets when building a shard
+    shard_asset_id_to_paths = asset_id_to_paths
+    if shard is not None:
+        shard_asset_id_to_paths = {
+            a: path for a, path in asset_id_to_paths.items() if a in shard
+        }
+        logger.debug(
+            "shard {} has {} of {} assets",
+            shard,
+            len(shard_asset_id_to_paths),
+            len(asset_id_to_paths),
+        )
+        # the other shards' assets are unknown here, so the index is left to
+        # be rebuilt by an unsharded run once all of the shards are done
+        invalidate_index(cache_dir)
+
+    # Check the manifest for what needs to be updated
+    manifest = CacheManifest(cache_dir, shard=shard)
+    plan = manifest.plan(
+        shard_asset_id_to_paths,
+        required_files,
+        content_hash=content_hash,
+        options=options,
+    )
+    if prune:
+        for asset_id in plan.orphaned:
+            shutil.rmtree(cache_dir / asset_id, ignore_errors=True)
+            manifest.discard(asset_id)
+        if plan.orphaned:
+            logger.debug("pruned {} orphaned assets", len(plan.orphaned))
+    manifest.save()
+
+    uncached = plan.stale
     logger.debug("{} assets need to be added to " "the cache", len(uncached))
     cache: CacheF = cast(CacheF, partial(cache_asset, cache_dir, cache_f))
-    path_asset_id = [(asset_id_to_paths[a_id], a_id) for a_id in uncached]
-
-    start = time.time()
-    cacher_f(cache, path_asset_id)
+    path_asset_id = [(shard_asset_id_to_paths[a_id], a_id) for a_id in sorted(uncached)]
+
+    start = last_save = time.time()
+    n_cached = 0
+    try:
+        for asset_id in cacher_f(cache, path_asset_id):
+            entry = with_content_hash(uncached[asset_id], content_hash)
+            manifest.record(asset_id, entry)
+            n_cached += 1
+            if time.time() - last_save > MANIFEST_SAVE_INTERVAL:
+                # checkpoint, so an interrupted build resumes from here
+                manifest.save()
+                last_save = time.time()
+    finally:
+        if uncached:
+            manifest.save()
     elapsed = time.time() - start
     if uncached:
-        logger.debug("{} assets cached in {:.0f} seconds", len(uncached), elapsed)
+        logger.debug("{} assets cached in {:.0f} seconds", n_cached, elapsed)
+    if shard is None:
+        sync_index(cache_dir, manifest.entries, refreshed=uncached)
 
     return cache_dir, asset_id_to_paths
 
@@ -260,23 +699,49 @@ def build_image_cache(
     ext: Optional[str] = None,
     glob: Optional[str] = None,
     parallel: bool = True,
+    cacher_f: Optional[CacherF] = None,
+    content_hash: bool = False,
+    prune: bool = False,
+    shard: Optional[Shard] = None,
+    asset_paths: Optional[Sequence[PathLike]] = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    pyramid_min_size: Optional[int] = DEFAULT_PYRAMID_MIN_SIZE,
+    image_variants: Sequence[str] = (),
 ) -> Tuple[Path, Dict[str, Path]]:
-    cacher_f: CacherF
-    if parallel:
-        cacher_f = parallel_cacher
-    else:
-        cacher_f = serial_cacher
+    if cacher_f is None:
+        cacher_f = default_cacher(cache_dir, parallel=parallel, shard=shard)
+
+    # fail now, rather than on every asset, if a variant can't be saved
+    image_variants = [get_image_variant(v).name for v in image_variants]
+    options: Dict[str, Any] = {
+        "tile_size": tile_size,
+        "pyramid_min_size": pyramid_min_size,
+    }
+    if image_variants:
+        # only recorded when used, so caches built without are left as they are
+        options["image_variants"] = sorted(image_variants)
 
     return build_cache(
         cacher_f=cacher_f,
         asset_path_f=image_paths,
-        cache_f=cache_image,
+        cache_f=partial(
+            cache_image,
+            tile_size=tile_size,
+            pyramid_min_size=pyramid_min_size,
+            image_variants=image_variants,
+        ),
         identifier_f=identifier_f,
         asset_dir=asset_dir,
         cache_dir=cache_dir,
+        required_files=image_cache_files(image_variants),
         recursive=recursive,
         ext=ext,
         glob=glob,
+        content_hash=content_hash,
+        prune=prune,
+        options=options,
+        shard=shard,
+        asset_paths=asset_paths,
     )
 
 
@@ -288,26 +753,70 @@ def build_mesh_cache(
     ext: Optional[str] = None,
     glob: Optional[str] = None,
     parallel: bool = True,
+    cacher_f: Optional[CacherF] = None,
+    content_hash: bool = False,
+    prune: bool = False,
+    shard: Optional[Shard] = None,
+    asset_paths: Optional[Sequence[PathLike]] = None,
+    mesh_codec: str = DEFAULT_CODEC,
+    mesh_level: Optional[int] = None,
+    mesh_lods: Sequence[float] = (),
 ) -> Tuple[Path, Dict[str, Path]]:
-    cacher_f: CacherF
-    if parallel:
-        cacher_f = parallel_cacher
-    else:
-        cacher_f = serial_cacher
+    if cacher_f is None:
+        cacher_f = default_cacher(cache_dir, parallel=parallel, shard=shard)
 
     return build_cache(
         cacher_f=cacher_f,
         asset_path_f=mesh_paths,
-        cache_f=cache_mesh,
+        cache_f=partial(cache_mesh, codec=mesh_codec, level=mesh_level, lods=mesh_lods),
         identifier_f=identifier_f,
         asset_dir=asset_dir,
         cache_dir=cache_dir,
+        required_files=mesh_cache_files(mesh_codec),
         recursive=recursive,
         ext=ext,
         glob=glob,
+        content_hash=content_hash,
+        prune=prune,
+        options={
+            "mesh_codec": mesh_codec,
+            "mesh_level": mesh_level,
+            "mesh_lods": sorted(mesh_lods),
+        },
+        shard=shard,
+        asset_paths=asset_paths,
     )
 
 
+# The caching options that are recorded in the manifest, and their defaults
+DEFAULT_CACHE_OPTIONS: Dict[str, Any] = {
+    "mesh_codec": DEFAULT_CODEC,
+    "mesh_level": None,
+    "mesh_lods": (),
+    "tile_size": DEFAULT_TILE_SIZE,
+    "pyramid_min_size": DEFAULT_PYRAMID_MIN_SIZE,
+    "image_variants": (),
+}
+
+
+def _with_cached_options(
+    cached: Mapping[str, Any], **given: Optional[Any]
+) -> Dict[str, Any]:
+    # the given options, with those that are None as cached or else defaulted
+    cached = dict(cached)
+    if given["mesh_codec"] not in (None, cached.get("mesh_codec")):
+        # a level is only meaningful for the codec it was given for
+        cached.pop("mesh_level", None)
+    return {
+        name: (
+            given[name]
+            if given[name] is not None
+            else cached.get(name, DEFAULT_CACHE_OPTIONS[name])
+        )
+        for name in DEFAULT_CACHE_OPTIONS
+    }
+
+
 def cache_assets(
     mode: str,
     identifier_f: IdentifierF,
@@ -317,14 +826,62 @@ def cache_assets(
     ext: Optional[str] = None,
     glob: Optional[str] = None,
     parallel: bool = True,
+    cacher_f: Optional[CacherF] = None,
+    content_hash: bool = False,
+    prune: bool = False,
+    shard: Optional[Shard] = None,
+    asset_paths: Optional[Sequence[PathLike]] = None,
+    mesh_codec: Optional[str] = None,
+    mesh_level: Optional[int] = None,
+    mesh_lods: Optional[Sequence[float]] = None,
+    tile_size: Optional[int] = None,
+    pyramid_min_size: Optional[int] = None,
+    image_variants: Optional[Sequence[str]] = None,
 ) -> Tuple[Path, Dict[str, Path]]:
+    r"""
+    Cache the assets of a directory. The caching options that aren't given
+    are those the cache was last built with (or their defaults), so that
+    e.g. lmio serving a cache built by lmiocache doesn't rebuild it.
+    """
+    options = _with_cached_options(
+        CacheManifest(abspath(expanduser(cache_dir)), shard=shard).options,
+        mesh_codec=mesh_codec,
+        mesh_level=mesh_level,
+        mesh_lods=mesh_lods,
+        tile_size=tile_size,
+        pyramid_min_size=pyramid_min_size,
+        image_variants=image_variants,
+    )
     if mode == "image":
-        cache_builder = partial(build_image_cache, parallel=parallel)
+        cache_builder = partial(
+            build_image_cache,
+            parallel=parallel,
+            cacher_f=cacher_f,
+            tile_size=options["tile_size"],
+            pyramid_min_size=options["pyramid_min_size"],
+            image_variants=options["image_variants"],
+        )
     elif mode == "mesh":
-        cache_builder = partial(build_mesh_cache, parallel=parallel)
+        cache_builder = partial(
+            build_mesh_cache,
+            parallel=parallel,
+            cacher_f=cacher_f,
+            mesh_codec=options["mesh_codec"],
+            mesh_level=options["mesh_level"],
+            mesh_lods=options["mesh_lods"],
+        )
     else:
         raise UnexpectedMode(mode)
 
     return cache_builder(
-        identifier_f, asset_dir, cache_dir, recursive=recursive, ext=ext, glob=glob
+        identifier_f,
+        asset_dir,
+        cache_dir,
+        recursive=recursive,
+        ext=ext,
+        glob=glob,
+        content_hash=content_hash,
+        prune=prune,
+        shard=shard,
+        asset_paths=asset_paths,
     )
@@ -0,0 +1,122 @@
+import gzip
+import io
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, NamedTuple, Optional
+
+from landmarkerio.types import PathLike
+
+
+class UnknownCodec(ValueError):
+    def __init__(self, codec: str) -> None:
+        super().__init__(
+            f"Unknown codec '{codec}' - must be one of {', '.join(CODECS)}"
+        )
+
+
+class Codec(NamedTuple):
+    name: str
+    # appended to the name of the cached file
+    suffix: str
+    # the HTTP Content-Encoding the stored bytes can be served with as-is
+    content_encoding: str
+    default_level: int
+    writer: Callable[[BinaryIO, int], Any]
+    decompress: Callable[[bytes], bytes]
+
+
+class _BrotliWriter:
+    r"""
+    File-like wrapper around a brotli.Compressor - the brotli package does
+    not provide a streaming writer of its own.
+    """
+
+    def __init__(self, f: BinaryIO, level: int) -> None:
+        import brotli
+
+        self._f = f
+        self._compressor = brotli.Compressor(quality=level)
+
+    def write(self, data: Any) -> int:
+        self._f.write(self._compressor.process(bytes(data)))
+        return len(data)
+
+    def close(self) -> None:
+        self._f.write(self._compressor.finish())
+
+
+def _brotli_decompress(data: bytes) -> bytes:
+    import brotli
+
+    return brotli.decompress(data)
+
+
+def _gzip_writer(f: BinaryIO, level: int) -> gzip.GzipFile:
+    # mtime=0 keeps the output deterministic for identical input
+    return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=level, mtime=0)
+
+
+def _zstd_writer(f: BinaryIO, level: int) -> Any:
+    import zstandard
+
+    return zstandard.ZstdCompressor(level=level).stream_writer(f, closefd=False)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    import zstandard
+
+    # streamed frames don't record their size, so are read back as a stream
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+        return reader.read()
+
+
+CODECS: Dict[str, Codec] = {
+    c.name: c
+    for c in (
+        Codec("gzip", ".gz", "gzip", 1, _gzip_writer, gzip.decompress),
+        Codec("zstd", ".zst", "zstd", 3, _zstd_writer, _zstd_decompress),
+        Codec("br", ".br", "br", 4, _BrotliWriter, _brotli_decompress),
+    )
+}
+DEFAULT_CODEC = "gzip"
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise UnknownCodec(name)
+
+
+def codec_for_path(path: PathLike) -> Optional[Codec]:
+    suffix = Path(path).suffix
+    for codec in CODECS.values():
+        if codec.suffix == suffix:
+            return codec
+    return None
+
+
+def compress(data: bytes, codec: Codec, level: Optional[int] = None) -> bytes:
+    f = io.BytesIO()
+    writer = codec.writer(f, codec.default_level if level is None else level)
+    writer.write(data)
+    writer.close()
+    return f.getvalue()
+
+
+@contextmanager
+def open_compressed(
+    path: PathLike, codec: Codec, level: Optional[int] = None
+) -> Iterator[Any]:
+    r"""
+    Open path for writing, with everything written to the returned file-like
+    object passed straight through the codec's compressor.
+    """
+    if level is None:
+        level = codec.default_level
+    with Path(path).open("wb") as f:
+        writer = codec.writer(f, level)
+        try:
+            yield writer
+        finally:
+            writer.close()
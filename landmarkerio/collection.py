@@ -1,11 +1,14 @@
 import abc
 from os.path import abspath, expanduser
 from pathlib import Path
-from typing import Sequence
+from typing import Dict, Mapping, Optional, Sequence
 
 from loguru import logger
 from landmarkerio import ALL_COLLECTION_ID, FileExt, dirs_in_dir
+from landmarkerio.index import CacheIndex
+from landmarkerio.page import Page, PageQuery, paginate
 from landmarkerio.types import PathLike
+from landmarkerio.utils import updated_asset_ids
 
 
 class MissingCollection(ValueError):
@@ -28,6 +31,27 @@ class CollectionAdapter(abc.ABC):
     def collection(self, collection_id: str) -> Sequence[str]:
         pass
 
+    def collection_page(self, collection_id: str, query: PageQuery) -> Page:
+        r"""
+        One page of a collection, for clients that can't load it all at once.
+        """
+        return paginate(self.collection(collection_id), query)
+
+    def revision(self) -> Optional[int]:
+        r"""
+        A number that changes whenever the collections do, so that they can be
+        serialised once per revision. None if the adapter can't tell, in which
+        case they are serialised on every request.
+        """
+        return None
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        r"""
+        Called when assets are added to (with the paths of their source
+        files) or removed from a running server.
+        """
+        pass
+
     def __str__(self) -> str:
         a = f"Serving {len(self.collection_ids())} collection(s):"
         b = "\n".join(
@@ -40,8 +64,22 @@ class FileCollectionAdapter(CollectionAdapter):
     def __init__(self, collection_dir: PathLike) -> None:
         self.collection_dir = Path(abspath(expanduser(collection_dir)))
         logger.debug("Found collections: {}", self.collection_dir)
+        self._collection = self._load_collections()
+        self._revision = 0
+
+    def _load_collections(self) -> Dict[str, Sequence[str]]:
         collection_paths = self.collection_dir.glob("*" + FileExt.collection)
-        self._collection = {c.stem: load_collection(c) for c in collection_paths}
+        return {c.stem: load_collection(c) for c in collection_paths}
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        # the collection files may well have been edited alongside
+        collection = self._load_collections()
+        if collection != self._collection:
+            self._collection = collection
+            self._revision += 1
+
+    def revision(self) -> Optional[int]:
+        return self._revision
 
     def collection_ids(self) -> Sequence[str]:
         return list(self._collection.keys())
@@ -56,8 +94,37 @@ class FileCollectionAdapter(CollectionAdapter):
 class AllCacheCollectionAdapter(CollectionAdapter):
     def __init__(self, cache_dir: PathLike) -> None:
         cache_dir = Path(abspath(expanduser(cache_dir)))
-        self._collection = [p.name for p in dirs_in_dir(cache_dir)]
+        index = CacheIndex.open(cache_dir)
+        if index is not None:
+            self._collection = index.asset_ids()
+        else:
+            self._collection = [p.name for p in dirs_in_dir(cache_dir)]
+        self._collection_ids = [ALL_COLLECTION_ID]
+        self._revision = 0
+
+    def collection_ids(self) -> Sequence[str]:
+        return self._collection_ids
+
+    def collection(self, collection_id: str) -> Sequence[str]:
+        if collection_id == ALL_COLLECTION_ID:
+            return self._collection
+        else:
+            raise MissingCollection(collection_id)
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        if added or removed:
+            self._collection = updated_asset_ids(self._collection, added, removed)
+            self._revision += 1
+
+    def revision(self) -> Optional[int]:
+        return self._revision
+
+
+class AllAssetsCollectionAdapter(CollectionAdapter):
+    def __init__(self, asset_ids: Sequence[str]) -> None:
+        self._collection = asset_ids
         self._collection_ids = [ALL_COLLECTION_ID]
+        self._revision = 0
 
     def collection_ids(self) -> Sequence[str]:
         return self._collection_ids
@@ -67,3 +134,11 @@ class AllCacheCollectionAdapter(CollectionAdapter):
             return self._collection
         else:
             raise MissingCollection(collection_id)
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        if added or removed:
+            self._collection = updated_asset_ids(self._collection, added, removed)
+            self._revision += 1
+
+    def revision(self) -> Optional[int]:
+        return self._revision
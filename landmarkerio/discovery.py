@@ -0,0 +1,239 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+from landmarkerio.types import PathLike
+
+DISCOVERY_FORMAT_VERSION = 1
+# Walking directories is bound by the latency of the filesystem (especially
+# over NFS) rather than by CPU, so many more threads than cores pay off
+DEFAULT_DISCOVERY_THREADS = 32
+# A directory modified this close to when it was scanned may have changed
+# again within the resolution of its mtime, so it is always rescanned
+RACY_INTERVAL_NS = 2 * 10**9
+
+
+class DirListing(NamedTuple):
+    mtime_ns: int
+    files: List[str]
+    subdirs: List[str]
+
+
+class DiscoveryIndex(NamedTuple):
+    r"""
+    The matching files and subdirectories of every directory walked by a
+    previous discovery, so that directories that have not been modified since
+    need not be listed again.
+    """
+
+    key: Dict[str, object]
+    scanned_at_ns: int
+    dirs: Dict[str, DirListing]
+
+
+def split_glob(pattern: str) -> Optional[Tuple[bool, str]]:
+    r"""
+    Split a glob into (recursive, filename pattern) if it is one the walker
+    supports ('*.jpg' or '**/*.jpg'), otherwise None.
+    """
+    parts = Path(pattern).parts
+    if len(parts) == 1 and "**" not in parts[0]:
+        return False, parts[0]
+    if len(parts) == 2 and parts[0] == "**" and "**" not in parts[1]:
+        return True, parts[1]
+    return None
+
+
+def _matches(name: str, name_pattern: str, extensions: Sequence[str]) -> bool:
+    # like glob, hidden files are skipped
+    return (
+        not name.startswith(".")
+        and fnmatch(name, name_pattern)
+        and (not extensions or name.lower().endswith(tuple(extensions)))
+    )
+
+
+def matches_glob(
+    asset_dir: PathLike,
+    glob_pattern: str,
+    path: PathLike,
+    extensions: Sequence[str] = (),
+) -> bool:
+    r"""
+    Whether discovering the files matching glob_pattern under asset_dir would
+    find the file at path, without listing any directories. glob_pattern must
+    be one that the walker supports.
+    """
+    split = split_glob(glob_pattern)
+    if split is None:
+        raise ValueError(f"{glob_pattern} is too complex to match a single path")
+    recursive, name_pattern = split
+    try:
+        rel = Path(path).relative_to(asset_dir)
+    except ValueError:
+        return False
+    if not rel.parts or (len(rel.parts) > 1 and not recursive):
+        return False
+    if any(part.startswith(".") for part in rel.parts[:-1]):
+        return False
+    return _matches(rel.name, name_pattern, extensions)
+
+
+def load_index(path: PathLike, key: Dict[str, object]) -> Optional[DiscoveryIndex]:
+    try:
+        with Path(path).open("rt") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != DISCOVERY_FORMAT_VERSION or data.get("key") != key:
+        return None
+    dirs = {d: DirListing(**listing) for d, listing in data["dirs"].items()}
+    return DiscoveryIndex(key, data["scanned_at_ns"], dirs)
+
+
+def save_index(path: PathLike, index: DiscoveryIndex) -> None:
+    path = Path(path)
+    data = {
+        "version": DISCOVERY_FORMAT_VERSION,
+        "key": index.key,
+        "scanned_at_ns": index.scanned_at_ns,
+        "dirs": {d: listing._asdict() for d, listing in index.dirs.items()},
+    }
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("wt") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _list_dir(
+    path: Path, recursive: bool, name_pattern: str, extensions: Sequence[str]
+) -> DirListing:
+    mtime_ns = os.stat(path).st_mtime_ns
+    files, subdirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                # like glob, hidden directories are skipped
+                if recursive and not entry.name.startswith("."):
+                    subdirs.append(entry.name)
+            elif _matches(entry.name, name_pattern, extensions):
+                files.append(entry.name)
+    return DirListing(mtime_ns, sorted(files), sorted(subdirs))
+
+
+def walk(
+    root: Path,
+    recursive: bool,
+    name_pattern: str,
+    extensions: Sequence[str] = (),
+    previous: Optional[DiscoveryIndex] = None,
+    n_threads: int = DEFAULT_DISCOVERY_THREADS,
+) -> Tuple[List[Path], Dict[str, DirListing]]:
+    r"""
+    Find the files under root whose names match name_pattern (and end with one
+    of the extensions, if given), listing directories in parallel. Listings
+    from a previous walk are reused for any directory whose mtime shows it
+    has not changed since.
+    """
+    prev_dirs = previous.dirs if previous is not None else {}
+    trusted_before = (
+        previous.scanned_at_ns - RACY_INTERVAL_NS if previous is not None else 0
+    )
+
+    def visit(rel: str) -> Tuple[str, DirListing, bool]:
+        path = root / rel
+        listing = prev_dirs.get(rel)
+        if listing is not None:
+            mtime_ns = os.stat(path).st_mtime_ns
+            if mtime_ns == listing.mtime_ns and mtime_ns < trusted_before:
+                return rel, listing, True
+        return rel, _list_dir(path, recursive, name_pattern, extensions), False
+
+    dirs: Dict[str, DirListing] = {}
+    paths: List[Path] = []
+    n_reused = 0
+    with ThreadPoolExecutor(n_threads) as executor:
+        pending: Set[Future] = {executor.submit(visit, "")}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    rel, listing, reused = future.result()
+                except OSError as e:
+                    # e.g. removed while we were walking
+                    logger.warning("Unable to list {} - {}", e.filename, e)
+                    continue
+                dirs[rel] = listing
+                n_reused += reused
+                paths.extend(root / rel / name for name in listing.files)
+                pending.update(
+                    executor.submit(visit, os.path.join(rel, d) if rel else d)
+                    for d in listing.subdirs
+                )
+    logger.debug(
+        "discovered {} files in {} directories ({} unchanged)",
+        len(paths),
+        len(dirs),
+        n_reused,
+    )
+    return sorted(paths), dirs
+
+
+def discover_paths(
+    asset_dir: PathLike,
+    glob_pattern: str,
+    extensions: Sequence[str] = (),
+    index_path: Optional[PathLike] = None,
+    n_threads: int = DEFAULT_DISCOVERY_THREADS,
+) -> Optional[List[Path]]:
+    r"""
+    Find the files matching glob_pattern under asset_dir, or None if the
+    pattern is too complex to be handled here. If index_path is given, the
+    listing of every directory is persisted there and reused next time.
+    """
+    split = split_glob(glob_pattern)
+    if split is None:
+        return None
+    recursive, name_pattern = split
+    root = Path(asset_dir)
+    key = {
+        "root": str(root),
+        "glob": glob_pattern,
+        "extensions": sorted(e.lower() for e in extensions),
+    }
+    previous = load_index(index_path, key) if index_path is not None else None
+    scanned_at_ns = time.time_ns()
+    paths, dirs = walk(
+        root, recursive, name_pattern, extensions, previous, n_threads=n_threads
+    )
+    if index_path is not None:
+        save_index(index_path, DiscoveryIndex(key, scanned_at_ns, dirs))
+    return paths
+
+
+def read_path_list(source: str, asset_dir: PathLike) -> List[Path]:
+    r"""
+    Read paths, one per line, from a file or from stdin if source is '-'.
+    Relative paths are taken to be relative to asset_dir.
+    """
+    if source == "-":
+        lines: Iterable[str] = sys.stdin
+        paths = _parse_path_list(lines, asset_dir)
+    else:
+        with Path(source).open("rt") as f:
+            paths = _parse_path_list(f, asset_dir)
+    logger.debug("{} asset paths listed in {}", len(paths), source)
+    return paths
+
+
+def _parse_path_list(lines: Iterable[str], asset_dir: PathLike) -> List[Path]:
+    asset_dir = Path(os.path.abspath(os.path.expanduser(asset_dir)))
+    stripped = (line.strip() for line in lines)
+    return [asset_dir / line for line in stripped if line and not line.startswith("#")]
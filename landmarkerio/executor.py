@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+
+class AdapterKind(object):
+    landmark = "landmark"
+    collection = "collection"
+    template = "template"
+    image = "image"
+    mesh = "mesh"
+    atlas = "atlas"
+
+
+# The threads each server process runs the (blocking) calls of each adapter
+# on. They are bounded per adapter so that e.g. a slow landmark share can
+# only tie up its own threads, while textures are still served. Collections
+# and templates are held in memory, so need few.
+DEFAULT_ADAPTER_THREADS = {
+    AdapterKind.landmark: 8,
+    AdapterKind.collection: 2,
+    AdapterKind.template: 2,
+    AdapterKind.image: 16,
+    AdapterKind.mesh: 16,
+    AdapterKind.atlas: 2,
+}
+
+
+class AdapterExecutor:
+    r"""
+    Runs the calls of an adapter on a bounded pool of threads, off the event
+    loop, keeping count of how many are waiting for a thread. With no threads
+    the calls are made directly on the event loop.
+    """
+
+    def __init__(self, name: str, n_threads: int) -> None:
+        self.name = name
+        self.n_threads = n_threads
+        self._executor = None
+        if n_threads > 0:
+            self._executor = ThreadPoolExecutor(
+                n_threads, thread_name_prefix=f"lmio-{name}"
+            )
+        self._lock = threading.Lock()
+        self.queued = self.running = self.peak_queued = 0
+        self.calls = 0
+        self.wait_s = 0.0
+
+    async def run(self, f: Callable[..., T], *args: Any) -> T:
+        if self._executor is None:
+            self.calls += 1
+            return f(*args)
+        with self._lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        loop = asyncio.get_running_loop()
+        call = partial(self._call, time.perf_counter(), f, *args)
+        return await loop.run_in_executor(self._executor, call)
+
+    def _call(self, submitted: float, f: Callable[..., T], *args: Any) -> T:
+        # on one of the executor's threads
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.calls += 1
+            self.wait_s += time.perf_counter() - submitted
+        try:
+            return f(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "threads": self.n_threads,
+                "queued": self.queued,
+                "running": self.running,
+                "peak_queued": self.peak_queued,
+                "calls": self.calls,
+                "mean_wait_ms": 1000 * self.wait_s / max(self.calls, 1),
+            }
+
+
+class AdapterExecutors:
+    r"""
+    The executor of each kind of adapter served by a server process.
+    """
+
+    def __init__(self, threads: Optional[Mapping[str, int]] = None) -> None:
+        threads = {**DEFAULT_ADAPTER_THREADS, **(threads or {})}
+        self.executors = {kind: AdapterExecutor(kind, n) for kind, n in threads.items()}
+
+    def __getitem__(self, kind: str) -> AdapterExecutor:
+        return self.executors[kind]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {kind: e.stats() for kind, e in self.executors.items()}
+
+    def log_stats(self) -> None:
+        for kind, stats in self.stats().items():
+            logger.debug(
+                "adapter threads: {} {} calls, {:.1f} ms mean wait, {} peak "
+                "queued ({} threads)",
+                kind,
+                stats["calls"],
+                stats["mean_wait_ms"],
+                stats["peak_queued"],
+                stats["threads"],
+            )
+
+
+def parse_adapter_threads(arg: str) -> Tuple[str, int]:
+    r"""
+    Parse a 'kind=N' command line argument, e.g. 'landmark=32'.
+    """
+    kind, sep, n = arg.partition("=")
+    if not sep or kind not in DEFAULT_ADAPTER_THREADS or int(n) < 0:
+        kinds = ", ".join(DEFAULT_ADAPTER_THREADS)
+        raise ValueError(f"expected KIND=N where KIND is one of {kinds}")
+    return kind, int(n)
@@ -0,0 +1,169 @@
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from PIL import Image, features
+
+from landmarkerio.types import PathLike
+
+EXIF_ORIENTATION = 0x0112
+
+# Modes PIL can decode straight to an 8-bit texture. Anything else (e.g. 16
+# bit or floating point images) is left to menpo to normalise.
+DECODABLE_MODES = ("1", "L", "LA", "P", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr")
+
+# PIL refuses to open images of more than ~179 megapixels, as a guard against
+# decompression bombs. Assets are the user's own files, and gigapixel scans are
+# what tile pyramids are for, so the limit is raised to this while caching.
+MAX_CACHED_IMAGE_PIXELS = 1 << 36
+_pixel_limit_lock = threading.Lock()
+
+
+@contextmanager
+def allow_large_images() -> Iterator[None]:
+    r"""
+    Let PIL open images of up to MAX_CACHED_IMAGE_PIXELS (unless the limit has
+    been lifted altogether) within the block.
+    """
+    with _pixel_limit_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        if limit is not None:
+            Image.MAX_IMAGE_PIXELS = max(limit, MAX_CACHED_IMAGE_PIXELS)
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def open_image(path: PathLike) -> Image.Image:
+    r"""
+    Image.open, allowing images of up to MAX_CACHED_IMAGE_PIXELS. Pixels are
+    only decoded when needed, so the limit needn't be held any longer.
+    """
+    with allow_large_images():
+        return Image.open(path)
+
+
+class ImageProbe(NamedTuple):
+    width: int
+    height: int
+    mode: str
+    format: Optional[str]
+    orientation: int
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    @property
+    def servable_as_is(self) -> bool:
+        r"""
+        Whether the file can be served as the texture byte for byte. An EXIF
+        rotation would make browsers display the image differently to how the
+        landmarks are placed, so those are re-encoded without it.
+        """
+        return (
+            self.format == "JPEG"
+            and self.mode in ("RGB", "L")
+            and self.orientation == 1
+        )
+
+    @property
+    def decodable(self) -> bool:
+        return self.mode in DECODABLE_MODES
+
+
+def probe_image(path: PathLike) -> ImageProbe:
+    r"""
+    Read the dimensions, mode and orientation of an image from its header
+    without decoding any pixels.
+    """
+    with open_image(path) as ip:
+        orientation = ip.getexif().get(EXIF_ORIENTATION, 1)
+        return ImageProbe(ip.width, ip.height, ip.mode, ip.format, orientation)
+
+
+class UnknownImageVariant(ValueError):
+    def __init__(self, variant: str) -> None:
+        super().__init__(
+            f"Unknown image variant '{variant}' - must be one of "
+            f"{', '.join(IMAGE_VARIANTS)}"
+        )
+
+
+class ImageVariant(NamedTuple):
+    name: str  # also the suffix of the cached files
+    mimetype: str
+    # passed to PIL when saving textures and thumbnails respectively
+    texture_options: Dict[str, Any]
+    thumbnail_options: Dict[str, Any]
+    # the PIL plugin that provides the format, if it isn't built in
+    plugin: Optional[str] = None
+
+
+# In order of preference - of the variants a client accepts, the first that
+# has been cached is served
+IMAGE_VARIANTS: Dict[str, ImageVariant] = {
+    v.name: v
+    for v in (
+        ImageVariant(
+            "avif",
+            "image/avif",
+            {"quality": 60, "speed": 8},
+            {"quality": 30, "speed": 8},
+            plugin="pillow_avif",
+        ),
+        ImageVariant("webp", "image/webp", {"quality": 80}, {"quality": 40}),
+    )
+}
+
+
+def get_image_variant(name: str) -> ImageVariant:
+    try:
+        variant = IMAGE_VARIANTS[name]
+    except KeyError:
+        raise UnknownImageVariant(name)
+    if variant.plugin is not None and not features.check(variant.name):
+        # e.g. AVIF is only built into recent Pillows
+        __import__(variant.plugin)
+    return variant
+
+
+def variant_file(cache_file: str, variant: str) -> str:
+    r"""
+    The name of a variant of a cached image, e.g. texture.webp for
+    texture.jpg.
+    """
+    return f"{Path(cache_file).stem}.{variant}"
+
+
+def save_image_variant(
+    ip: Image.Image, path: Path, variant: ImageVariant, thumbnail: bool = False
+) -> None:
+    options = variant.thumbnail_options if thumbnail else variant.texture_options
+    ip.save(path, format=variant.name.upper(), **options)
+
+
+def accepted_variants(accept: Optional[str]) -> List[str]:
+    r"""
+    The image variants an Accept header explicitly accepts, in our order of
+    preference. Wildcards are not enough, as browsers send them for formats
+    they can't decode.
+    """
+    if not accept:
+        return []
+    accepted = set()
+    for item in accept.split(","):
+        mimetype, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(mimetype.lower())
+    return [v.name for v in IMAGE_VARIANTS.values() if v.mimetype in accepted]
@@ -0,0 +1,167 @@
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from landmarkerio import INDEX_FILENAME, MANIFEST_FILENAME, CacheFile
+from landmarkerio.discovery import DEFAULT_DISCOVERY_THREADS
+from landmarkerio.types import PathLike
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    asset_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    files TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER
+)
+"""
+
+
+class IndexedAsset(NamedTuple):
+    asset_id: str
+    kind: str  # 'image' or 'mesh'
+    files: List[str]
+    size: int
+    # the dimensions of the image (or texture), if the asset has one
+    width: Optional[int]
+    height: Optional[int]
+
+
+def index_path(cache_dir: PathLike) -> Path:
+    return Path(cache_dir) / INDEX_FILENAME
+
+
+def describe_cached_asset(cache_dir: PathLike, asset_id: str) -> IndexedAsset:
+    asset_cache_dir = Path(cache_dir) / asset_id
+    files, size = [], 0
+    with os.scandir(asset_cache_dir) as it:
+        for entry in it:
+            if entry.is_file():
+                files.append(entry.name)
+                size += entry.stat().st_size
+    files.sort()
+    kind = "image"
+    if any(f.startswith(CacheFile.mesh_raw) for f in files):
+        kind = "mesh"
+    width = height = None
+    if CacheFile.image in files:
+        with (asset_cache_dir / CacheFile.image).open("rt") as f:
+            image = json.load(f)
+        width, height = image["width"], image["height"]
+    return IndexedAsset(asset_id, kind, files, size, width, height)
+
+
+def sync_index(
+    cache_dir: PathLike, asset_ids: Iterable[str], refreshed: Iterable[str] = ()
+) -> None:
+    r"""
+    Bring the index of a cache directory in line with the assets cached in
+    it. Assets that are not yet indexed (or that are in ``refreshed``, as
+    they have just been recached) are described from their cache directory,
+    and any that are no longer cached are dropped.
+    """
+    path = index_path(cache_dir)
+    asset_ids = set(asset_ids)
+    with closing(sqlite3.connect(str(path))) as conn:
+        with conn:
+            conn.execute(INDEX_SCHEMA)
+            indexed = {r[0] for r in conn.execute("SELECT asset_id FROM assets")}
+            to_describe = sorted((asset_ids - indexed) | (set(refreshed) & asset_ids))
+            removed = indexed - asset_ids
+
+            def describe(asset_id: str) -> Optional[IndexedAsset]:
+                try:
+                    return describe_cached_asset(cache_dir, asset_id)
+                except OSError as e:
+                    logger.warning("Unable to index {} - {}", asset_id, e)
+                    return None
+
+            # on a fresh index this is a stat of every cached file, so it is
+            # done in parallel like discovery
+            with ThreadPoolExecutor(DEFAULT_DISCOVERY_THREADS) as executor:
+                described = [a for a in executor.map(describe, to_describe) if a]
+            conn.executemany(
+                "DELETE FROM assets WHERE asset_id = ?", ((a,) for a in removed)
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?)",
+                (a._replace(files=json.dumps(a.files)) for a in described),
+            )
+    # touch, so that the index is never older than the manifest it reflects
+    os.utime(path)
+    logger.debug(
+        "index:     {} assets ({} updated, {} removed)",
+        len(asset_ids),
+        len(described),
+        len(removed),
+    )
+
+
+def invalidate_index(cache_dir: PathLike) -> None:
+    try:
+        index_path(cache_dir).unlink()
+        logger.debug("index:     removed, as it no longer reflects the cache")
+    except FileNotFoundError:
+        pass
+
+
+class CacheIndex:
+    r"""
+    Read-only view of the SQLite index that ``lmiocache`` keeps of a cache
+    directory, so that servers can list the cached assets without having to
+    walk the whole cache on every start.
+    """
+
+    def __init__(self, path: PathLike) -> None:
+        self.path = Path(os.path.abspath(path))
+
+    @classmethod
+    def open(cls, cache_dir: PathLike) -> Optional["CacheIndex"]:
+        r"""
+        The index of cache_dir, or None if there isn't one that is up to date
+        (e.g. if assets have since been cached by a lazy server).
+        """
+        path = index_path(cache_dir)
+        try:
+            index_mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        try:
+            manifest_mtime = os.stat(Path(cache_dir) / MANIFEST_FILENAME).st_mtime_ns
+        except FileNotFoundError:
+            manifest_mtime = 0
+        if index_mtime < manifest_mtime:
+            logger.debug("index:     ignored, as the cache has changed since")
+            return None
+        return cls(path)
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        uri = f"{self.path.as_uri()}?mode=ro"
+        with closing(sqlite3.connect(uri, uri=True)) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def asset_ids(self) -> List[str]:
+        return [r[0] for r in self._query("SELECT asset_id FROM assets ORDER BY 1")]
+
+    def image_asset_ids(self) -> List[str]:
+        # in mesh mode only textured meshes have images
+        sql = "SELECT asset_id FROM assets WHERE width IS NOT NULL ORDER BY 1"
+        return [r[0] for r in self._query(sql)]
+
+    def mesh_asset_ids(self) -> List[str]:
+        sql = "SELECT asset_id FROM assets WHERE kind = 'mesh' ORDER BY 1"
+        return [r[0] for r in self._query(sql)]
+
+    def asset(self, asset_id: str) -> Optional[IndexedAsset]:
+        rows = self._query("SELECT * FROM assets WHERE asset_id = ?", (asset_id,))
+        if not rows:
+            return None
+        asset_id, kind, files, size, width, height = rows[0]
+        return IndexedAsset(asset_id, kind, json.loads(files), size, width, height)
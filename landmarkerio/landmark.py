@@ -2,15 +2,58 @@ import abc
 import json
 import os
 import os.path as p
-from collections import defaultdict
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence, cast
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
 from loguru import logger
 
-from landmarkerio import FileExt, LM_DIRNAME
+from landmarkerio import FileExt, LM_DIRNAME, dirs_in_dir
+from landmarkerio.discovery import DEFAULT_DISCOVERY_THREADS
 from landmarkerio.types import PathLike
 
+LANDMARK_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS landmarks (
+    asset_id TEXT NOT NULL,
+    lm_id TEXT NOT NULL,
+    lm_json TEXT NOT NULL,
+    PRIMARY KEY (asset_id, lm_id)
+);
+CREATE TABLE IF NOT EXISTS revision (revision INTEGER NOT NULL);
+"""
+# How long a writer waits for another (e.g. in another server process) to
+# commit before giving up
+LANDMARK_DB_TIMEOUT = 30.0
+# How long a server process trusts the revision of the landmark database it
+# last read before checking for landmarks saved by other processes. Its own
+# saves are seen straight away.
+LANDMARK_DB_REVISION_TTL = 1.0
+# Keep well under SQLite's limit on the number of parameters of a query
+_MAX_QUERY_PARAMS = 500
+# How many landmarks are read and written at once when importing/exporting
+_TRANSFER_CHUNK_SIZE = 1000
+
+# (asset_id, lm_id)
+LandmarkKey = Tuple[str, str]
+
+
+class MissingLandmark(ValueError):
+    def __init__(self, asset_id: str, lm_id: str) -> None:
+        super().__init__(f"Cannot find {lm_id} landmarks for '{asset_id}'")
+
 
 class LandmarkAdapter(abc.ABC):
     @abc.abstractmethod
@@ -32,13 +75,112 @@ class LandmarkAdapter(abc.ABC):
     def save_landmark(self, asset_id: str, lm_id: str, lm_json: Dict[str, Any]) -> None:
         pass
 
+    def load_landmarks(
+        self, keys: Sequence[LandmarkKey]
+    ) -> List[Optional[Dict[str, Any]]]:
+        r"""
+        Load the landmarks of many (asset_id, lm_id) pairs at once, with None
+        for those that don't exist.
+        """
+        lms: List[Optional[Dict[str, Any]]] = []
+        for asset_id, lm_id in keys:
+            try:
+                lms.append(self.load_landmark(asset_id, lm_id))
+            except (OSError, LookupError, MissingLandmark):
+                lms.append(None)
+        return lms
+
+    def revision(self) -> Optional[int]:
+        r"""
+        A number that changes whenever the landmark ids of any asset do, so
+        that they can be serialised once per revision. None if the adapter
+        can't tell, in which case they are serialised on every request.
+        """
+        return None
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        r"""
+        Called when assets are added to (with the paths of their source
+        files) or removed from a running server.
+        """
+        pass
+
 
 class FileLmAdapter(LandmarkAdapter):
     r"""
     Concrete implementation of LmAdapter that serves landmarks from the
     local filesystem.
+
+    Which landmarks each asset has is indexed in memory when the adapter is
+    created, and kept up to date as landmarks are saved and assets added, so
+    that listing them never touches the disk.
     """
 
+    _index: Dict[str, Tuple[str, ...]]
+    _revision = 0
+
+    def _build_index(self) -> None:
+        self._index = {}
+        # landmarks are saved on the server's threads
+        self._index_lock = threading.Lock()
+        self._rescan(self._indexed_asset_ids())
+
+    def __getstate__(self):
+        # handed to the server's workers, which start with a lock of their own
+        state = self.__dict__.copy()
+        del state["_index_lock"]
+        return state
+
+    def __setstate__(self, state) -> None:
+        self.__dict__.update(state)
+        self._index_lock = threading.Lock()
+
+    def _rescan(self, asset_ids: Iterable[str]) -> None:
+        asset_ids = list(asset_ids)
+        if not asset_ids:
+            return
+        # like discovery, this is bound by the latency of the filesystem
+        with ThreadPoolExecutor(DEFAULT_DISCOVERY_THREADS) as executor:
+            scanned = list(executor.map(self._scan_landmark_ids, asset_ids))
+        changed = False
+        with self._index_lock:
+            for asset_id, lm_ids in zip(asset_ids, scanned):
+                if lm_ids:
+                    changed |= self._index.get(asset_id) != lm_ids
+                    self._index[asset_id] = lm_ids
+                else:
+                    changed |= self._index.pop(asset_id, None) is not None
+            if changed:
+                self._revision += 1
+
+    def _forget(self, asset_ids: Iterable[str]) -> None:
+        with self._index_lock:
+            removed = [a for a in asset_ids if self._index.pop(a, None) is not None]
+            if removed:
+                self._revision += 1
+
+    @abc.abstractmethod
+    def _indexed_asset_ids(self) -> Iterable[str]:
+        # the assets that may have landmarks when the adapter is created
+        pass
+
+    @abc.abstractmethod
+    def _scan_landmark_ids(self, asset_id: str) -> Tuple[str, ...]:
+        # the landmark ids of an asset found on disk
+        pass
+
+    def revision(self) -> Optional[int]:
+        return self._revision
+
+    def asset_id_to_lm_id(self) -> Dict[str, Sequence[str]]:
+        r"""
+        Return a dict mapping asset ID's to landmark IDs that are
+        present on this server for that asset.
+        """
+        # a copy, as the index may change while the listing is serialised
+        with self._index_lock:
+            return dict(self._index)
+
     def load_landmark(self, asset_id: str, lm_id: str) -> Dict[str, Any]:
         fp = self.landmark_path(asset_id, lm_id)
         if not fp.exists():
@@ -54,6 +196,14 @@ class FileLmAdapter(LandmarkAdapter):
         fp = self.landmark_path(asset_id, lm_id)
         with fp.open("w") as f:
             json.dump(lm_json, f, sort_keys=True, indent=4, separators=(",", ": "))
+        self._indexed(asset_id, lm_id)
+
+    def _indexed(self, asset_id: str, lm_id: str) -> None:
+        with self._index_lock:
+            lm_ids = self._index.get(asset_id, ())
+            if lm_id not in lm_ids:
+                self._index[asset_id] = tuple(sorted(lm_ids + (lm_id,)))
+                self._revision += 1
 
     @abc.abstractmethod
     def landmark_path(self, asset_id: str, lm_id: str) -> Path:
@@ -67,41 +217,41 @@ class SeparateDirFileLmAdapter(FileLmAdapter):
             # By default place the landmarks in the cwd
             lm_dir = Path(os.getcwd()) / LM_DIRNAME
         self.lm_dir = Path(p.abspath(p.expanduser(lm_dir)))
-        if self.lm_dir.exists():
+        if not self.lm_dir.exists():
             logger.warning("The landmark dir does not exist - creating...")
             self.lm_dir.mkdir(parents=True, exist_ok=True)
-        logger.debug("landmarks: {}", self.lm_dir)
+        self._build_index()
+        logger.debug(
+            "landmarks: {} ({} assets with landmarks)", self.lm_dir, len(self._index)
+        )
 
     def landmark_path(self, asset_id: str, lm_id: str) -> Path:
         # where a landmark should exist
         return self.lm_dir / asset_id / (lm_id + FileExt.lm)
 
     def landmark_ids(self, asset_id: str) -> Sequence[str]:
-        lm_files = self._landmark_paths(asset_id=asset_id)
-        return [f.stem for f in lm_files]
+        return list(self._index.get(asset_id, ()))
 
-    def asset_id_to_lm_id(self) -> Dict[str, Sequence[str]]:
-        r"""
-        Return a dict mapping asset ID's to landmark IDs that are
-        present on this server for that asset.
-        """
-        lm_files = self._landmark_paths()
-        mapping: Dict[str, List[str]] = defaultdict(list)
-        for lm_path in lm_files:
-            lm_id = lm_path.stem
-            asset_id = lm_path.parent.stem
-            mapping[asset_id].append(lm_id)
-        return cast(Dict[str, Sequence[str]], mapping)
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        # the landmarks of removed assets are left on disk, and so still listed
+        self._rescan(added)
+
+    def _indexed_asset_ids(self) -> Iterable[str]:
+        return [d.name for d in dirs_in_dir(self.lm_dir)]
 
-    def _landmark_paths(self, asset_id: Optional[str] = None) -> Sequence[Path]:
-        if asset_id is None:
-            asset_id = "*"
-        asset_path = self.lm_dir / asset_id
-        return [
-            f
-            for f in asset_path.glob("*")
-            if f.exists() and f.suffixes[-1] == FileExt.lm
-        ]
+    def _scan_landmark_ids(self, asset_id: str) -> Tuple[str, ...]:
+        try:
+            entries = os.scandir(self.lm_dir / asset_id)
+        except OSError:
+            return ()
+        with entries:
+            return tuple(
+                sorted(
+                    e.name[: -len(FileExt.lm)]
+                    for e in entries
+                    if e.name.endswith(FileExt.lm) and e.is_file()
+                )
+            )
 
     def save_landmark(self, asset_id: str, lm_id: str, lm_json: Dict[str, Any]) -> None:
         r"""
@@ -116,9 +266,10 @@ class SeparateDirFileLmAdapter(FileLmAdapter):
 class InplaceFileLmAdapter(FileLmAdapter):
     def __init__(self, asset_ids_to_paths: Dict[str, Path]) -> None:
         self.ids_to_paths = asset_ids_to_paths
+        self._build_index()
         logger.debug(
             "Landmarks served inplace - found {} asset with landmarks",
-            len(self.asset_id_to_lm_id()),
+            len(self._index),
         )
 
     def landmark_ids(self, asset_id: str) -> Sequence[str]:
@@ -128,16 +279,27 @@ class InplaceFileLmAdapter(FileLmAdapter):
         else:
             raise ValueError(f"Unable to find landmark IDs for '{asset_id}'")
 
-    def asset_id_to_lm_id(self) -> Dict[str, Sequence[str]]:
-        r"""
-        Return a dict mapping asset ID's to landmark IDs that are
-        present on this server for that asset.
-        """
-        return {
-            aid: ["inplace"]
-            for aid in self.ids_to_paths
-            if self._lm_path_for_asset_id(aid).exists()
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        removed = set(removed)
+        ids_to_paths = {
+            a: path for a, path in self.ids_to_paths.items() if a not in removed
         }
+        ids_to_paths.update(added)
+        self.ids_to_paths = ids_to_paths
+        self._forget(removed)
+        self._rescan(added)
+
+    def _indexed_asset_ids(self) -> Iterable[str]:
+        return self.ids_to_paths
+
+    def _scan_landmark_ids(self, asset_id: str) -> Tuple[str, ...]:
+        if self._lm_path_for_asset_id(asset_id).is_file():
+            return ("inplace",)
+        return ()
+
+    def _indexed(self, asset_id: str, lm_id: str) -> None:
+        # whatever the lm_id, the one .ljson file is written
+        super()._indexed(asset_id, "inplace")
 
     def landmark_path(self, asset_id: str, lm_id: str) -> Path:
         # note the lm_id is ignored. We just always return the .ljson file.
@@ -146,3 +308,192 @@ class InplaceFileLmAdapter(FileLmAdapter):
     def _lm_path_for_asset_id(self, asset_id: str) -> Path:
         asset_path = Path(self.ids_to_paths[asset_id])
         return asset_path.with_suffix(FileExt.lm)
+
+
+class SQLiteLmAdapter(LandmarkAdapter):
+    r"""
+    Serves landmarks from an SQLite database, which is much quicker to list,
+    back up and copy than a file per landmark. The database is in WAL mode,
+    so that any number of server processes can read it while one writes.
+    """
+
+    def __init__(self, db_path: PathLike) -> None:
+        self.db_path = Path(p.abspath(p.expanduser(db_path)))
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        # the last revision read, and when
+        self._revision: Optional[Tuple[int, float]] = None
+        self._saves = 0
+        conn = self._conn()
+        # WAL mode is persistent, so this only has to be done once
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.executescript(LANDMARK_DB_SCHEMA)
+            conn.execute(
+                "INSERT INTO revision SELECT 0 "
+                "WHERE NOT EXISTS (SELECT 1 FROM revision)"
+            )
+        logger.debug("landmarks: {}", self.db_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        # a connection per thread (adapters are called on a pool of threads)
+        # and per process, as connections can't be shared with forked workers
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = sqlite3.connect(str(self.db_path), timeout=LANDMARK_DB_TIMEOUT)
+            # in WAL mode a commit is still atomic without syncing each one
+            local.conn.execute("PRAGMA synchronous=NORMAL")
+            local.pid = os.getpid()
+        return local.conn
+
+    def asset_id_to_lm_id(self) -> Dict[str, Sequence[str]]:
+        r"""
+        Return a dict mapping asset ID's to landmark IDs that are
+        present on this server for that asset.
+        """
+        mapping: Dict[str, List[str]] = {}
+        rows = self._conn().execute(
+            "SELECT asset_id, lm_id FROM landmarks ORDER BY asset_id, lm_id"
+        )
+        for asset_id, lm_id in rows:
+            mapping.setdefault(asset_id, []).append(lm_id)
+        return cast(Dict[str, Sequence[str]], mapping)
+
+    def landmark_ids(self, asset_id: str) -> Sequence[str]:
+        rows = self._conn().execute(
+            "SELECT lm_id FROM landmarks WHERE asset_id = ? ORDER BY lm_id",
+            (asset_id,),
+        )
+        return [r[0] for r in rows]
+
+    def load_landmark(self, asset_id: str, lm_id: str) -> Dict[str, Any]:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT lm_json FROM landmarks WHERE asset_id = ? AND lm_id = ?",
+                (asset_id, lm_id),
+            )
+            .fetchone()
+        )
+        if row is None:
+            raise MissingLandmark(asset_id, lm_id)
+        return json.loads(row[0])
+
+    def load_landmarks(
+        self, keys: Sequence[LandmarkKey]
+    ) -> List[Optional[Dict[str, Any]]]:
+        # all the landmarks of the assets asked for, a chunk at a time
+        asset_ids = sorted({asset_id for asset_id, _ in keys})
+        found: Dict[LandmarkKey, str] = {}
+        for i in range(0, len(asset_ids), _MAX_QUERY_PARAMS):
+            chunk = asset_ids[i : i + _MAX_QUERY_PARAMS]
+            rows = self._conn().execute(
+                f"SELECT asset_id, lm_id, lm_json FROM landmarks "
+                f"WHERE asset_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update(((a, l), lm_json) for a, l, lm_json in rows)
+        lm_jsons = (found.get((asset_id, lm_id)) for asset_id, lm_id in keys)
+        return [json.loads(j) if j is not None else None for j in lm_jsons]
+
+    def save_landmark(self, asset_id: str, lm_id: str, lm_json: Dict[str, Any]) -> None:
+        r"""
+        Persist a given landmark definition to the database.
+        """
+        self.save_landmarks([(asset_id, lm_id, lm_json)])
+
+    def save_landmarks(
+        self, landmarks: Iterable[Tuple[str, str, Dict[str, Any]]]
+    ) -> None:
+        r"""
+        Persist many (asset_id, lm_id, lm_json) landmarks in one transaction.
+        """
+        conn = self._conn()
+        added = False
+        with conn:
+            for asset_id, lm_id, lm_json in landmarks:
+                data = json.dumps(lm_json, sort_keys=True, separators=(",", ":"))
+                updated = conn.execute(
+                    "UPDATE landmarks SET lm_json = ? WHERE asset_id = ? AND lm_id = ?",
+                    (data, asset_id, lm_id),
+                ).rowcount
+                if not updated:
+                    conn.execute(
+                        "INSERT INTO landmarks VALUES (?, ?, ?)",
+                        (asset_id, lm_id, data),
+                    )
+                    added = True
+            if added:
+                # only new landmarks change the listing
+                conn.execute("UPDATE revision SET revision = revision + 1")
+        if added:
+            self._saves += 1
+            self._revision = None
+
+    def revision(self) -> Optional[int]:
+        # shared by all server processes, so it moves with their saves too
+        cached = self._revision
+        now = time.monotonic()
+        if cached is not None and now - cached[1] < LANDMARK_DB_REVISION_TTL:
+            return cached[0]
+        saves = self._saves
+        revision = self._conn().execute("SELECT revision FROM revision").fetchone()[0]
+        if saves == self._saves:
+            # not read before a save made while reading
+            self._revision = (revision, now)
+        return revision
+
+
+def _landmark_keys(adapter: LandmarkAdapter) -> List[LandmarkKey]:
+    return [
+        (asset_id, lm_id)
+        for asset_id, lm_ids in adapter.asset_id_to_lm_id().items()
+        for lm_id in lm_ids
+    ]
+
+
+def import_landmark_dir(lm_dir: PathLike, db_path: PathLike) -> int:
+    r"""
+    Copy the landmarks in a directory laid out as by SeparateDirFileLmAdapter
+    into an SQLite landmark database, replacing any already there. Returns
+    how many landmarks were imported.
+    """
+    lm_dir = Path(lm_dir)
+    if not lm_dir.is_dir():
+        raise FileNotFoundError(lm_dir)
+    files = SeparateDirFileLmAdapter(lm_dir)
+    db = SQLiteLmAdapter(db_path)
+    keys = _landmark_keys(files)
+
+    def load(key: LandmarkKey) -> Tuple[str, str, Dict[str, Any]]:
+        return key[0], key[1], files.load_landmark(*key)
+
+    # reading a file per landmark is bound by the latency of the filesystem
+    with ThreadPoolExecutor(DEFAULT_DISCOVERY_THREADS) as executor:
+        for i in range(0, len(keys), _TRANSFER_CHUNK_SIZE):
+            chunk = keys[i : i + _TRANSFER_CHUNK_SIZE]
+            db.save_landmarks(executor.map(load, chunk))
+    logger.info("imported {} landmarks from {} into {}", len(keys), lm_dir, db.db_path)
+    return len(keys)
+
+
+def export_landmark_dir(db_path: PathLike, lm_dir: PathLike) -> int:
+    r"""
+    Write the landmarks of an SQLite landmark database out to a directory,
+    laid out as by SeparateDirFileLmAdapter. Returns how many landmarks were
+    exported.
+    """
+    if not Path(db_path).is_file():
+        raise FileNotFoundError(db_path)
+    db = SQLiteLmAdapter(db_path)
+    files = SeparateDirFileLmAdapter(lm_dir)
+    keys = _landmark_keys(db)
+    for i in range(0, len(keys), _TRANSFER_CHUNK_SIZE):
+        chunk = keys[i : i + _TRANSFER_CHUNK_SIZE]
+        for (asset_id, lm_id), lm_json in zip(chunk, db.load_landmarks(chunk)):
+            if lm_json is not None:
+                files.save_landmark(asset_id, lm_id, lm_json)
+    logger.info(
+        "exported {} landmarks from {} to {}", len(keys), db.db_path, files.lm_dir
+    )
+    return len(keys)
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from loguru import logger
+
+from landmarkerio.manifest import CacheManifest, ManifestEntry, source_entry
+from landmarkerio.types import PathLike
+
+CacheF = Callable[[PathLike, str], None]
+CacherF = Callable[[CacheF, Sequence[Tuple[PathLike, str]]], Iterable[str]]
+# called with each asset that has been cached (and the path of its source
+# file), as the adapters' update_assets are
+CachedListener = Callable[[Mapping[str, Path], Sequence[str]], None]
+
+# How often the manifest is saved while assets are being cached on demand
+MANIFEST_SAVE_INTERVAL = 30.0
+
+
+def _cache_asset(
+    cache: CacheF, path: PathLike, asset_id: str, content_hash: bool
+) -> ManifestEntry:
+    # runs in a worker - stat the source first so that a change made while
+    # it is being cached is picked up next time
+    entry = source_entry(path, content_hash=content_hash)
+    cache(path, asset_id)
+    return entry
+
+
+class LazyCacher:
+    r"""
+    Caches assets on demand while the server is running, instead of all of
+    them up front.
+
+    Pass :meth:`defer` as the ``cacher_f`` of ``cache_assets`` to have it
+    plan the cache (adopting whatever is already cached) without caching
+    anything. Within the server, :meth:`ensure` then caches an asset in a
+    pool of worker processes the first time it is requested, with concurrent
+    requests for the same asset sharing the one job, and :meth:`warm` works
+    through the rest in the background.
+
+    Alternatively, :meth:`capture` wraps a cacher that caches every asset up
+    front. Either way, more assets can be added (or removed) while the server
+    is running.
+    """
+
+    def __init__(
+        self,
+        cache_dir: PathLike,
+        n_jobs: int = -1,
+        content_hash: bool = False,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.n_workers = (os.cpu_count() or 1) if n_jobs < 0 else n_jobs
+        self.content_hash = content_hash
+        self.asset_ids: Sequence[str] = []
+        # bumped whenever asset_ids changes
+        self.revision = 0
+        self._cache: Optional[CacheF] = None
+        self._pending: Dict[str, PathLike] = {}
+        self._failed: Dict[str, str] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._requeued: Set[str] = set()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manifest: Optional[CacheManifest] = None
+        self._last_save = 0.0
+        self._warming = False
+        self._listeners: List[CachedListener] = []
+
+    def __getstate__(self):
+        # handed to the server process before anything has been started
+        state = self.__dict__.copy()
+        state.update(
+            _inflight={},
+            _requeued=set(),
+            _executor=None,
+            _manifest=None,
+            _listeners=[],
+        )
+        return state
+
+    def defer(
+        self, cache: CacheF, path_asset_id: Sequence[Tuple[PathLike, str]]
+    ) -> Iterable[str]:
+        self._cache = cache
+        self._pending = {asset_id: path for path, asset_id in path_asset_id}
+        logger.info("{} assets will be cached on demand", len(self._pending))
+        return ()
+
+    def capture(self, cacher_f: CacherF) -> CacherF:
+        def cacher(
+            cache: CacheF, path_asset_id: Sequence[Tuple[PathLike, str]]
+        ) -> Iterable[str]:
+            self._cache = cache
+            return cacher_f(cache, path_asset_id)
+
+        return cacher
+
+    def add(self, asset_id_to_path: Mapping[str, PathLike]) -> None:
+        r"""
+        Add new (or changed) assets, which will be cached on demand.
+        """
+        for asset_id, path in asset_id_to_path.items():
+            self._failed.pop(asset_id, None)
+            self._pending[asset_id] = path
+            if asset_id in self._inflight:
+                # changed while being cached - cache it again afterwards
+                self._requeued.add(asset_id)
+        new_ids = set(asset_id_to_path) - set(self.asset_ids)
+        if new_ids:
+            # swapped rather than updated in place, so readers never see a
+            # partially updated list
+            self.asset_ids = sorted(set(self.asset_ids) | new_ids)
+            self.revision += 1
+
+    def remove(self, asset_ids: Iterable[str]) -> None:
+        removed = set(asset_ids)
+        for asset_id in removed:
+            self._pending.pop(asset_id, None)
+            self._failed.pop(asset_id, None)
+        if removed & set(self.asset_ids):
+            self.asset_ids = [a for a in self.asset_ids if a not in removed]
+            self.revision += 1
+
+    def on_cached(self, listener: CachedListener) -> None:
+        r"""
+        Have listener told about each asset once it has been cached.
+        """
+        self._listeners.append(listener)
+
+    def is_pending(self, asset_id: str) -> bool:
+        return asset_id in self._pending
+
+    def is_failed(self, asset_id: str) -> bool:
+        return asset_id in self._failed
+
+    async def ensure(self, asset_id: str) -> None:
+        r"""
+        Cache asset_id if it has not been already, waiting for it to finish.
+        Raises FileNotFoundError if the asset could not be cached.
+        """
+        if asset_id in self._failed:
+            raise FileNotFoundError(f"Unable to cache {asset_id}")
+        # still pending afterwards if it changed while it was being cached
+        while asset_id in self._pending:
+            future = self._inflight.get(asset_id)
+            if future is None:
+                future = asyncio.ensure_future(self._cache_asset(asset_id))
+                self._inflight[asset_id] = future
+            # shielded so a client going away doesn't cancel it for everyone
+            await asyncio.shield(future)
+            if asset_id in self._failed:
+                raise FileNotFoundError(f"Unable to cache {asset_id}")
+
+    async def _cache_asset(self, asset_id: str) -> None:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.n_workers)
+        executor = self._executor
+        loop = asyncio.get_running_loop()
+        path = self._pending[asset_id]
+        start = time.time()
+        try:
+            entry = await loop.run_in_executor(
+                executor,
+                _cache_asset,
+                self._cache,
+                path,
+                asset_id,
+                self.content_hash,
+            )
+        except Exception as e:
+            logger.error("failed to cache {} - {}: {}", asset_id, type(e).__name__, e)
+            self._failed[asset_id] = f"{type(e).__name__}: {e}"
+            if isinstance(e, BrokenProcessPool) and self._executor is executor:
+                # a worker died - start a fresh pool for the next asset
+                executor.shutdown(wait=False)
+                self._executor = None
+        else:
+            logger.debug("cached {} in {:.2f}s", asset_id, time.time() - start)
+            self._record(asset_id, entry)
+            for listener in self._listeners:
+                listener({asset_id: Path(path)}, [])
+        finally:
+            self._inflight.pop(asset_id, None)
+            if asset_id in self._requeued:
+                self._requeued.discard(asset_id)
+                self._failed.pop(asset_id, None)
+            else:
+                self._pending.pop(asset_id, None)
+
+    def _record(self, asset_id: str, entry: ManifestEntry) -> None:
+        if self._manifest is None:
+            self._manifest = CacheManifest(self.cache_dir)
+        self._manifest.record(asset_id, entry)
+        if time.time() - self._last_save > MANIFEST_SAVE_INTERVAL:
+            self._manifest.save()
+            self._last_save = time.time()
+
+    async def warm(self, asset_ids: Iterable[str]) -> None:
+        r"""
+        Cache every pending asset in the order given (then any left over),
+        keeping no more jobs queued than there are workers so that assets
+        requested by clients jump ahead of the queue.
+        """
+        if self._warming:
+            return
+        self._warming = True
+        order: List[str] = list(dict.fromkeys(list(asset_ids) + sorted(self._pending)))
+        n_warming = sum(self.is_pending(a) for a in order)
+        if n_warming:
+            logger.info("warming the cache with {} assets", n_warming)
+        await self.cache_all(order)
+        if n_warming:
+            logger.info("all assets cached ({} failed)", len(self._failed))
+        self.save()
+
+    async def cache_all(self, asset_ids: Iterable[str]) -> None:
+        r"""
+        Cache each of the pending assets given, in order, without queueing
+        more jobs than there are workers.
+        """
+        slots = asyncio.Semaphore(self.n_workers)
+        tasks: Set[asyncio.Future] = set()
+
+        async def warm_one(asset_id: str) -> None:
+            try:
+                await self.ensure(asset_id)
+            except FileNotFoundError:
+                pass  # already logged
+            finally:
+                slots.release()
+
+        for asset_id in asset_ids:
+            if not self.is_pending(asset_id):
+                continue
+            await slots.acquire()
+            task = asyncio.ensure_future(warm_one(asset_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def save(self) -> None:
+        if self._manifest is not None:
+            self._manifest.save()
+            self._last_save = time.time()
+
+    def close(self) -> None:
+        for future in self._inflight.values():
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.save()
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, Mapping, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+
+class FileKind(object):
+    thumbnail = "thumbnail"
+    texture = "texture"
+    tile = "tile"
+    mesh = "mesh"
+
+
+# Budgets (in bytes) of each kind of file kept in memory by each server
+# process. Kinds are budgeted separately so that a few large meshes can't
+# evict every thumbnail.
+DEFAULT_MEMORY_BUDGETS = {
+    FileKind.thumbnail: 64 << 20,
+    FileKind.texture: 128 << 20,
+    FileKind.tile: 64 << 20,
+    FileKind.mesh: 256 << 20,
+}
+# No one file may take more than this fraction of the budget of its kind
+MAX_ENTRY_FRACTION = 8
+
+
+# (asset id, which of the asset's files)
+EntryKey = Tuple[str, Hashable]
+
+
+class ByteLRU:
+    r"""
+    A least-recently-used cache of the files of assets, bounded by their
+    total size rather than by how many there are.
+    """
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self.max_entry_size = budget // MAX_ENTRY_FRACTION
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries: "OrderedDict[EntryKey, Tuple[str, bytes]]" = OrderedDict()
+        self._asset_keys: Dict[str, Set[EntryKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: EntryKey, etag: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != etag:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def admits(self, size: int) -> bool:
+        return size <= self.max_entry_size
+
+    def put(self, key: EntryKey, etag: str, data: bytes) -> None:
+        if not self.admits(len(data)):
+            return
+        self.discard(key)
+        self._entries[key] = (etag, data)
+        self._asset_keys.setdefault(key[0], set()).add(key)
+        self.size += len(data)
+        while self.size > self.budget:
+            self.discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def discard(self, key: EntryKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+            keys = self._asset_keys[key[0]]
+            keys.discard(key)
+            if not keys:
+                del self._asset_keys[key[0]]
+
+    def discard_asset(self, asset_id: str) -> None:
+        for key in list(self._asset_keys.get(asset_id, ())):
+            self.discard(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "size": self.size,
+            "budget": self.budget,
+        }
+
+
+class FileCacheSlot:
+    r"""
+    Where one file of an asset is kept in a :class:`FileCache`.
+    """
+
+    def __init__(self, lru: ByteLRU, key: EntryKey) -> None:
+        self.lru = lru
+        self.key = key
+
+    def get(self, etag: str) -> Optional[bytes]:
+        return self.lru.get(self.key, etag)
+
+    def admits(self, size: int) -> bool:
+        return self.lru.admits(size)
+
+    def put(self, etag: str, data: bytes) -> None:
+        self.lru.put(self.key, etag, data)
+
+
+class FileCache:
+    r"""
+    Keeps the most recently served files of each kind in memory.
+
+    Every entry is stored along with the ETag of the file it was read from and
+    is only served while that still matches, so a stale file is never served.
+    Assets that have been recached are dropped straight away (see
+    :meth:`update_assets`) so that their old files don't take up the budget.
+    """
+
+    def __init__(self, budgets: Optional[Mapping[str, int]] = None) -> None:
+        budgets = {**DEFAULT_MEMORY_BUDGETS, **(budgets or {})}
+        self.lrus = {kind: ByteLRU(budget) for kind, budget in budgets.items()}
+
+    def slot(self, kind: str, asset_id: str, key: Hashable) -> Optional[FileCacheSlot]:
+        r"""
+        The slot for a file of asset_id, or None if files of this kind aren't
+        kept in memory.
+        """
+        lru = self.lrus.get(kind)
+        if lru is None or lru.budget <= 0:
+            return None
+        return FileCacheSlot(lru, (asset_id, key))
+
+    def invalidate(self, asset_ids: Iterable[str]) -> None:
+        for asset_id in asset_ids:
+            for lru in self.lrus.values():
+                lru.discard_asset(asset_id)
+
+    def update_assets(self, added: Mapping[str, Path], removed: Sequence[str]) -> None:
+        # 'added' includes the assets that have been recached
+        self.invalidate(added)
+        self.invalidate(removed)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {kind: lru.stats() for kind, lru in self.lrus.items()}
+
+    def log_stats(self) -> None:
+        for kind, stats in self.stats().items():
+            logger.debug(
+                "memory cache: {} {} hits, {} misses, {} evictions "
+                "({} entries, {}/{} MiB)",
+                kind,
+                stats["hits"],
+                stats["misses"],
+                stats["evictions"],
+                stats["entries"],
+                stats["size"] >> 20,
+                stats["budget"] >> 20,
+            )
+
+
+def parse_memory_budget(arg: str) -> Tuple[str, int]:
+    r"""
+    Parse a 'kind=MiB' command line argument, e.g. 'mesh=512'.
+    """
+    kind, sep, mib = arg.partition("=")
+    if not sep or kind not in DEFAULT_MEMORY_BUDGETS:
+        kinds = ", ".join(DEFAULT_MEMORY_BUDGETS)
+        raise ValueError(f"expected KIND=MiB where KIND is one of {kinds}")
+    return kind, int(mib) << 20
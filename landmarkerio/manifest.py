@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+
+from loguru import logger
+
+from landmarkerio import MANIFEST_FILENAME, SHARD_MANIFEST_GLOB
+from landmarkerio.discovery import DEFAULT_DISCOVERY_THREADS
+from landmarkerio.shard import Shard
+from landmarkerio.types import PathLike
+
+# Bump whenever the layout or encoding of the files written into an asset's
+# cache directory changes, so that existing caches are transparently rebuilt.
+CACHE_FORMAT_VERSION = 4
+
+
+class ManifestEntry(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    sha1: Optional[str]
+    version: int
+
+
+class CachePlan(NamedTuple):
+    # asset ids that have to be (re)cached, mapped to the state of their
+    # source file at the time the plan was made
+    stale: Dict[str, ManifestEntry]
+    # asset ids in the manifest that are no longer backed by a source file
+    orphaned: Sequence[str]
+
+
+def file_sha1(path: PathLike, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_path(cache_dir: PathLike, shard: Optional[Shard] = None) -> Path:
+    if shard is None:
+        return Path(cache_dir) / MANIFEST_FILENAME
+    # each shard writes its own manifest so machines never contend for one file
+    name = SHARD_MANIFEST_GLOB.replace("*-of-*", f"{shard.index}-of-{shard.count}")
+    return Path(cache_dir) / name
+
+
+def source_entry(path: PathLike, content_hash: bool = False) -> ManifestEntry:
+    st = os.stat(path)
+    return ManifestEntry(
+        path=str(path),
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        sha1=file_sha1(path) if content_hash else None,
+        version=CACHE_FORMAT_VERSION,
+    )
+
+
+class CacheManifest:
+    r"""
+    Persisted record of which source file (and which version of it) each
+    asset in a cache directory was built from.
+
+    An entry is only ever recorded once an asset has been completely cached,
+    so an asset id without an entry is treated as missing or incomplete. The
+    options the cache was built with (e.g. the mesh codec) are stored too, so
+    that changing them rebuilds every asset.
+
+    When building one shard of a cache, only the assets in that shard are
+    tracked and they are saved to a manifest of the shard's own. The manifests
+    of every shard (and of unsharded builds) are merged on load, and an
+    unsharded build folds them all back into the one manifest.
+    """
+
+    def __init__(self, cache_dir: PathLike, shard: Optional[Shard] = None) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.shard = shard
+        self.path = manifest_path(cache_dir, shard)
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.options: Dict[str, Any] = {}
+        self.shard_paths = sorted(self.cache_dir.glob(SHARD_MANIFEST_GLOB))
+        paths = [p for p in [self.cache_dir / MANIFEST_FILENAME] if p.is_file()]
+        paths += self.shard_paths
+        self.exists = bool(paths)
+        for path in paths:
+            with path.open("rt") as f:
+                data = json.load(f)
+            self.entries.update(
+                (asset_id, ManifestEntry(**entry))
+                for asset_id, entry in data["assets"].items()
+                if shard is None or asset_id in shard
+            )
+            if path == self.path or not self.options:
+                self.options = data.get("options", {})
+        if self.exists:
+            logger.debug("manifest:  {} cached assets", len(self.entries))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, asset_id: str) -> bool:
+        return asset_id in self.entries
+
+    def record(self, asset_id: str, entry: ManifestEntry) -> None:
+        self.entries[asset_id] = entry
+
+    def discard(self, asset_id: str) -> None:
+        self.entries.pop(asset_id, None)
+
+    def save(self) -> None:
+        data = {
+            "version": CACHE_FORMAT_VERSION,
+            "options": self.options,
+            "assets": {a: e._asdict() for a, e in sorted(self.entries.items())},
+        }
+        # write then rename so that a crash never leaves a truncated manifest
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("wt") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        if self.shard is None:
+            # the shards' entries have all been merged into this manifest
+            for path in self.shard_paths:
+                path.unlink()
+            self.shard_paths = []
+
+    def plan(
+        self,
+        asset_id_to_paths: Mapping[str, Path],
+        required_files: Iterable[str],
+        content_hash: bool = False,
+        options: Optional[Mapping[str, Any]] = None,
+    ) -> CachePlan:
+        r"""
+        Compare the manifest against the current source assets and work out
+        which assets are new, changed or incompletely cached.
+
+        Caches built before the manifest existed are adopted as-is for any
+        asset directory that contains all of the ``required_files``.
+        """
+        required_files = list(required_files)
+        options = dict(options or {})
+        rebuild_all = self.exists and options != self.options
+        if rebuild_all:
+            logger.warning(
+                "cache options changed ({} -> {}) - recaching all assets",
+                self.options,
+                options,
+            )
+        self.options = options
+        cached_dirs = set(os.listdir(self.cache_dir))
+        stale: Dict[str, ManifestEntry] = {}
+        n_adopted = n_changed = 0
+
+        # stat in parallel, as each stat is a round trip on network filesystems
+        with ThreadPoolExecutor(DEFAULT_DISCOVERY_THREADS) as executor:
+            currents = executor.map(source_entry, asset_id_to_paths.values())
+        for asset_id, current in zip(asset_id_to_paths, currents):
+            entry = self.entries.get(asset_id)
+
+            if entry is None:
+                if not self.exists and self._is_complete(asset_id, required_files):
+                    self.record(asset_id, with_content_hash(current, content_hash))
+                    n_adopted += 1
+                else:
+                    stale[asset_id] = current
+            elif (
+                rebuild_all
+                or asset_id not in cached_dirs
+                or entry.version != CACHE_FORMAT_VERSION
+            ):
+                stale[asset_id] = current
+            elif (entry.path, entry.size, entry.mtime_ns) != (
+                current.path,
+                current.size,
+                current.mtime_ns,
+            ):
+                current = with_content_hash(current, content_hash)
+                if entry.sha1 is not None and entry.sha1 == current.sha1:
+                    # touched but identical - no need to rebuild
+                    self.record(asset_id, current)
+                else:
+                    stale[asset_id] = current
+                    n_changed += 1
+
+        orphaned = sorted(set(self.entries) - set(asset_id_to_paths))
+        if n_adopted:
+            logger.debug("adopted {} assets from an existing cache", n_adopted)
+        if n_changed:
+            logger.debug("{} cached assets have changed on disk", n_changed)
+        if orphaned:
+            logger.debug("{} cached assets no longer have a source", len(orphaned))
+        return CachePlan(stale=stale, orphaned=orphaned)
+
+    def _is_complete(self, asset_id: str, required_files: List[str]) -> bool:
+        asset_cache_dir = self.cache_dir / asset_id
+        return all((asset_cache_dir / f).is_file() for f in required_files)
+
+
+def with_content_hash(entry: ManifestEntry, content_hash: bool) -> ManifestEntry:
+    if content_hash and entry.sha1 is None:
+        return entry._replace(sha1=file_sha1(entry.path))
+    return entry
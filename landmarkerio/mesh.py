@@ -0,0 +1,202 @@
+import struct
+from typing import Any, BinaryIO, NamedTuple, Optional
+
+import numpy as np
+
+# Indexed meshes start with a little-endian header of
+#   magic, version, n_points, n_tris, bytes per index, flags
+# followed by float32 points, the uint16/uint32 trilist (padded to a multiple
+# of 4 bytes so every section can be viewed as a typed array) and, if
+# textured, float32 tcoords.
+INDEXED_MESH_MAGIC = b"LMIM"
+INDEXED_MESH_VERSION = 1
+INDEXED_MESH_HEADER = struct.Struct("<4sIIIII")
+FLAG_TEXTURED = 1
+# keeps the cluster keys of decimate within int64
+MAX_CLUSTER_RESOLUTION = 1 << 20
+
+
+class RawMesh(NamedTuple):
+    points: np.ndarray
+    trilist: np.ndarray
+    tcoords: Optional[np.ndarray] = None
+
+    @property
+    def n_points(self) -> int:
+        return self.points.shape[0]
+
+    @property
+    def n_tris(self) -> int:
+        return self.trilist.shape[0]
+
+
+def as_raw_mesh(m: Any) -> RawMesh:
+    r"""
+    The arrays needed to serve a menpo TriMesh (or TexturedTriMesh).
+    """
+    tcoords = m.tcoords.points if hasattr(m, "tcoords") else None
+    return RawMesh(m.points, m.trilist, tcoords)
+
+
+def write_expanded_mesh(f: BinaryIO, mesh: RawMesh) -> None:
+    r"""
+    The legacy format - every corner of every triangle is written out in full.
+    """
+    normals = False  # for now we are just not exporting normals.
+    is_textured = mesh.tcoords is not None
+    f.write(struct.pack("IIII", mesh.n_tris, is_textured, normals, False))
+    _write_per_triangle(f, mesh.points, mesh.trilist)
+    if mesh.tcoords is not None:
+        _write_per_triangle(f, mesh.tcoords, mesh.trilist)
+
+
+def _write_per_triangle(
+    f: BinaryIO, values: np.ndarray, trilist: np.ndarray, chunk_size: int = 1 << 16
+) -> None:
+    # expand the per-vertex values out to every corner of every triangle, a
+    # chunk at a time so the fully expanded array never exists in memory
+    for i in range(0, len(trilist), chunk_size):
+        f.write(values[trilist[i : i + chunk_size]].astype(np.float32).tobytes())
+
+
+def index_dtype(n_points: int) -> np.dtype:
+    return np.dtype(np.uint16 if n_points <= np.iinfo(np.uint16).max else np.uint32)
+
+
+def write_indexed_mesh(f: BinaryIO, mesh: RawMesh) -> None:
+    dtype = index_dtype(mesh.n_points).newbyteorder("<")
+    flags = FLAG_TEXTURED if mesh.tcoords is not None else 0
+    f.write(
+        INDEXED_MESH_HEADER.pack(
+            INDEXED_MESH_MAGIC,
+            INDEXED_MESH_VERSION,
+            mesh.n_points,
+            mesh.n_tris,
+            dtype.itemsize,
+            flags,
+        )
+    )
+    f.write(mesh.points.astype("<f4").tobytes())
+    trilist = mesh.trilist.astype(dtype).tobytes()
+    f.write(trilist)
+    f.write(b"\0" * (-len(trilist) % 4))
+    if mesh.tcoords is not None:
+        f.write(mesh.tcoords.astype("<f4").tobytes())
+
+
+def read_indexed_mesh(f: BinaryIO) -> RawMesh:
+    magic, version, n_points, n_tris, index_bytes, flags = INDEXED_MESH_HEADER.unpack(
+        f.read(INDEXED_MESH_HEADER.size)
+    )
+    if magic != INDEXED_MESH_MAGIC or version != INDEXED_MESH_VERSION:
+        raise ValueError(f"Not a version {INDEXED_MESH_VERSION} indexed mesh")
+    dtype = np.dtype(f"<u{index_bytes}")
+    points = np.frombuffer(f.read(n_points * 12), dtype="<f4").reshape(-1, 3)
+    trilist_bytes = n_tris * 3 * index_bytes
+    trilist = np.frombuffer(f.read(trilist_bytes), dtype=dtype).reshape(-1, 3)
+    f.read(-trilist_bytes % 4)
+    tcoords = None
+    if flags & FLAG_TEXTURED:
+        tcoords = np.frombuffer(f.read(n_points * 8), dtype="<f4").reshape(-1, 2)
+    return RawMesh(points, trilist, tcoords)
+
+
+def lod_file(raw_name: str, lod: int) -> str:
+    r"""
+    The name a decimated level of detail of raw_name is cached under.
+    """
+    stem, ext = raw_name.rsplit(".", 1)
+    return f"{stem}_lod{lod}.{ext}"
+
+
+def cluster_vertices(mesh: RawMesh, resolution: int) -> RawMesh:
+    r"""
+    Decimate a mesh by snapping its vertices to a grid with resolution cells
+    along its longest side, merging all the vertices in a cell into their mean
+    and dropping the triangles that collapse as a result.
+    """
+    mins = mesh.points.min(axis=0)
+    extent = np.ptp(mesh.points, axis=0)
+    cell = max(extent.max(), np.finfo(np.float64).tiny) / resolution
+    cells = np.floor((mesh.points - mins) / cell).astype(np.int64)
+    cells = np.minimum(cells, resolution - 1)
+    keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+
+    # only vertices that are actually used by a triangle are clustered
+    used = np.zeros(mesh.n_points, dtype=bool)
+    used[mesh.trilist.ravel()] = True
+    _, labels = np.unique(np.where(used, keys, -1), return_inverse=True)
+    labels = labels.ravel()
+    if not used.all():
+        # label 0 is the unused vertices - shift it out of the way
+        labels = labels - 1
+
+    trilist = labels[mesh.trilist]
+    keep = (
+        (trilist[:, 0] != trilist[:, 1])
+        & (trilist[:, 1] != trilist[:, 2])
+        & (trilist[:, 0] != trilist[:, 2])
+    )
+    trilist = trilist[keep]
+    n_clusters = labels.max() + 1
+    # drop duplicated triangles (in any winding), keeping the first seen
+    corners = np.sort(trilist, axis=1).astype(np.int64)
+    if n_clusters < MAX_CLUSTER_RESOLUTION:
+        # pack each triangle into a single int64 - far faster than axis=0
+        tri_keys = (corners[:, 0] * n_clusters + corners[:, 1]) * n_clusters
+        _, first = np.unique(tri_keys + corners[:, 2], return_index=True)
+    else:
+        _, first = np.unique(corners, axis=0, return_index=True)
+    trilist = trilist[np.sort(first)]
+
+    valid = labels >= 0
+    counts = np.bincount(labels[valid], minlength=n_clusters)[:, None]
+
+    def cluster_mean(values: np.ndarray) -> np.ndarray:
+        return (
+            np.stack(
+                [
+                    np.bincount(labels[valid], weights=v[valid], minlength=n_clusters)
+                    for v in values.T
+                ],
+                axis=1,
+            )
+            / counts
+        )
+
+    tcoords = None if mesh.tcoords is None else cluster_mean(mesh.tcoords)
+    return RawMesh(cluster_mean(mesh.points), trilist, tcoords)
+
+
+def decimate(mesh: RawMesh, fraction: float, n_iterations: int = 12) -> RawMesh:
+    r"""
+    Decimate a mesh to (at most) roughly fraction of its triangles by
+    searching for the finest vertex clustering that gets under the target.
+    A mesh that can't be decimated that far (e.g. a tetrahedron to a
+    quarter) comes back without any triangles at all.
+    """
+    if fraction >= 1:
+        return mesh
+    target = max(1, int(mesh.n_tris * fraction))
+    lo, hi = 1, 2
+    best = cluster_vertices(mesh, lo)
+    # grow the grid until it is too fine, then bisect
+    while hi <= MAX_CLUSTER_RESOLUTION:
+        candidate = cluster_vertices(mesh, hi)
+        if candidate.n_tris > target:
+            break
+        best, lo = candidate, hi
+        if candidate.n_tris == mesh.n_tris:
+            return candidate
+        hi *= 2
+    hi = min(hi, MAX_CLUSTER_RESOLUTION)
+    for _ in range(n_iterations):
+        if hi - lo <= 1:
+            break
+        mid = (lo + hi) // 2
+        candidate = cluster_vertices(mesh, mid)
+        if candidate.n_tris > target:
+            hi = mid
+        else:
+            best, lo = candidate, mid
+    return best
@@ -0,0 +1,237 @@
+import mmap
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+from functools import lru_cache
+from os.path import abspath, expanduser
+from pathlib import Path
+from typing import Any, BinaryIO, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from landmarkerio import ATLASES_DIRNAME, PACK_INDEX_FILENAME, dirs_in_dir
+from landmarkerio.index import CacheIndex
+from landmarkerio.types import PackedFile, PathLike
+
+# Segments are rolled over once they reach this size, so that a pack can be
+# copied between machines as a handful of large files
+DEFAULT_SEGMENT_SIZE = 1 << 30
+# How often the offsets of newly packed assets are committed
+PACK_COMMIT_INTERVAL = 30.0
+
+PACK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    asset_id TEXT PRIMARY KEY,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    asset_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (asset_id, name)
+);
+"""
+
+
+def is_pack(path: PathLike) -> bool:
+    return (Path(path) / PACK_INDEX_FILENAME).is_file()
+
+
+def segment_path(pack_dir: PathLike, segment: int) -> Path:
+    return Path(pack_dir) / f"segment-{segment:05d}.pack"
+
+
+def _asset_source(asset_cache_dir: Path) -> str:
+    # publishing a recached asset swaps in a new directory, so this changes
+    # whenever the asset does
+    st = os.stat(asset_cache_dir)
+    return f"{st.st_ino}:{st.st_mtime_ns}"
+
+
+def _asset_files(asset_cache_dir: Path) -> List[Tuple[str, Path]]:
+    files = []
+    for root, _, names in os.walk(asset_cache_dir):
+        for name in names:
+            path = Path(root) / name
+            files.append((path.relative_to(asset_cache_dir).as_posix(), path))
+    return sorted(files)
+
+
+class SegmentWriter:
+    r"""
+    Appends files to the segments of a pack, starting a new segment whenever
+    the current one would grow beyond segment_size.
+    """
+
+    def __init__(self, pack_dir: Path, segment_size: int) -> None:
+        self.pack_dir = pack_dir
+        self.segment_size = segment_size
+        self.segment = 0
+        while segment_path(pack_dir, self.segment + 1).exists():
+            self.segment += 1
+        self._f: BinaryIO = segment_path(pack_dir, self.segment).open("ab")
+
+    def append(self, path: Path) -> Tuple[int, int, int]:
+        data = path.read_bytes()
+        offset = self._f.tell()
+        if offset and offset + len(data) > self.segment_size:
+            self.flush()
+            self._f.close()
+            self.segment += 1
+            self._f = segment_path(self.pack_dir, self.segment).open("ab")
+            offset = 0
+        self._f.write(data)
+        return self.segment, offset, len(data)
+
+    def flush(self) -> None:
+        # the data has to be on disk before the offsets pointing at it are
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        self._f.close()
+
+
+def pack_cache(
+    cache_dir: PathLike,
+    pack_dir: PathLike,
+    segment_size: int = DEFAULT_SEGMENT_SIZE,
+) -> None:
+    r"""
+    Pack a directory cache into append-only segment files plus an index of
+    the offset of every file within them.
+
+    Packing an existing pack again only appends the assets that have been
+    recached since, and drops those that are no longer in the cache. The
+    space taken by their old versions is not reclaimed - repack into a fresh
+    directory for that.
+    """
+    cache_dir = Path(abspath(expanduser(cache_dir)))
+    pack_dir = Path(abspath(expanduser(pack_dir)))
+    pack_dir.mkdir(parents=True, exist_ok=True)
+    index = CacheIndex.open(cache_dir)
+    if index is not None:
+        asset_ids = index.asset_ids()
+    else:
+        asset_ids = [p.name for p in dirs_in_dir(cache_dir)]
+
+    with closing(sqlite3.connect(str(pack_dir / PACK_INDEX_FILENAME))) as conn:
+        conn.executescript(PACK_SCHEMA)
+        packed = dict(conn.execute("SELECT asset_id, source FROM assets"))
+        writer = SegmentWriter(pack_dir, segment_size)
+        start = last_commit = time.time()
+        n_packed = 0
+        try:
+            for asset_id in asset_ids:
+                asset_cache_dir = cache_dir / asset_id
+                source = _asset_source(asset_cache_dir)
+                if packed.get(asset_id) == source:
+                    continue
+                rows = [
+                    (asset_id, name, *writer.append(path))
+                    for name, path in _asset_files(asset_cache_dir)
+                ]
+                conn.execute("DELETE FROM files WHERE asset_id = ?", (asset_id,))
+                conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute(
+                    "INSERT OR REPLACE INTO assets VALUES (?, ?)", (asset_id, source)
+                )
+                n_packed += 1
+                if time.time() - last_commit > PACK_COMMIT_INTERVAL:
+                    # checkpoint, so an interrupted pack resumes from here
+                    writer.flush()
+                    conn.commit()
+                    last_commit = time.time()
+                    logger.debug("packed {}/{} assets", n_packed, len(asset_ids))
+        finally:
+            writer.close()
+            conn.commit()
+
+        removed = set(packed) - set(asset_ids)
+        with conn:
+            for table in ("assets", "files"):
+                conn.executemany(
+                    f"DELETE FROM {table} WHERE asset_id = ?", ((a,) for a in removed)
+                )
+    _copy_atlases(cache_dir, pack_dir)
+    logger.debug(
+        "packed {} assets ({} removed) into {} segments in {:.0f} seconds",
+        n_packed,
+        len(removed),
+        writer.segment + 1,
+        time.time() - start,
+    )
+
+
+def _copy_atlases(cache_dir: Path, pack_dir: Path) -> None:
+    # atlases are a handful of large files already, so are copied as they are
+    atlases = cache_dir / ATLASES_DIRNAME
+    if atlases.is_dir():
+        shutil.rmtree(pack_dir / ATLASES_DIRNAME, ignore_errors=True)
+        shutil.copytree(atlases, pack_dir / ATLASES_DIRNAME)
+
+
+@lru_cache(maxsize=None)
+def _open_segment(segment: Path) -> mmap.mmap:
+    # segments are mapped once per process, so serving a file is a slice of
+    # memory rather than an open, seek and read
+    with segment.open("rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_packed(packed: PackedFile) -> bytes:
+    segment = _open_segment(packed.segment)
+    end = packed.offset + packed.size
+    if end > len(segment):
+        # the segment has been appended to since it was mapped
+        _open_segment.cache_clear()
+        segment = _open_segment(packed.segment)
+    return segment[packed.offset : end]
+
+
+class Pack:
+    r"""
+    Read-only access to a packed cache, as written by ``lmiopack``.
+    """
+
+    def __init__(self, pack_dir: PathLike) -> None:
+        self.pack_dir = Path(abspath(expanduser(pack_dir)))
+        self._uri = f"{(self.pack_dir / PACK_INDEX_FILENAME).as_uri()}?mode=ro"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        # connections can't be shared with forked workers
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn.execute(sql, params).fetchall()
+
+    def asset_ids(self) -> List[str]:
+        return [r[0] for r in self._query("SELECT asset_id FROM assets ORDER BY 1")]
+
+    def asset_ids_with(self, name_pattern: str) -> List[str]:
+        r"""
+        The ids of the assets with a file whose name matches name_pattern
+        (an SQL LIKE pattern).
+        """
+        sql = "SELECT DISTINCT asset_id FROM files WHERE name LIKE ? ORDER BY 1"
+        return [r[0] for r in self._query(sql, (name_pattern,))]
+
+    def locate(self, asset_id: str, name: str) -> PackedFile:
+        rows = self._query(
+            "SELECT segment, offset, size FROM files WHERE asset_id = ? AND name = ?",
+            (asset_id, name),
+        )
+        if not rows:
+            raise FileNotFoundError(f"{asset_id}/{name} is not in the pack")
+        segment, offset, size = rows[0]
+        return PackedFile(segment_path(self.pack_dir, segment), offset, size, name)
+
+    def read(self, asset_id: str, name: str) -> bytes:
+        return read_packed(self.locate(asset_id, name))
@@ -0,0 +1,102 @@
+import base64
+from typing import List, Mapping, NamedTuple, Optional, Sequence
+
+# The most asset ids returned in one page
+MAX_PAGE_SIZE = 10000
+
+
+class InvalidPageQuery(ValueError):
+    pass
+
+
+class PageQuery(NamedTuple):
+    offset: int = 0
+    limit: int = MAX_PAGE_SIZE
+    # only asset ids that start with this
+    prefix: Optional[str] = None
+    # where the previous page left off, as returned with it
+    cursor: Optional[str] = None
+
+
+class Page(NamedTuple):
+    asset_ids: Sequence[str]
+    # None once there are no more asset ids
+    next_cursor: Optional[str]
+
+    def as_json(self) -> dict:
+        return {"asset_ids": list(self.asset_ids), "next": self.next_cursor}
+
+
+PAGE_ARGS = ("offset", "limit", "prefix", "cursor")
+
+
+def parse_page_query(args: Mapping[str, str]) -> Optional[PageQuery]:
+    r"""
+    The page asked for by the query arguments of a request, or None if none
+    of them were given (and so the whole list is wanted).
+    """
+    if not any(a in args for a in PAGE_ARGS):
+        return None
+    try:
+        offset = int(args.get("offset", 0))
+        limit = int(args.get("limit", MAX_PAGE_SIZE))
+    except ValueError:
+        raise InvalidPageQuery("offset and limit must be integers")
+    if offset < 0 or not 0 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidPageQuery(
+            f"offset must be positive and limit between 0 and {MAX_PAGE_SIZE}"
+        )
+    return PageQuery(offset, limit, args.get("prefix") or None, args.get("cursor"))
+
+
+def encode_cursor(position: int, asset_id: str) -> str:
+    token = f"{position}:{asset_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(token).decode("ascii").rstrip("=")
+
+
+def _cursor_start(asset_ids: Sequence[str], cursor: str) -> int:
+    # a cursor is the position after the last asset id of a page, and that id
+    # in case the list has changed underneath it since
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        token = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        position_str, _, asset_id = token.partition(":")
+        position = int(position_str)
+    except ValueError:
+        raise InvalidPageQuery(f"Invalid cursor '{cursor}'")
+    if 0 < position <= len(asset_ids) and asset_ids[position - 1] == asset_id:
+        return position
+    try:
+        return asset_ids.index(asset_id) + 1
+    except ValueError:
+        raise InvalidPageQuery("The cursor's asset has since been removed")
+
+
+def paginate(asset_ids: Sequence[str], query: PageQuery) -> Page:
+    r"""
+    One page of a list of asset ids. Only the asset ids of the page are
+    copied, so this is cheap however long the list is - unless a prefix is
+    given, which has to be looked for.
+    """
+    start = 0
+    if query.cursor is not None:
+        start = _cursor_start(asset_ids, query.cursor)
+    skip = query.offset
+    if query.prefix is None:
+        # every asset id counts towards the offset, so it can be jumped
+        start, skip = min(start + skip, len(asset_ids)), 0
+    page: List[str] = []
+    end = start  # the position after the last asset id of the page
+    for position in range(start, len(asset_ids)):
+        asset_id = asset_ids[position]
+        if query.prefix is not None and not asset_id.startswith(query.prefix):
+            continue
+        if skip:
+            skip -= 1
+            continue
+        if len(page) == query.limit:
+            # there is at least one more asset id to come
+            return Page(page, encode_cursor(end, page[-1]) if page else None)
+        page.append(asset_id)
+        end = position + 1
+    return Page(page, None)
@@ -0,0 +1,218 @@
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from landmarkerio.types import PathLike
+
+PathAssetID = Tuple[PathLike, str]
+ChunkResult = List[Tuple[str, Optional[str]]]
+
+DEFAULT_CHUNK_SIZE = 16
+DEFAULT_CHUNK_BYTES = 64 * 1024**2
+PROGRESS_INTERVAL = 10.0
+
+
+def default_max_inflight_bytes() -> Optional[int]:
+    r"""
+    An eighth of physical memory, in source file bytes, or None (no limit)
+    if the amount of memory cannot be determined.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 8
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _file_size(path: PathLike) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _cache_chunk(
+    cache: Callable[[PathLike, str], None], chunk: Sequence[PathAssetID]
+) -> ChunkResult:
+    # runs in a worker - an exception only ever fails the asset that raised it
+    results: ChunkResult = []
+    for path, asset_id in chunk:
+        try:
+            cache(path, asset_id)
+            results.append((asset_id, None))
+        except Exception as e:
+            results.append((asset_id, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def chunk_largest_first(
+    path_asset_id: Sequence[PathAssetID],
+    sizes: Dict[str, int],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> List[List[PathAssetID]]:
+    r"""
+    Group assets into chunks, largest files first so that the slowest assets
+    start early and the small ones fill in the gaps at the end. Large assets
+    end up in chunks of their own.
+    """
+    chunks: List[List[PathAssetID]] = []
+    chunk: List[PathAssetID] = []
+    nbytes = 0
+    for item in sorted(path_asset_id, key=lambda pa: sizes[pa[1]], reverse=True):
+        size = sizes[item[1]]
+        if chunk and (len(chunk) >= chunk_size or nbytes + size > chunk_bytes):
+            chunks.append(chunk)
+            chunk, nbytes = [], 0
+        chunk.append(item)
+        nbytes += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def write_failure_report(path: PathLike, failures: Dict[str, Dict]) -> None:
+    path = Path(path)
+    if not failures:
+        if path.exists():
+            path.unlink()
+        return
+    with path.open("wt") as f:
+        json.dump(failures, f, indent=4, sort_keys=True)
+    logger.warning("{} assets failed to cache - see {}", len(failures), path)
+
+
+def pool_cacher(
+    cache: Callable[[PathLike, str], None],
+    path_asset_id: Sequence[PathAssetID],
+    n_jobs: int = -1,
+    max_inflight_bytes: Optional[int] = None,
+    retries: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    report_path: Optional[PathLike] = None,
+) -> Iterator[str]:
+    r"""
+    Cache assets in a pool of worker processes, yielding each asset id as it
+    is cached.
+
+    Work is submitted in chunks, largest source files first, while the total
+    size of the source files being worked on stays under max_inflight_bytes
+    (at least one chunk is always in flight). An asset that raises is retried
+    up to retries times and then recorded in the failure report rather than
+    stopping the run. If a worker dies outright the pool is rebuilt and the
+    assets that were in flight are rerun one at a time, so that only the asset
+    that killed it is charged an attempt.
+    """
+    if not path_asset_id:
+        return
+    n_workers = (os.cpu_count() or 1) if n_jobs < 0 else n_jobs
+    sizes = {asset_id: _file_size(path) for path, asset_id in path_asset_id}
+    paths = {asset_id: path for path, asset_id in path_asset_id}
+    pending: Deque[List[PathAssetID]] = deque(
+        chunk_largest_first(path_asset_id, sizes, chunk_size, chunk_bytes)
+    )
+
+    attempts: Counter = Counter()
+    failures: Dict[str, Dict] = {}
+    # assets that were in flight when a worker died, to be run one at a time
+    suspects: Deque[List[PathAssetID]] = deque()
+    inflight: Dict[Future, Tuple[List[PathAssetID], int]] = {}
+    inflight_bytes = 0
+    broken = False
+    n_done = 0
+    start = last_progress = time.time()
+
+    def retry_or_fail(asset_id: str, error: str) -> None:
+        attempts[asset_id] += 1
+        if attempts[asset_id] <= retries:
+            logger.debug("retrying {} - {}", asset_id, error)
+            pending.append([(paths[asset_id], asset_id)])
+        else:
+            logger.error("failed to cache {} - {}", asset_id, error)
+            failures[asset_id] = {
+                "path": str(paths[asset_id]),
+                "error": error,
+                "attempts": attempts[asset_id],
+            }
+
+    executor = ProcessPoolExecutor(n_workers)
+    try:
+        while pending or suspects or inflight:
+            if broken and not inflight:
+                logger.warning("a cache worker died - restarting the pool")
+                executor.shutdown(wait=True)
+                executor = ProcessPoolExecutor(n_workers)
+                broken = False
+
+            if suspects and not broken and not inflight:
+                chunk = suspects.popleft()
+                nbytes = sizes[chunk[0][1]]
+                inflight[executor.submit(_cache_chunk, cache, chunk)] = (chunk, nbytes)
+                inflight_bytes += nbytes
+
+            # keep every worker busy, within the in-flight memory budget
+            while (
+                not broken
+                and not suspects
+                and pending
+                and len(inflight) < 2 * n_workers
+            ):
+                nbytes = sum(sizes[a] for _, a in pending[0])
+                if (
+                    inflight
+                    and max_inflight_bytes is not None
+                    and inflight_bytes + nbytes > max_inflight_bytes
+                ):
+                    break
+                chunk = pending.popleft()
+                inflight[executor.submit(_cache_chunk, cache, chunk)] = (chunk, nbytes)
+                inflight_bytes += nbytes
+
+            n_running = len(inflight)
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk, nbytes = inflight.pop(future)
+                inflight_bytes -= nbytes
+                try:
+                    results = future.result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    if n_running == 1 and len(chunk) == 1:
+                        retry_or_fail(chunk[0][1], f"worker died: {e}")
+                    else:
+                        # any of these could be the culprit - rerun each alone
+                        suspects.extend([item] for item in chunk)
+                    continue
+                for asset_id, error in results:
+                    if error is None:
+                        n_done += 1
+                        yield asset_id
+                    else:
+                        retry_or_fail(asset_id, error)
+
+            now = time.time()
+            if now - last_progress > PROGRESS_INTERVAL:
+                last_progress = now
+                rate = n_done / (now - start)
+                remaining = len(path_asset_id) - n_done - len(failures)
+                logger.info(
+                    "cached {}/{} ({} failed) - {:.1f} assets/s, ~{:.0f}s remaining",
+                    n_done,
+                    len(path_asset_id),
+                    len(failures),
+                    rate,
+                    remaining / rate if rate else float("inf"),
+                )
+    finally:
+        for future in inflight:
+            future.cancel()
+        executor.shutdown(wait=False)
+        if report_path is not None:
+            write_failure_report(report_path, failures)
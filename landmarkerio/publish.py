@@ -0,0 +1,95 @@
+import os
+import shutil
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+
+from landmarkerio import LOCKS_DIRNAME, STAGING_DIRNAME
+from landmarkerio.types import PathLike
+
+# A lock older than this is assumed to belong to a machine that died
+DEFAULT_LOCK_TIMEOUT = 60 * 60
+
+
+class AssetLocked(RuntimeError):
+    def __init__(self, asset_id: str, owner: str) -> None:
+        super().__init__(f"{asset_id} is being cached by {owner}")
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+@contextmanager
+def asset_lock(
+    cache_dir: PathLike, asset_id: str, timeout: float = DEFAULT_LOCK_TIMEOUT
+) -> Iterator[None]:
+    r"""
+    Hold an exclusive lock on caching asset_id in cache_dir. The lock is a
+    file created with O_EXCL, which is atomic on local disks and NFS alike, so
+    it is safe to share a cache directory between machines.
+    """
+    locks_dir = Path(cache_dir) / LOCKS_DIRNAME
+    locks_dir.mkdir(exist_ok=True)
+    lock_path = locks_dir / f"{asset_id}.lock"
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                age = time.time() - lock_path.stat().st_mtime
+                owner = lock_path.read_text()
+            except FileNotFoundError:
+                continue  # released in the meantime - try again
+            if age < timeout:
+                raise AssetLocked(asset_id, owner)
+            logger.warning("breaking stale lock on {} held by {}", asset_id, owner)
+            try:
+                lock_path.unlink()
+            except FileNotFoundError:
+                pass
+    try:
+        with os.fdopen(fd, "wt") as f:
+            f.write(_owner())
+        yield
+    finally:
+        try:
+            lock_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def staging_dir(cache_dir: PathLike) -> Iterator[Path]:
+    r"""
+    A private directory within cache_dir to build assets in before they are
+    published. It is on the same filesystem, so publishing is just a rename.
+    """
+    token = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}"
+    path = Path(cache_dir) / STAGING_DIRNAME / token
+    path.mkdir(parents=True)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def publish(staged: Path, target: Path) -> None:
+    r"""
+    Move a completely built asset directory into place. Readers either see
+    the old directory, no directory for an instant, or the new one - never a
+    partially written one.
+    """
+    if target.exists():
+        old = staged.with_name(staged.name + ".old")
+        os.rename(target, old)
+        os.rename(staged, target)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.rename(staged, target)
@@ -0,0 +1,213 @@
+import json
+import math
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from PIL import Image
+
+from landmarkerio import CacheFile
+from landmarkerio.image import open_image
+from landmarkerio.types import PathLike
+
+DEFAULT_TILE_SIZE = 512
+# WebGL only allows textures of maximum dimension 4096, so past this a tiled
+# pyramid is built so clients can fetch just the region they are looking at
+DEFAULT_PYRAMID_MIN_SIZE = 4096
+
+
+def n_pyramid_levels(width: int, height: int, tile_size: int) -> int:
+    # level 0 fits in a single tile, the last level is full resolution
+    return max(0, math.ceil(math.log2(max(width, height) / tile_size))) + 1
+
+
+def tile_file(level: int, x: int, y: int) -> str:
+    return f"{level}/{x}_{y}.jpg"
+
+
+# Reads the rows [y, y + height) of an image at full resolution
+BandReader = Callable[[int, int], Image.Image]
+
+
+class _PyramidLevel:
+    r"""
+    Cuts the rows of one level of a pyramid into tiles as they arrive, and
+    passes them on halved to the level below, so that no level is ever held
+    in memory whole.
+    """
+
+    def __init__(
+        self,
+        level: int,
+        tiles_dir: Path,
+        tile_size: int,
+        quality: int,
+        below: Optional["_PyramidLevel"],
+    ) -> None:
+        self.level = level
+        self.tiles_dir = tiles_dir
+        self.tile_size = tile_size
+        self.quality = quality
+        self.below = below
+        self.y = 0  # the row of the level the tile buffer starts at
+        self.tile_rows: Optional[Image.Image] = None
+        self.odd_row: Optional[Image.Image] = None
+        (tiles_dir / str(level)).mkdir(parents=True, exist_ok=True)
+
+    def push(self, rows: Image.Image) -> None:
+        self.tile_rows = _stack(self.tile_rows, rows)
+        while self.tile_rows.height >= self.tile_size:
+            self._save_tiles(self.tile_rows.crop((0, 0, rows.width, self.tile_size)))
+            self.tile_rows = self.tile_rows.crop(
+                (0, self.tile_size, rows.width, self.tile_rows.height)
+            )
+        if self.below is not None:
+            # rows are halved in pairs, the same as halving the whole level
+            rows = _stack(self.odd_row, rows)
+            even = rows.height - rows.height % 2
+            self.odd_row = rows.crop((0, even, rows.width, rows.height))
+            if even:
+                self.below.push(rows.crop((0, 0, rows.width, even)).reduce(2))
+
+    def flush(self) -> None:
+        if self.tile_rows is not None and self.tile_rows.height:
+            self._save_tiles(self.tile_rows)
+        if self.below is not None:
+            if self.odd_row is not None and self.odd_row.height:
+                self.below.push(self.odd_row.reduce(2))
+            self.below.flush()
+
+    def _save_tiles(self, rows: Image.Image) -> None:
+        y = self.y // self.tile_size
+        for x in range(math.ceil(rows.width / self.tile_size)):
+            box = (
+                x * self.tile_size,
+                0,
+                min(rows.width, (x + 1) * self.tile_size),
+                rows.height,
+            )
+            rows.crop(box).save(
+                self.tiles_dir / tile_file(self.level, x, y),
+                quality=self.quality,
+                format="jpeg",
+            )
+        self.y += rows.height
+
+
+def _stack(top: Optional[Image.Image], bottom: Image.Image) -> Image.Image:
+    if top is None or not top.height:
+        return bottom
+    stacked = Image.new(bottom.mode, (bottom.width, top.height + bottom.height))
+    stacked.paste(top, (0, 0))
+    stacked.paste(bottom, (0, top.height))
+    return stacked
+
+
+def build_pyramid_from_bands(
+    read_band: BandReader,
+    width: int,
+    height: int,
+    asset_cache_dir: PathLike,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    quality: int = 85,
+) -> Dict[str, Any]:
+    r"""
+    Save a multi-resolution pyramid of fixed size JPEG tiles for an image,
+    halving the resolution at each level until it fits within one tile.
+
+    The image is read a band of rows at a time (as RGB or L), and each level
+    is tiled as its rows are produced, so only a few bands of each level are
+    ever in memory.
+    """
+    asset_cache_dir = Path(asset_cache_dir)
+    tiles_dir = asset_cache_dir / CacheFile.tiles_dir
+    n_levels = n_pyramid_levels(width, height, tile_size)
+    level_sizes = [[0, 0]] * n_levels
+    top: Optional[_PyramidLevel] = None
+    w, h = width, height
+    for level in range(n_levels):
+        # from the top (full resolution) level, each half the size of the last
+        level_sizes[n_levels - 1 - level] = [w, h]
+        w, h = math.ceil(w / 2), math.ceil(h / 2)
+    for level in range(n_levels):
+        top = _PyramidLevel(level, tiles_dir, tile_size, quality, below=top)
+    assert top is not None
+
+    for y in range(0, height, tile_size):
+        top.push(read_band(y, min(tile_size, height - y)))
+    top.flush()
+
+    metadata = {
+        "width": width,
+        "height": height,
+        "tile_size": tile_size,
+        "levels": n_levels,
+        "level_sizes": level_sizes,
+        "format": "jpeg",
+    }
+    with (asset_cache_dir / CacheFile.tiles).open("wt") as f:
+        json.dump(metadata, f)
+    return metadata
+
+
+def build_pyramid(
+    image: Image.Image,
+    asset_cache_dir: PathLike,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    quality: int = 85,
+) -> Dict[str, Any]:
+    r"""
+    Save the tile pyramid of an image that has already been decoded.
+    """
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    def read_band(y: int, height: int) -> Image.Image:
+        return image.crop((0, y, image.width, y + height))
+
+    return build_pyramid_from_bands(
+        read_band, image.width, image.height, asset_cache_dir, tile_size, quality
+    )
+
+
+def _vips_band_reader(path: PathLike) -> Optional[Tuple[BandReader, int, int]]:
+    # libvips decodes an image a strip at a time, which PIL can't for e.g.
+    # JPEG, so is used when the optional pyvips package is installed
+    try:
+        import pyvips
+    except ImportError:
+        return None
+    image = pyvips.Image.new_from_file(str(path), access="sequential")
+    if image.hasalpha():
+        image = image.flatten()
+    grey = image.bands == 1
+    image = image.colourspace("b-w" if grey else "srgb").cast("uchar")
+    mode = "L" if grey else "RGB"
+
+    def read_band(y: int, height: int) -> Image.Image:
+        band = image.crop(0, y, image.width, height).write_to_memory()
+        return Image.frombytes(mode, (image.width, height), band)
+
+    return read_band, image.width, image.height
+
+
+def build_pyramid_from_file(
+    path: PathLike,
+    asset_cache_dir: PathLike,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    quality: int = 85,
+) -> Dict[str, Any]:
+    r"""
+    Save the tile pyramid of an image file. With pyvips installed the image is
+    read in strips, so never has to fit in memory. Otherwise it is decoded
+    whole by PIL.
+    """
+    reader = _vips_band_reader(path)
+    if reader is not None:
+        read_band, width, height = reader
+        return build_pyramid_from_bands(
+            read_band, width, height, asset_cache_dir, tile_size, quality
+        )
+    logger.debug("pyvips is not installed - decoding {} whole to tile it", path)
+    with open_image(path) as ip:
+        return build_pyramid(ip, asset_cache_dir, tile_size, quality)
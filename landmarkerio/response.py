@@ -1,19 +1,457 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+from email.utils import formatdate, parsedate_to_datetime
 from functools import partial
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from sanic import response
+from sanic.compat import Header
+from sanic.exceptions import SanicException
+from sanic.request import Request
 from sanic.response import HTTPResponse
 
 from landmarkerio import Mimetype
-from landmarkerio.types import PathLike
+from landmarkerio.codec import Codec, codec_for_path, compress, get_codec
+from landmarkerio.lru import FileCacheSlot
+from landmarkerio.pack import read_packed
+from landmarkerio.types import PackedFile, PathLike
 
+# Clients may keep responses but must revalidate them, which costs a round
+# trip but only a 304 (rather than the whole file) when nothing has changed
+DEFAULT_CACHE_CONTROL = "no-cache"
 
-async def serve_file(mimetype: str, path: PathLike, gzip: bool = False) -> HTTPResponse:
-    headers = None
-    if gzip:
-        headers = {"Content-Encoding": "gzip"}
-    return await response.file(path, mime_type=mimetype, headers=headers)
+# The encodings prepared JSON is compressed with (when the codec's package is
+# installed), in order of preference, and at what level. A listing of a
+# million assets takes under a second to compress at these levels, whereas
+# the highest take several times longer for a few percent.
+JSON_ENCODINGS = {"br": 5, "zstd": 6, "gzip": 6}
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESSED_SIZE = 1024
+# What a compressed file is recompressed with for clients that don't accept
+# the encoding it was stored with (before falling back to none at all), and
+# at what level
+FALLBACK_ENCODING = "gzip"
+FALLBACK_LEVEL = 6
+
+
+class Validators(NamedTuple):
+    etag: str
+    last_modified: Optional[float] = None
+
+    def headers(self, cache_control: str) -> Dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": cache_control}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = formatdate(self.last_modified, usegmt=True)
+        return headers
+
+    def encoded(self, encoding: str) -> "Validators":
+        # each content encoding is a different representation, so has its
+        # own ETag
+        return self._replace(etag=f'{self.etag[:-1]}-{encoding}"')
+
+
+class ByteRange(NamedTuple):
+    start: int
+    end: int  # inclusive, as in the Range header
+    total: int
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start + 1
+
+    def content_range(self) -> str:
+        return f"bytes {self.start}-{self.end}/{self.total}"
+
+
+def stat_file(path: Union[PathLike, PackedFile]) -> Tuple[Validators, int]:
+    r"""
+    The validators of a file, and its size.
+    """
+    if isinstance(path, PackedFile):
+        # segments are append-only, so a file's offset identifies its content
+        st = os.stat(path.segment)
+        etag = f'"{st.st_ino:x}-{path.offset:x}-{path.size:x}"'
+        return Validators(etag, st.st_mtime), path.size
+    # recached assets are published as new files, so get a new inode
+    st = os.stat(path)
+    etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+    return Validators(etag, st.st_mtime), st.st_size
+
+
+def file_validators(path: Union[PathLike, PackedFile]) -> Validators:
+    return stat_file(path)[0]
+
+
+def is_not_modified(request: Optional[Request], validators: Validators) -> bool:
+    r"""
+    Whether the client already has the current version of a response, as
+    determined by its If-None-Match or (failing that) If-Modified-Since.
+    """
+    if request is None:
+        return False
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # weak comparison, as is the rule for If-None-Match
+        etag = validators.etag
+        tags = (t.strip() for t in if_none_match.split(","))
+        return any((t[2:] if t.startswith("W/") else t) == etag for t in tags)
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is not None and validators.last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(validators.last_modified) <= since
+    return False
+
+
+def parse_range(header: str, total: int) -> Optional[ByteRange]:
+    r"""
+    The range of bytes asked for by a Range header, or None if the header
+    isn't one that we support (and so should be ignored). Only single ranges
+    are supported - a whole file is as good an answer to a multi-range
+    request as any.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = (part.strip() for part in spec.partition("-"))
+    if not dash or not (first or last) or not (first + last).isdigit():
+        return None
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), total - 1) if last else total - 1
+    else:
+        # a suffix - the last n bytes (where none at all can't be satisfied)
+        n = int(last)
+        start = total - min(n, total) if n else total
+        end = total - 1
+    if start >= total:
+        raise SanicException(
+            "Range Not Satisfiable",
+            status_code=416,
+            headers={"Content-Range": f"bytes */{total}"},
+            quiet=True,
+        )
+    return ByteRange(start, end, total)
+
+
+def requested_range(
+    request: Optional[Request], validators: Validators, total: int
+) -> Optional[ByteRange]:
+    r"""
+    The part of a file to respond with, or None for all of it. A range is
+    only honoured if the If-Range (if any) shows that the client's partial
+    copy is of the current version.
+    """
+    if request is None:
+        return None
+    range_header = request.headers.get("Range")
+    if range_header is None:
+        return None
+    if_range = request.headers.get("If-Range")
+    if if_range is not None:
+        if_range = if_range.strip()
+        if if_range.startswith(('"', "W/")):
+            # strong comparison, so weak ETags never match
+            if if_range != validators.etag:
+                return None
+        else:
+            try:
+                date = parsedate_to_datetime(if_range).timestamp()
+            except (TypeError, ValueError):
+                return None
+            if validators.last_modified is None or (
+                int(validators.last_modified) != date
+            ):
+                return None
+    return parse_range(range_header, total)
+
+
+def not_modified(
+    validators: Validators, cache_control: str, vary: Optional[str] = None
+) -> HTTPResponse:
+    headers = validators.headers(cache_control)
+    if vary is not None:
+        headers["Vary"] = vary
+    return response.empty(status=304, headers=headers)
+
+
+def partial_response(
+    body: bytes,
+    byte_range: Optional[ByteRange],
+    headers: Dict[str, str],
+    mimetype: str,
+) -> HTTPResponse:
+    r"""
+    Respond with body, which is only the requested range of the file if a
+    range was requested.
+    """
+    if byte_range is None:
+        return response.raw(body, headers=headers, content_type=mimetype)
+    headers["Content-Range"] = byte_range.content_range()
+    return response.raw(body, status=206, headers=headers, content_type=mimetype)
+
+
+async def read_file(path: Union[PathLike, PackedFile]) -> bytes:
+    loop = asyncio.get_running_loop()
+    if isinstance(path, PackedFile):
+        # copying out of a mapped segment blocks on page faults like a read
+        return await loop.run_in_executor(None, read_packed, path)
+    return await loop.run_in_executor(None, Path(path).read_bytes)
+
+
+async def read_file_via_memory(
+    path: Union[PathLike, PackedFile], memory: Optional[FileCacheSlot]
+) -> bytes:
+    r"""
+    Read a whole file, from memory if it's kept there.
+    """
+    if memory is None:
+        return await read_file(path)
+    loop = asyncio.get_running_loop()
+    validators, size = await loop.run_in_executor(None, stat_file, path)
+    body = memory.get(validators.etag)
+    if body is None:
+        body = await read_file(path)
+        if memory.admits(size):
+            memory.put(validators.etag, body)
+    return body
+
+
+async def serve_file(
+    mimetype: str,
+    path: Union[PathLike, PackedFile],
+    encoding: Optional[str] = None,
+    request: Optional[Request] = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+    memory: Optional[FileCacheSlot] = None,
+    vary: Optional[str] = None,
+) -> HTTPResponse:
+    r"""
+    Serve a file, honouring conditional and range requests. If given a slot
+    of a memory cache, the file is served from (and kept in) memory. vary
+    names the request headers (if any) that chose this file over others.
+    """
+    loop = asyncio.get_running_loop()
+    validators, size = await loop.run_in_executor(None, stat_file, path)
+    if is_not_modified(request, validators):
+        return not_modified(validators, cache_control, vary=vary)
+    headers = validators.headers(cache_control)
+    headers["Accept-Ranges"] = "bytes"
+    if vary is not None:
+        headers["Vary"] = vary
+    if encoding is not None:
+        # ranges are of the encoded file, as they are for any static server
+        headers["Content-Encoding"] = encoding
+    byte_range = requested_range(request, validators, size)
+    body = None
+    if memory is not None:
+        body = memory.get(validators.etag)
+        if body is None and memory.admits(size):
+            body = await read_file(path)
+            memory.put(validators.etag, body)
+    if body is not None:
+        if byte_range is not None:
+            body = body[byte_range.start : byte_range.end + 1]
+        return partial_response(body, byte_range, headers, mimetype)
+    if isinstance(path, PackedFile):
+        if byte_range is not None:
+            path = path._replace(
+                offset=path.offset + byte_range.start, size=byte_range.size
+            )
+        body = await read_file(path)
+        return partial_response(body, byte_range, headers, mimetype)
+    # case-insensitive, so that Sanic's defaults don't duplicate our headers
+    return await response.file(
+        path,
+        mime_type=mimetype,
+        headers=Header(headers),
+        last_modified=validators.last_modified,
+        _range=byte_range,
+    )
+
+
+def transcode(body: bytes, codec: Codec, encoding: str) -> bytes:
+    r"""
+    Recompress a body compressed with codec into a content encoding, which
+    may be 'identity'.
+    """
+    body = codec.decompress(body)
+    if encoding == "identity":
+        return body
+    return compress(body, get_codec(encoding), FALLBACK_LEVEL)
+
+
+async def serve_compressed_file(
+    mimetype: str,
+    path: Union[PathLike, PackedFile],
+    request: Optional[Request] = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+    memory: Optional[FileCacheSlot] = None,
+) -> HTTPResponse:
+    r"""
+    Serve a file with the Content-Encoding of the codec it was stored with,
+    if the client accepts it. Otherwise it is recompressed with the fallback
+    encoding or, if that isn't accepted either, decompressed.
+    """
+    codec = codec_for_path(path.name if isinstance(path, PackedFile) else path)
+    serve = partial(
+        serve_file,
+        mimetype,
+        path,
+        request=request,
+        cache_control=cache_control,
+        memory=memory,
+    )
+    if codec is None:
+        return await serve()
+    vary = "Accept-Encoding"
+    encoding = accepted_encoding(request, [codec.content_encoding, FALLBACK_ENCODING])
+    if encoding == codec.content_encoding:
+        return await serve(encoding=encoding, vary=vary)
+
+    loop = asyncio.get_running_loop()
+    validators, _ = await loop.run_in_executor(None, stat_file, path)
+    validators = validators.encoded(encoding)
+    if is_not_modified(request, validators):
+        return not_modified(validators, cache_control, vary=vary)
+    # the stored file is what's kept in memory - clients that need it
+    # transcoded are rare enough that it isn't worth keeping both
+    body = await read_file_via_memory(path, memory)
+    body = await loop.run_in_executor(None, transcode, body, codec, encoding)
+    headers = validators.headers(cache_control)
+    headers["Accept-Ranges"] = "bytes"
+    headers["Vary"] = vary
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    byte_range = requested_range(request, validators, len(body))
+    if byte_range is not None:
+        body = body[byte_range.start : byte_range.end + 1]
+    return partial_response(body, byte_range, headers, mimetype)
+
+
+class PreparedJSON(NamedTuple):
+    validators: Validators
+    # the body in each content encoding it is available in, 'identity' (i.e.
+    # uncompressed) included
+    bodies: Dict[str, bytes]
+
+
+def prepare_json(data: Any) -> PreparedJSON:
+    body = json.dumps(data, separators=(",", ":")).encode()
+    bodies = {"identity": body}
+    if len(body) >= MIN_COMPRESSED_SIZE:
+        for encoding, level in JSON_ENCODINGS.items():
+            try:
+                bodies[encoding] = compress(body, get_codec(encoding), level)
+            except ImportError:
+                pass  # e.g. brotli isn't installed
+    return PreparedJSON(Validators(f'"{hashlib.sha1(body).hexdigest()}"'), bodies)
+
+
+def accepted_encoding(request: Optional[Request], available: Sequence[str]) -> str:
+    r"""
+    The first of the available content encodings that the Accept-Encoding of
+    a request allows, or 'identity' if none do.
+    """
+    if request is None:
+        return "identity"
+    accepted = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = item.partition(";")
+        q = params.strip()
+        if not (q.startswith("q=") and q[2:].strip("0. ") == ""):
+            accepted.add(encoding.strip().lower())
+    for encoding in available:
+        if encoding in accepted or ("*" in accepted and encoding != "identity"):
+            return encoding
+    return "identity"
+
+
+def serve_prepared_json(
+    prepared: PreparedJSON,
+    request: Optional[Request] = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+) -> HTTPResponse:
+    vary = "Accept-Encoding"
+    encoding = accepted_encoding(request, list(prepared.bodies))
+    validators = prepared.validators
+    if encoding != "identity":
+        validators = validators.encoded(encoding)
+    if is_not_modified(request, validators):
+        return not_modified(validators, cache_control, vary=vary)
+    headers = validators.headers(cache_control)
+    headers["Vary"] = vary
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return response.raw(
+        prepared.bodies[encoding], headers=headers, content_type=Mimetype.json
+    )
+
+
+class JSONCache:
+    r"""
+    Listings serialised (and compressed) once per revision of the adapter
+    they come from, rather than on every request.
+    """
+
+    def __init__(self) -> None:
+        self._prepared: Dict[Hashable, Tuple[int, PreparedJSON]] = {}
+
+    async def get(
+        self, key: Hashable, revision: int, data_f: Callable[[], Any]
+    ) -> PreparedJSON:
+        r"""
+        The prepared JSON of data_f() as of revision. data_f is only called
+        (and its result serialised, off the event loop) if the revision has
+        changed since. data_f may return an awaitable of the data.
+        """
+        cached = self._prepared.get(key)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+        data = data_f()
+        if inspect.isawaitable(data):
+            data = await data
+        loop = asyncio.get_running_loop()
+        prepared = await loop.run_in_executor(None, prepare_json, data)
+        self._prepared[key] = (revision, prepared)
+        return prepared
+
+
+def serve_json(
+    data: Any,
+    request: Optional[Request] = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+) -> HTTPResponse:
+    body = json.dumps(data, separators=(",", ":")).encode()
+    validators = Validators(f'"{hashlib.sha1(body).hexdigest()}"')
+    if is_not_modified(request, validators):
+        return not_modified(validators, cache_control)
+    return response.raw(
+        body, headers=validators.headers(cache_control), content_type=Mimetype.json
+    )
 
 
 serve_image_file = partial(serve_file, Mimetype.jpeg)
 serve_binary_file = partial(serve_file, Mimetype.binary)
-serve_gzip_binary_file = partial(serve_binary_file, gzip=True)
+serve_gzip_binary_file = partial(serve_binary_file, encoding="gzip")
+serve_compressed_binary_file = partial(serve_compressed_file, Mimetype.binary)
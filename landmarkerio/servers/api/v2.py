@@ -1,12 +1,34 @@
+from functools import partial
+from typing import Optional
+
 from loguru import logger
 from sanic import Blueprint
 from sanic.exceptions import SanicException
-from sanic.response import json
 
+from landmarkerio import MeshFormat, Mimetype
 from landmarkerio.asset import ImageAdapter, MeshAdapter
+from landmarkerio.atlas import AtlasAdapter
+from landmarkerio.batch import (
+    BATCH_CONCURRENCY,
+    MAX_BATCH_SIZE,
+    encode_batch_item,
+    ordered_map,
+)
 from landmarkerio.collection import CollectionAdapter, MissingCollection
+from landmarkerio.executor import AdapterExecutors, AdapterKind
+from landmarkerio.image import IMAGE_VARIANTS, accepted_variants
 from landmarkerio.landmark import LandmarkAdapter
-from landmarkerio.response import serve_gzip_binary_file, serve_image_file
+from landmarkerio.lru import FileCache, FileKind
+from landmarkerio.page import InvalidPageQuery, parse_page_query
+from landmarkerio.response import (
+    DEFAULT_CACHE_CONTROL,
+    JSONCache,
+    read_file_via_memory,
+    serve_compressed_binary_file,
+    serve_file,
+    serve_json,
+    serve_prepared_json,
+)
 from landmarkerio.template import MissingTemplate, TemplateAdapter
 
 
@@ -17,76 +39,329 @@ def build_v2_blueprint(
     image_adapter: ImageAdapter,
     mesh_adapter: MeshAdapter,
     landmark_adapter: LandmarkAdapter,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+    file_cache: Optional[FileCache] = None,
+    atlas_adapter: Optional[AtlasAdapter] = None,
+    executors: Optional[AdapterExecutors] = None,
 ) -> Blueprint:
     api = Blueprint("v2", url_prefix="/api/v2")
 
+    # adapters may block on the filesystem, so they are called on their own
+    # bounded pools of threads rather than on the event loop
+    if executors is None:
+        executors = AdapterExecutors()
+    collection_call = executors[AdapterKind.collection].run
+    template_call = executors[AdapterKind.template].run
+    image_call = executors[AdapterKind.image].run
+    mesh_call = executors[AdapterKind.mesh].run
+    landmark_call = executors[AdapterKind.landmark].run
+    atlas_call = executors[AdapterKind.atlas].run
+
+    # every response carries validators, so that clients revisiting an asset
+    # get a 304 rather than the whole payload again
+    def json(request, data):
+        return serve_json(data, request=request)
+
+    json_cache = JSONCache()
+
+    async def listing(request, key, revision, call, data_f):
+        # serialised and compressed once per revision of the adapter, unless
+        # the adapter can't tell when it has changed
+        if revision is None:
+            return json(request, await call(data_f))
+        prepared = await json_cache.get(key, revision, partial(call, data_f))
+        return serve_prepared_json(prepared, request=request)
+
+    def memory_slot(kind, asset_id, path):
+        if file_cache is None:
+            return None
+        return file_cache.slot(kind, asset_id, path)
+
+    async def serve_image(
+        request, kind, asset_id, path, mimetype=Mimetype.jpeg, vary=None
+    ):
+        return await serve_file(
+            mimetype,
+            path,
+            request=request,
+            cache_control=cache_control,
+            memory=memory_slot(kind, asset_id, path),
+            vary=vary,
+        )
+
+    async def serve_negotiated_image(request, kind, asset_id, path_f, variant_f):
+        # the first variant the client accepts that has been cached, else the
+        # JPEG that every asset has
+        for variant in accepted_variants(request.headers.get("Accept")):
+            try:
+                path = await image_call(variant_f, asset_id, variant)
+            except FileNotFoundError:
+                continue
+            mimetype = IMAGE_VARIANTS[variant].mimetype
+            return await serve_image(
+                request, kind, asset_id, path, mimetype=mimetype, vary="Accept"
+            )
+        path = await image_call(path_f, asset_id)
+        return await serve_image(request, kind, asset_id, path, vary="Accept")
+
+    def page_query(request):
+        # None if the whole list is wanted, as it was before pagination
+        try:
+            return parse_page_query(request.args)
+        except InvalidPageQuery as e:
+            raise SanicException(str(e), status_code=400)
+
     @api.route("/mode")
     async def get_mode(request):
-        return json(mode)
+        return json(request, mode)
 
     @api.route("/collections")
     async def collections(request):
-        return json(collection_adapter.collection_ids())
+        return await listing(
+            request,
+            "collections",
+            collection_adapter.revision(),
+            collection_call,
+            collection_adapter.collection_ids,
+        )
 
     @api.route("/collections/<collection_id>")
     async def collection(request, collection_id):
+        query = page_query(request)
         try:
-            return json(collection_adapter.collection(collection_id))
+            if query is None:
+                return await listing(
+                    request,
+                    ("collection", collection_id),
+                    collection_adapter.revision(),
+                    collection_call,
+                    partial(collection_adapter.collection, collection_id),
+                )
+            page = await collection_call(
+                collection_adapter.collection_page, collection_id, query
+            )
+            return json(request, page.as_json())
+        except InvalidPageQuery as e:
+            raise SanicException(str(e), status_code=400)
         except MissingCollection as e:
             raise SanicException(str(e), status_code=404)
 
     @api.route("/templates")
     async def templates(request):
-        return json(template_adapter.template_ids())
+        return await listing(
+            request,
+            "templates",
+            template_adapter.revision(),
+            template_call,
+            template_adapter.template_ids,
+        )
 
     @api.route("/templates/<t_id>")
     async def template(request, t_id):
         try:
-            return json(template_adapter.load_template(t_id))
+            return await listing(
+                request,
+                ("template", t_id),
+                template_adapter.revision(),
+                template_call,
+                partial(template_adapter.load_template, t_id),
+            )
         except MissingTemplate as e:
             raise SanicException(str(e), status_code=404)
 
     @api.route("/images")
     async def images(request):
-        return json(image_adapter.asset_ids())
+        query = page_query(request)
+        if query is None:
+            return await listing(
+                request,
+                "images",
+                image_adapter.revision(),
+                image_call,
+                image_adapter.asset_ids,
+            )
+        try:
+            page = await image_call(image_adapter.asset_ids_page, query)
+            return json(request, page.as_json())
+        except InvalidPageQuery as e:
+            raise SanicException(str(e), status_code=400)
 
     @api.route("/textures/<asset_id>")
     async def texture(request, asset_id):
         try:
-            return await serve_image_file(image_adapter.texture_path(asset_id))
+            await image_adapter.prepare(asset_id)
+            return await serve_negotiated_image(
+                request,
+                FileKind.texture,
+                asset_id,
+                image_adapter.texture_path,
+                image_adapter.texture_variant_path,
+            )
         except FileNotFoundError:
             raise SanicException(
                 status_code=404, message=f"Unable to find texture for {asset_id}"
             )
 
+    @api.route("/textures/<asset_id>/tiles")
+    async def texture_tiles(request, asset_id):
+        try:
+            await image_adapter.prepare(asset_id)
+            pyramid = await image_call(image_adapter.tile_pyramid, asset_id)
+            return json(request, pyramid)
+        except FileNotFoundError:
+            raise SanicException(
+                status_code=404, message=f"Unable to find tiles for {asset_id}"
+            )
+
+    @api.route("/textures/<asset_id>/<level:int>/<x:int>/<y:int>")
+    async def texture_tile(request, asset_id, level, x, y):
+        try:
+            await image_adapter.prepare(asset_id)
+            path = await image_call(image_adapter.tile_path, asset_id, level, x, y)
+            return await serve_image(request, FileKind.tile, asset_id, path)
+        except FileNotFoundError:
+            raise SanicException(
+                status_code=404,
+                message=f"Unable to find tile {level}/{x}/{y} for {asset_id}",
+            )
+
     @api.route("/thumbnails/<asset_id>")
     async def thumbnail(request, asset_id):
         try:
-            return await serve_image_file(image_adapter.thumbnail_path(asset_id))
+            await image_adapter.prepare(asset_id)
+            return await serve_negotiated_image(
+                request,
+                FileKind.thumbnail,
+                asset_id,
+                image_adapter.thumbnail_path,
+                image_adapter.thumbnail_variant_path,
+            )
         except FileNotFoundError:
             raise SanicException(
                 status_code=404, message=f"Unable to find thumbnail for {asset_id}"
             )
 
+    async def batch_asset_ids(request):
+        if request.method == "POST":
+            asset_ids = request.json
+            if not isinstance(asset_ids, list):
+                raise SanicException("Expected a list of asset ids", status_code=400)
+        elif "collection" in request.args:
+            try:
+                offset = max(int(request.args.get("offset", 0)), 0)
+                limit = max(int(request.args.get("limit", MAX_BATCH_SIZE)), 0)
+            except ValueError:
+                raise SanicException("Invalid offset or limit", status_code=400)
+            collection_id = request.args.get("collection")
+            try:
+                collection = await collection_call(
+                    collection_adapter.collection, collection_id
+                )
+            except MissingCollection as e:
+                raise SanicException(str(e), status_code=404)
+            asset_ids = collection[offset : offset + limit]
+        else:
+            asset_ids = request.args.getlist("id", [])
+        if len(asset_ids) > MAX_BATCH_SIZE:
+            raise SanicException(
+                f"At most {MAX_BATCH_SIZE} assets can be batched", status_code=400
+            )
+        return [str(a) for a in asset_ids]
+
+    @api.route("/thumbnails", methods=("GET", "POST"))
+    async def thumbnails(request):
+        # many thumbnails in one response, for browsing a collection. Missing
+        # thumbnails are sent as empty.
+        asset_ids = await batch_asset_ids(request)
+
+        async def read_thumbnail(asset_id):
+            try:
+                await image_adapter.prepare(asset_id)
+                path = await image_call(image_adapter.thumbnail_path, asset_id)
+                memory = memory_slot(FileKind.thumbnail, asset_id, path)
+                return asset_id, await read_file_via_memory(path, memory)
+            except FileNotFoundError:
+                return asset_id, None
+
+        response = await request.respond(content_type=Mimetype.batch)
+        async for asset_id, data in ordered_map(
+            read_thumbnail, asset_ids, BATCH_CONCURRENCY
+        ):
+            await response.send(encode_batch_item(asset_id, data))
+        await response.eof()
+
+    async def atlas(collection_id):
+        if atlas_adapter is None:
+            raise FileNotFoundError(f"No atlas available for {collection_id}")
+        # only the atlases of the collections being served are served
+        await collection_call(collection_adapter.collection, collection_id)
+        return await atlas_call(atlas_adapter.atlas, collection_id)
+
+    @api.route("/atlases/<collection_id>")
+    async def collection_atlas(request, collection_id):
+        try:
+            return json(request, await atlas(collection_id))
+        except (FileNotFoundError, MissingCollection) as e:
+            raise SanicException(str(e), status_code=404)
+
+    @api.route("/atlases/<collection_id>/<sheet:int>")
+    async def collection_atlas_sheet(request, collection_id, sheet):
+        try:
+            await atlas(collection_id)
+            path = await atlas_call(atlas_adapter.sheet_path, collection_id, sheet)
+            # atlases share the budget of the thumbnails they are made of
+            return await serve_image(request, FileKind.thumbnail, collection_id, path)
+        except (FileNotFoundError, MissingCollection) as e:
+            raise SanicException(str(e), status_code=404)
+
     @api.route("/landmarks")
     async def landmarks(request):
-        return json(landmark_adapter.asset_id_to_lm_id())
+        # a landmark database only reads its revision (a single row, which
+        # WAL mode never blocks) every so often, so it's asked directly
+        return await listing(
+            request,
+            "landmarks",
+            landmark_adapter.revision(),
+            landmark_call,
+            landmark_adapter.asset_id_to_lm_id,
+        )
+
+    @api.route("/landmarks", methods=("POST",))
+    async def landmarks_batch(request):
+        # many landmarks in one response, in the order of the [asset_id, lm_id]
+        # pairs posted. Missing landmarks are sent as null.
+        keys = request.json
+        if not isinstance(keys, list) or not all(
+            isinstance(k, list) and len(k) == 2 for k in keys
+        ):
+            raise SanicException(
+                "Expected a list of [asset_id, lm_id] pairs", status_code=400
+            )
+        if len(keys) > MAX_BATCH_SIZE:
+            raise SanicException(
+                f"At most {MAX_BATCH_SIZE} landmarks can be batched", status_code=400
+            )
+        keys = [(str(asset_id), str(lm_id)) for asset_id, lm_id in keys]
+        return json(request, await landmark_call(landmark_adapter.load_landmarks, keys))
 
     @api.route("/landmarks/<asset_id>")
     async def landmarks_subset(request, asset_id):
         try:
-            return json(landmark_adapter.landmark_ids(asset_id))
+            lm_ids = await landmark_call(landmark_adapter.landmark_ids, asset_id)
+            return json(request, lm_ids)
         except ValueError as e:
             raise SanicException(status_code=404, message=str(e))
 
     @api.route("/landmarks/<asset_id>/<lm_id>")
     async def landmark(request, asset_id, lm_id):
         try:
-            return json(landmark_adapter.load_landmark(asset_id, lm_id))
-        except BaseException:
+            lm = await landmark_call(landmark_adapter.load_landmark, asset_id, lm_id)
+            return json(request, lm)
+        except Exception:
             try:
                 logger.exception(f"Unable to load landmarks for {asset_id}/{lm_id}")
-                return json(template_adapter.load_template(lm_id))
+                template = await template_call(template_adapter.load_template, lm_id)
+                return json(request, template)
             except MissingTemplate:
                 raise SanicException(
                     status_code=404,
@@ -96,9 +371,11 @@ def build_v2_blueprint(
     @api.route("/landmarks/<asset_id>/<lm_id>", methods=("PUT",))
     async def upload_landmarks(request, asset_id, lm_id):
         try:
-            landmark_adapter.save_landmark(asset_id, lm_id, request.json)
-            return json("success")
-        except BaseException:
+            await landmark_call(
+                landmark_adapter.save_landmark, asset_id, lm_id, request.json
+            )
+            return serve_json("success")
+        except Exception:
             logger.exception(f"Unable to save landmarks for {asset_id}/{lm_id}")
             raise SanicException(
                 status_code=409, message=f"{asset_id}:{lm_id} unable to save"
@@ -106,13 +383,64 @@ def build_v2_blueprint(
 
     @api.route("/meshes")
     async def meshes(request):
-        return json(mesh_adapter.asset_ids())
+        query = page_query(request)
+        if query is None:
+            return await listing(
+                request,
+                "meshes",
+                mesh_adapter.revision(),
+                mesh_call,
+                mesh_adapter.asset_ids,
+            )
+        try:
+            page = await mesh_call(mesh_adapter.asset_ids_page, query)
+            return json(request, page.as_json())
+        except InvalidPageQuery as e:
+            raise SanicException(str(e), status_code=400)
 
     @api.route("/meshes/<asset_id>")
     async def mesh(request, asset_id):
+        mesh_format = request.args.get("format", MeshFormat.expanded)
+        if mesh_format not in (MeshFormat.expanded, MeshFormat.indexed):
+            raise SanicException(
+                f"Unknown mesh format '{mesh_format}'", status_code=400
+            )
+        lod: Optional[int] = None
+        lod_arg = request.args.get("lod")
+        if lod_arg is not None:
+            try:
+                lod = int(lod_arg)
+            except ValueError:
+                raise SanicException(
+                    f"Invalid level of detail '{lod_arg}'", status_code=400
+                )
         try:
-            return await serve_gzip_binary_file(mesh_adapter.mesh_path(asset_id))
+            await mesh_adapter.prepare(asset_id)
+            if lod is not None:
+                path = await mesh_call(
+                    mesh_adapter.lod_mesh_path, asset_id, lod, mesh_format
+                )
+            elif mesh_format == MeshFormat.indexed:
+                path = await mesh_call(mesh_adapter.indexed_mesh_path, asset_id)
+            else:
+                path = await mesh_call(mesh_adapter.mesh_path, asset_id)
+            return await serve_compressed_binary_file(
+                path,
+                request=request,
+                cache_control=cache_control,
+                memory=memory_slot(FileKind.mesh, asset_id, path),
+            )
         except FileNotFoundError:
             raise SanicException(f"Unable to find mesh for {asset_id}", status_code=404)
 
+    @api.route("/meshes/<asset_id>/lods")
+    async def mesh_lods(request, asset_id):
+        try:
+            await mesh_adapter.prepare(asset_id)
+            return json(request, await mesh_call(mesh_adapter.mesh_lods, asset_id))
+        except FileNotFoundError:
+            raise SanicException(
+                f"Unable to find levels of detail for {asset_id}", status_code=404
+            )
+
     return api
@@ -1,21 +1,38 @@
-from typing import Optional
+from typing import Iterator, Mapping, Optional, Sequence
 
 from sanic import Blueprint, Sanic
 from sanic_cors import CORS
 
-from landmarkerio.asset import ImageCacheAdapter, MeshCacheAdapter
+from landmarkerio.asset import (
+    ImageAdapter,
+    ImageCacheAdapter,
+    LazyImageCacheAdapter,
+    LazyMeshCacheAdapter,
+    MeshAdapter,
+    MeshCacheAdapter,
+    PackedImageAdapter,
+    PackedMeshAdapter,
+)
+from landmarkerio.atlas import AtlasAdapter
 from landmarkerio.collection import (
+    AllAssetsCollectionAdapter,
     AllCacheCollectionAdapter,
     CollectionAdapter,
     FileCollectionAdapter,
 )
+from landmarkerio.executor import AdapterExecutors
 from landmarkerio.http_auth.sanic_httpauth import HTTPBasicAuth
 from landmarkerio.landmark import LandmarkAdapter
+from landmarkerio.lazy import LazyCacher
+from landmarkerio.lru import FileCache
+from landmarkerio.pack import Pack, is_pack
+from landmarkerio.response import DEFAULT_CACHE_CONTROL
 from landmarkerio.servers.api.v2 import build_v2_blueprint
 from landmarkerio.servers.auth import verify_password
 from landmarkerio.template import CachedFileTemplateAdapter
 from landmarkerio.types import PathLike
 from landmarkerio.utils import DIMS
+from landmarkerio.watch import AssetsListener, AssetWatcher
 
 
 def add_basic_auth_to_api(api: Blueprint, username: str, password: str) -> None:
@@ -31,6 +48,45 @@ def add_basic_auth_to_api(api: Blueprint, username: str, password: str) -> None:
         pass
 
 
+def collection_order(collection_adapter: CollectionAdapter) -> Iterator[str]:
+    for collection_id in collection_adapter.collection_ids():
+        yield from collection_adapter.collection(collection_id)
+
+
+def add_lazy_caching(app: Sanic, cacher: LazyCacher, order: Iterator[str]) -> None:
+    @app.after_server_start
+    async def start_warming(app):
+        app.add_task(cacher.warm(order), name="lmio_warm_cache")
+
+    @app.before_server_stop
+    async def stop_caching(app):
+        cacher.close()
+
+
+def add_watcher(
+    app: Sanic, watcher: AssetWatcher, listeners: Sequence[AssetsListener]
+) -> None:
+    @app.after_server_start
+    async def start_watching(app):
+        app.add_task(watcher.run(listeners), name="lmio_watch_assets")
+
+    @app.before_server_stop
+    async def stop_watching(app):
+        watcher.cacher.close()
+
+
+def add_file_cache_stats(app: Sanic, file_cache: FileCache) -> None:
+    @app.before_server_stop
+    async def log_file_cache_stats(app):
+        file_cache.log_stats()
+
+
+def add_adapter_executor_stats(app: Sanic, executors: AdapterExecutors) -> None:
+    @app.before_server_stop
+    async def log_adapter_executor_stats(app):
+        executors.log_stats()
+
+
 def serve_from_cache(
     mode: str,
     cache_dir: PathLike,
@@ -39,6 +95,11 @@ def serve_from_cache(
     collection_dir: Optional[PathLike] = None,
     username: Optional[str] = None,
     password: Optional[str] = None,
+    lazy_cacher: Optional[LazyCacher] = None,
+    watcher: Optional[AssetWatcher] = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+    memory_budgets: Optional[Mapping[str, int]] = None,
+    adapter_threads: Optional[Mapping[str, int]] = None,
 ):
     app = Sanic(name="landmarkerio")
     CORS(app)
@@ -46,14 +107,57 @@ def serve_from_cache(
     n_dims = DIMS[mode]
     template_adapter = CachedFileTemplateAdapter(n_dims, template_dir=template_dir)
 
+    # a cache packed by lmiopack is served from its segments
+    packed = lazy_cacher is None and is_pack(cache_dir)
+
     collection_adapter: CollectionAdapter
     if collection_dir is not None:
         collection_adapter = FileCollectionAdapter(collection_dir)
+    elif lazy_cacher is not None:
+        collection_adapter = AllAssetsCollectionAdapter(lazy_cacher.asset_ids)
+    elif packed:
+        collection_adapter = AllAssetsCollectionAdapter(Pack(cache_dir).asset_ids())
     else:
         collection_adapter = AllCacheCollectionAdapter(cache_dir)
 
-    image_adapter = ImageCacheAdapter(cache_dir)
-    mesh_adapter = MeshCacheAdapter(cache_dir)
+    image_adapter: ImageAdapter
+    mesh_adapter: MeshAdapter
+    if packed:
+        image_adapter = PackedImageAdapter(cache_dir)
+        mesh_adapter = PackedMeshAdapter(cache_dir)
+    elif lazy_cacher is not None:
+        # assets are cached as they are requested, or in the background
+        image_adapter = LazyImageCacheAdapter(cache_dir, lazy_cacher, mode)
+        mesh_adapter = LazyMeshCacheAdapter(cache_dir, lazy_cacher, mode)
+        add_lazy_caching(app, lazy_cacher, collection_order(collection_adapter))
+    else:
+        image_adapter = ImageCacheAdapter(cache_dir)
+        mesh_adapter = MeshCacheAdapter(cache_dir)
+
+    # thumbnail atlases, which are kept up to date as collections change
+    atlas_adapter = AtlasAdapter(
+        cache_dir, collection_adapter=None if packed else collection_adapter
+    )
+
+    # hot files are kept in memory by each worker
+    file_cache = FileCache(memory_budgets)
+    add_file_cache_stats(app, file_cache)
+
+    # adapters are called on bounded pools of threads, off the event loop
+    executors = AdapterExecutors(adapter_threads)
+    add_adapter_executor_stats(app, executors)
+
+    if watcher is not None:
+        # new assets are cached and listed while the server is running
+        listeners = [
+            collection_adapter.update_assets,
+            image_adapter.update_assets,
+            mesh_adapter.update_assets,
+            landmark_adapter.update_assets,
+            file_cache.update_assets,
+            atlas_adapter.update_assets,
+        ]
+        add_watcher(app, watcher, listeners)
 
     v2_api = build_v2_blueprint(
         mode,
@@ -62,6 +166,10 @@ def serve_from_cache(
         image_adapter,
         mesh_adapter,
         landmark_adapter,
+        cache_control=cache_control,
+        file_cache=file_cache,
+        atlas_adapter=atlas_adapter,
+        executors=executors,
     )
     app.blueprint(v2_api)
 
@@ -0,0 +1,37 @@
+import hashlib
+from typing import NamedTuple
+
+
+class Shard(NamedTuple):
+    r"""
+    One of count disjoint partitions of a set of assets, so that several
+    machines can each build a part of the same cache.
+    """
+
+    index: int
+    count: int
+
+    def __contains__(self, asset_id: object) -> bool:
+        return asset_shard(str(asset_id), self.count) == self.index
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def asset_shard(asset_id: str, count: int) -> int:
+    # a stable hash - Python's hash() is salted per process
+    digest = hashlib.sha1(asset_id.encode("utf8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def parse_shard(value: str) -> Shard:
+    r"""
+    Parse a shard given as 'i/n', where 0 <= i < n.
+    """
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Expected a shard of the form 'i/n' - got '{value}'")
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be in [0, {count}) - got {index}")
+    return Shard(index, count)
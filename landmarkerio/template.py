@@ -138,6 +138,13 @@ class TemplateAdapter(abc.ABC):
     def load_template(self, lm_id: str):
         pass
 
+    def revision(self) -> Optional[int]:
+        r"""
+        A number that changes whenever the templates do, or None if the
+        adapter can't tell.
+        """
+        return None
+
 
 class FileTemplateAdapter(TemplateAdapter):
     def __init__(self, n_dims: int, template_dir: Optional[PathLike] = None) -> None:
@@ -181,8 +188,15 @@ class CachedFileTemplateAdapter(FileTemplateAdapter):
             "cached {} templates ({})", len(self._cache), ", ".join(self._cache.keys())
         )
 
+    def template_ids(self) -> Sequence[str]:
+        # only the templates that were cached can be loaded
+        return list(self._cache)
+
     def load_template(self, lm_id: str):
         try:
             return self._cache[lm_id]
         except KeyError:
             raise MissingTemplate(lm_id)
+
+    def revision(self) -> Optional[int]:
+        return 0
@@ -0,0 +1,91 @@
+import asyncio
+import shutil
+
+from PIL import Image
+
+from landmarkerio import CacheFile
+from landmarkerio.atlas import AtlasAdapter, atlas_dir, build_atlas, build_atlases
+from landmarkerio.collection import AllAssetsCollectionAdapter
+
+
+def _cache(cache_dir, asset_id, colour, size=(64, 32)):
+    asset_cache_dir = cache_dir / asset_id
+    asset_cache_dir.mkdir(parents=True)
+    image = Image.new("RGB", size, colour)
+    image.save(asset_cache_dir / CacheFile.thumbnail, format="jpeg")
+
+
+def test_atlas_indexes_the_rectangle_of_each_thumbnail(tmp_path):
+    for i, asset_id in enumerate("abcde"):
+        _cache(tmp_path, asset_id, (50 * i, 0, 0))
+    # 2 x 2 cells per sheet
+    index = build_atlas(tmp_path, "all", list("abcde"), cell_size=16, sheet_size=32)
+
+    assert len(index["sheets"]) == 2
+    assert index["assets"]["a"] == {
+        "sheet": 0,
+        "x": 0,
+        "y": 0,
+        "width": 16,
+        "height": 8,
+    }
+    assert index["assets"]["d"] == {
+        "sheet": 0,
+        "x": 16,
+        "y": 16,
+        "width": 16,
+        "height": 8,
+    }
+    assert index["assets"]["e"]["sheet"] == 1
+
+    adapter = AtlasAdapter(tmp_path)
+    assert adapter.atlas("all") == index
+    with Image.open(adapter.sheet_path("all", 1)) as sheet:
+        assert sheet.size == (16, 16)
+        assert sheet.getpixel((4, 4))[0] > 150
+
+
+def test_rebuilding_an_atlas_redraws_only_changed_sheets(tmp_path):
+    for asset_id in "abcde":
+        _cache(tmp_path, asset_id, (0, 0, 0))
+    first = build_atlas(tmp_path, "all", list("abcde"), cell_size=16, sheet_size=32)
+    unchanged = AtlasAdapter(tmp_path).sheet_path("all", 0)
+    inode = unchanged.stat().st_ino
+
+    # a new asset and a recached one, both on the second sheet
+    _cache(tmp_path, "f", (255, 0, 0))
+    shutil.rmtree(tmp_path / "e")
+    _cache(tmp_path, "e", (0, 255, 0))
+    second = build_atlas(tmp_path, "all", list("abcdef"))
+
+    assert second["cell_size"] == 16
+    assert second["sheets"][0] == first["sheets"][0]
+    assert unchanged.stat().st_ino == inode
+    assert second["sheets"][1]["key"] != first["sheets"][1]["key"]
+    assert second["assets"]["f"]["sheet"] == 1
+    assert len(list(atlas_dir(tmp_path, "all").glob("*.jpg"))) == 2
+
+
+def test_atlases_of_removed_collections_are_removed(tmp_path):
+    _cache(tmp_path, "a", (0, 0, 0))
+    build_atlases(tmp_path, {"x": ["a"], "y": ["a", "missing"]})
+    assert AtlasAdapter(tmp_path).atlas("y")["assets"].keys() == {"a"}
+
+    build_atlases(tmp_path, {"y": ["a"]})
+    assert not atlas_dir(tmp_path, "x").exists()
+
+
+def test_adapter_rebuilds_atlases_when_collections_change(tmp_path):
+    _cache(tmp_path, "a", (0, 0, 0))
+    build_atlases(tmp_path, {"all": ["a"]})
+    collection_adapter = AllAssetsCollectionAdapter(["a"])
+    adapter = AtlasAdapter(tmp_path, collection_adapter=collection_adapter)
+
+    async def update():
+        _cache(tmp_path, "b", (0, 0, 0))
+        collection_adapter.update_assets({"b": tmp_path / "b"}, [])
+        adapter.update_assets({"b": tmp_path / "b"}, [])
+        await adapter._rebuilding
+
+    asyncio.run(update())
+    assert list(adapter.atlas("all")["assets"]) == ["a", "b"]
@@ -0,0 +1,28 @@
+import asyncio
+
+from landmarkerio.batch import decode_batch, encode_batch_item, ordered_map
+
+
+def test_batch_round_trip():
+    body = encode_batch_item("a/é", b"jpeg") + encode_batch_item("b", None)
+    assert list(decode_batch(body)) == [("a/é", b"jpeg"), ("b", b"")]
+
+
+def test_ordered_map_keeps_order_and_bounds_concurrency():
+    running = []
+    max_running = 0
+
+    async def f(i):
+        nonlocal max_running
+        running.append(i)
+        max_running = max(max_running, len(running))
+        # later items finish first
+        await asyncio.sleep(0.001 * (10 - i))
+        running.remove(i)
+        return i * 2
+
+    async def collect():
+        return [r async for r in ordered_map(f, range(10), 3)]
+
+    assert asyncio.run(collect()) == [i * 2 for i in range(10)]
+    assert max_running == 3
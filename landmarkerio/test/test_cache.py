@@ -0,0 +1,84 @@
+import json
+from importlib.machinery import SourceFileLoader
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from landmarkerio import CacheFile
+from landmarkerio.cache import _cache_mesh_for_id
+from landmarkerio.manifest import CacheManifest
+
+SCRIPT_DIR = Path(__file__).parent.parent
+
+
+def _load_script(name):
+    loader = SourceFileLoader(name, str(SCRIPT_DIR / name))
+    module = ModuleType(loader.name)
+    loader.exec_module(module)
+    return module
+
+
+class _Loader:
+    def __init__(self, factory):
+        self.factory = factory
+
+    def load(self):
+        return self
+
+    def prepare(self, **kwargs):
+        pass
+
+
+class _Sanic:
+    @staticmethod
+    def serve(primary, app_loader):
+        pass
+
+
+def test_lmio_serves_cache_built_by_lmiocache_as_built(tmp_path, monkeypatch):
+    asset_dir = tmp_path / "assets"
+    cache_dir = tmp_path / "cache"
+    asset_dir.mkdir()
+    for asset_id in ("a", "b"):
+        Image.new("RGB", (300, 200), "red").save(asset_dir / f"{asset_id}.jpg")
+
+    lmiocache = _load_script("lmiocache")
+    args = ["image", str(asset_dir), str(cache_dir), "--serial"]
+    args += ["--tile-size", "64", "--pyramid-min-size", "100"]
+    lmiocache.main(lmiocache.build_argparser().parse_args(args))
+    options = CacheManifest(cache_dir).options
+    assert options == {"tile_size": 64, "pyramid_min_size": 100}
+    texture = cache_dir / "a.jpg" / CacheFile.texture
+    cached_at = texture.stat().st_mtime_ns
+
+    lmio = _load_script("lmio")
+    monkeypatch.setattr(lmio, "AppLoader", _Loader)
+    monkeypatch.setattr(lmio, "Sanic", _Sanic)
+    args = ["image", str(asset_dir), "--cache", str(cache_dir)]
+    lmio.main(lmio.build_argparser().parse_args(args))
+
+    # nothing was recached with the default options
+    assert CacheManifest(cache_dir).options == options
+    assert texture.stat().st_mtime_ns == cached_at
+
+    # and rerunning lmiocache without the options keeps them too
+    args = ["image", str(asset_dir), str(cache_dir), "--serial"]
+    lmiocache.main(lmiocache.build_argparser().parse_args(args))
+    assert CacheManifest(cache_dir).options == options
+    assert texture.stat().st_mtime_ns == cached_at
+
+
+def test_lods_without_triangles_are_skipped(tmp_path):
+    points = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+    trilist = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+    tetrahedron = SimpleNamespace(points=points, trilist=trilist)
+    (tmp_path / "tet").mkdir()
+    _cache_mesh_for_id(tmp_path, "tet", tetrahedron, codec="gzip", lods=[0.25, 0.5])
+
+    with (tmp_path / "tet" / CacheFile.mesh_lods).open("rt") as f:
+        levels = json.load(f)
+    # no clustering of a tetrahedron keeps fewer than all four triangles
+    assert levels == [{"lod": 0, "fraction": 1.0, "n_points": 4, "n_tris": 4}]
+    assert not list((tmp_path / "tet").glob("*_lod[0-9]*"))
@@ -0,0 +1,79 @@
+import os
+import time
+from pathlib import Path
+
+from landmarkerio import discovery
+from landmarkerio.discovery import (
+    discover_paths,
+    matches_glob,
+    read_path_list,
+    split_glob,
+)
+
+
+def _touch(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_split_glob():
+    assert split_glob("*.jpg") == (False, "*.jpg")
+    assert split_glob(os.path.join("**", "*")) == (True, "*")
+    assert split_glob(os.path.join("a", "*.jpg")) is None
+
+
+def test_matches_glob_as_discovery_would(tmp_path):
+    root = tmp_path / "assets"
+    for rel in ("a.jpg", "b.JPG", "c.txt", ".d.jpg", "sub/e.jpg", ".sub/f.jpg"):
+        (root / rel).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel).write_bytes(b"")
+    for glob_pattern in ("*", "**/*", "**/[ab].*"):
+        found = set(discover_paths(root, glob_pattern, [".jpg"]))
+        matched = {
+            p for p in root.rglob("*") if matches_glob(root, glob_pattern, p, [".jpg"])
+        }
+        assert matched == found
+    assert not matches_glob(root, "**/*", tmp_path / "elsewhere.jpg")
+
+
+def test_discovery_only_relists_changed_dirs(tmp_path, monkeypatch):
+    root = tmp_path / "assets"
+    for d in ("a", "b", os.path.join("b", "c")):
+        (root / d).mkdir(parents=True)
+        (root / d / "x.jpg").write_bytes(b"")
+        (root / d / "x.txt").write_bytes(b"")
+    (root / ".hidden").mkdir()
+    (root / ".hidden" / "y.jpg").write_bytes(b"")
+    an_hour_ago = time.time() - 3600
+    for d in ("", "a", "b", os.path.join("b", "c")):
+        _touch(root / d, an_hour_ago)
+
+    index_path = tmp_path / "index.json"
+    glob = os.path.join("**", "*")
+    paths = discover_paths(root, glob, [".jpg"], index_path=index_path)
+    assert [p.relative_to(root).parts for p in paths] == [
+        ("a", "x.jpg"),
+        ("b", "c", "x.jpg"),
+        ("b", "x.jpg"),
+    ]
+
+    listed = []
+    list_dir = discovery._list_dir
+    monkeypatch.setattr(
+        discovery,
+        "_list_dir",
+        lambda path, *a: listed.append(path) or list_dir(path, *a),
+    )
+    (root / "b" / "c" / "new.jpg").write_bytes(b"")
+    paths = discover_paths(root, glob, [".jpg"], index_path=index_path)
+    assert listed == [root / "b" / "c"]
+    assert root / "b" / "c" / "new.jpg" in paths
+    assert len(paths) == 4
+
+
+def test_read_path_list(tmp_path):
+    listing = tmp_path / "list.txt"
+    listing.write_text("a.jpg\n\n# a comment\n/abs/b.jpg\n")
+    assert read_path_list(str(listing), tmp_path) == [
+        tmp_path / "a.jpg",
+        Path("/abs/b.jpg"),
+    ]
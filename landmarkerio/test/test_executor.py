@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+
+from landmarkerio.executor import (
+    AdapterExecutor,
+    AdapterExecutors,
+    AdapterKind,
+    parse_adapter_threads,
+)
+
+
+def test_calls_are_bounded_and_queue_depth_is_counted():
+    executor = AdapterExecutor("landmark", 2)
+    release = threading.Event()
+    threads = set()
+
+    def blocking(i):
+        threads.add(threading.current_thread().name)
+        release.wait(5)
+        return i
+
+    async def run():
+        calls = [asyncio.ensure_future(executor.run(blocking, i)) for i in range(5)]
+        await asyncio.sleep(0.1)
+        stats = executor.stats()
+        release.set()
+        return stats, await asyncio.gather(*calls)
+
+    stats, results = asyncio.run(run())
+    assert results == list(range(5))
+    assert (stats["running"], stats["queued"]) == (2, 3)
+    assert executor.peak_queued >= 3 and executor.calls == 5
+    assert len(threads) == 2 and threading.current_thread().name not in threads
+
+
+def test_no_threads_calls_on_the_event_loop():
+    executors = AdapterExecutors({AdapterKind.collection: 0})
+
+    async def run():
+        return await executors[AdapterKind.collection].run(
+            lambda: threading.current_thread().name
+        )
+
+    assert asyncio.run(run()) == threading.current_thread().name
+    assert executors.stats()[AdapterKind.collection]["calls"] == 1
+    assert executors.stats()[AdapterKind.landmark]["threads"] == 8
+
+
+def test_parse_adapter_threads():
+    assert parse_adapter_threads("landmark=32") == ("landmark", 32)
+    for arg in ("landmark", "texture=4", "mesh=-1"):
+        with pytest.raises(ValueError):
+            parse_adapter_threads(arg)
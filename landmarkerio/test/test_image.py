@@ -0,0 +1,17 @@
+from landmarkerio import CacheFile
+from landmarkerio.image import accepted_variants, variant_file
+
+
+def test_accepted_variants_are_in_order_of_preference():
+    accept = "image/webp,image/avif;q=0.9,image/*,*/*;q=0.8"
+    assert accepted_variants(accept) == ["avif", "webp"]
+
+
+def test_wildcards_and_refused_variants_are_not_accepted():
+    assert accepted_variants("image/*,*/*") == []
+    assert accepted_variants("image/avif;q=0, image/webp") == ["webp"]
+    assert accepted_variants(None) == []
+
+
+def test_variant_file_replaces_the_suffix():
+    assert variant_file(CacheFile.thumbnail, "webp") == "thumbnail.webp"
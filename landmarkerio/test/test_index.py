@@ -0,0 +1,50 @@
+import json
+import os
+
+from landmarkerio import MANIFEST_FILENAME, CacheFile
+from landmarkerio.index import CacheIndex, sync_index
+
+
+def _cache(cache_dir, asset_id, files):
+    (cache_dir / asset_id).mkdir()
+    for name in files:
+        content = b"" if name != CacheFile.image else b'{"width": 4, "height": 3}'
+        (cache_dir / asset_id / name).write_bytes(content)
+
+
+def test_index_lists_cached_assets(tmp_path):
+    _cache(tmp_path, "a", [CacheFile.image, CacheFile.texture])
+    _cache(tmp_path, "b", [CacheFile.mesh])
+    _cache(tmp_path, "c", [CacheFile.mesh, CacheFile.image, CacheFile.texture])
+    (tmp_path / MANIFEST_FILENAME).write_text(json.dumps({}))
+    assert CacheIndex.open(tmp_path) is None
+
+    sync_index(tmp_path, ["a", "b", "c"])
+    index = CacheIndex.open(tmp_path)
+    assert index.asset_ids() == ["a", "b", "c"]
+    assert index.image_asset_ids() == ["a", "c"]
+    assert index.mesh_asset_ids() == ["b", "c"]
+    a = index.asset("a")
+    assert (a.kind, a.files, a.width, a.height) == (
+        "image",
+        [CacheFile.image, CacheFile.texture],
+        4,
+        3,
+    )
+
+    sync_index(tmp_path, ["a", "c"])
+    assert CacheIndex.open(tmp_path).asset_ids() == ["a", "c"]
+    assert CacheIndex.open(tmp_path).asset("b") is None
+
+
+def test_index_is_ignored_once_the_manifest_changes(tmp_path):
+    _cache(tmp_path, "a", [CacheFile.image])
+    manifest = tmp_path / MANIFEST_FILENAME
+    manifest.write_text(json.dumps({}))
+    sync_index(tmp_path, ["a"])
+    assert CacheIndex.open(tmp_path) is not None
+
+    # e.g. a lazy server has since cached more assets
+    st = os.stat(manifest)
+    os.utime(manifest, ns=(st.st_atime_ns, st.st_mtime_ns + 10**10))
+    assert CacheIndex.open(tmp_path) is None
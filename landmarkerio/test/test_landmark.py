@@ -0,0 +1,147 @@
+import pickle
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from landmarkerio import landmark
+from landmarkerio.landmark import (
+    InplaceFileLmAdapter,
+    SeparateDirFileLmAdapter,
+    SQLiteLmAdapter,
+    export_landmark_dir,
+    import_landmark_dir,
+)
+
+
+def test_separate_dir_landmarks_are_indexed_and_kept_up_to_date(tmp_path):
+    lm_dir = tmp_path / "landmarks"
+    (lm_dir / "a.b").mkdir(parents=True)
+    (lm_dir / "a.b" / "face.ljson").write_text("{}")
+    (lm_dir / "a.b" / "notes.txt").write_text("")
+    (lm_dir / "empty").mkdir()
+
+    adapter = SeparateDirFileLmAdapter(lm_dir)
+    assert adapter.asset_id_to_lm_id() == {"a.b": ("face",)}
+    revision = adapter.revision()
+
+    adapter.save_landmark("c", "ibug68", {})
+    adapter.save_landmark("a.b", "ear", {})
+    assert adapter.landmark_ids("a.b") == ["ear", "face"]
+    assert adapter.landmark_ids("c") == ["ibug68"]
+    assert adapter.landmark_ids("missing") == []
+    assert adapter.revision() != revision
+
+    # saving over an existing landmark doesn't change the listing
+    revision = adapter.revision()
+    adapter.save_landmark("c", "ibug68", {"points": []})
+    assert adapter.revision() == revision
+
+    # a fresh adapter finds the same landmarks on disk
+    assert SeparateDirFileLmAdapter(lm_dir).asset_id_to_lm_id() == {
+        "a.b": ("ear", "face"),
+        "c": ("ibug68",),
+    }
+
+
+def test_inplace_landmarks_follow_added_and_removed_assets(tmp_path):
+    for name in "ab":
+        (tmp_path / f"{name}.jpg").write_bytes(b"")
+    (tmp_path / "a.ljson").write_text("{}")
+    adapter = InplaceFileLmAdapter({n: tmp_path / f"{n}.jpg" for n in "ab"})
+    assert adapter.asset_id_to_lm_id() == {"a": ("inplace",)}
+
+    adapter.save_landmark("b", "whatever", {})
+    assert (tmp_path / "b.ljson").exists()
+    assert adapter.asset_id_to_lm_id().keys() == {"a", "b"}
+
+    (tmp_path / "c.jpg").write_bytes(b"")
+    (tmp_path / "c.ljson").write_text("{}")
+    adapter.update_assets({"c": tmp_path / "c.jpg"}, ["a"])
+    assert adapter.asset_id_to_lm_id() == {"b": ("inplace",), "c": ("inplace",)}
+
+
+def test_file_landmark_adapters_can_be_sent_to_workers(tmp_path):
+    for name in "ab":
+        (tmp_path / f"{name}.jpg").write_bytes(b"")
+    (tmp_path / "a.ljson").write_text("{}")
+    adapters = [
+        InplaceFileLmAdapter({n: tmp_path / f"{n}.jpg" for n in "ab"}),
+        SeparateDirFileLmAdapter(tmp_path / "landmarks"),
+    ]
+    for adapter in adapters:
+        copy = pickle.loads(pickle.dumps(adapter))
+        copy.save_landmark("b", "face", {})
+        assert "b" in copy.asset_id_to_lm_id()
+        assert copy.revision() != adapter.revision()
+
+
+def test_sqlite_landmarks_are_listed_loaded_and_saved(tmp_path):
+    db_path = tmp_path / "landmarks.db"
+    adapter = SQLiteLmAdapter(db_path)
+    revision = adapter.revision()
+    adapter.save_landmark("a", "face", {"points": [1]})
+    adapter.save_landmark("a", "ear", {"points": [2]})
+    adapter.save_landmark("b", "face", {"points": [3]})
+    assert adapter.revision() != revision
+
+    # overwriting a landmark doesn't change the listing
+    revision = adapter.revision()
+    adapter.save_landmark("a", "face", {"points": [4]})
+    assert adapter.revision() == revision
+
+    # as seen by another server process
+    other = SQLiteLmAdapter(db_path)
+    assert other.asset_id_to_lm_id() == {"a": ["ear", "face"], "b": ["face"]}
+    assert other.landmark_ids("a") == ["ear", "face"]
+    assert other.landmark_ids("c") == []
+    assert other.load_landmark("a", "face") == {"points": [4]}
+    assert other.load_landmarks([["b", "face"], ("b", "ear"), ("a", "ear")]) == [
+        {"points": [3]},
+        None,
+        {"points": [2]},
+    ]
+    with sqlite3.connect(str(db_path)) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_sqlite_revision_is_only_read_every_so_often(tmp_path, monkeypatch):
+    monkeypatch.setattr(landmark, "LANDMARK_DB_REVISION_TTL", 3600.0)
+    db_path = tmp_path / "landmarks.db"
+    adapter, other = SQLiteLmAdapter(db_path), SQLiteLmAdapter(db_path)
+    revision = adapter.revision()
+
+    # another process's save is only seen once the revision is read again
+    other.save_landmark("a", "face", {})
+    assert adapter.revision() == revision
+    # whereas our own are seen straight away
+    adapter.save_landmark("b", "face", {})
+    assert adapter.revision() == revision + 2
+
+    monkeypatch.setattr(landmark, "LANDMARK_DB_REVISION_TTL", 0.0)
+    other.save_landmark("c", "face", {})
+    assert adapter.revision() == revision + 3
+
+
+def test_sqlite_landmarks_are_saved_concurrently(tmp_path):
+    adapter = SQLiteLmAdapter(tmp_path / "landmarks.db")
+    with ThreadPoolExecutor(8) as executor:
+        list(
+            executor.map(
+                lambda i: adapter.save_landmark(str(i % 10), str(i), {"i": i}),
+                range(100),
+            )
+        )
+    assert sum(len(lm_ids) for lm_ids in adapter.asset_id_to_lm_id().values()) == 100
+
+
+def test_landmark_dirs_round_trip_through_a_database(tmp_path):
+    lm_dir = tmp_path / "lmiolandmarks"
+    files = SeparateDirFileLmAdapter(lm_dir)
+    files.save_landmark("a", "face", {"points": [[1.5, 2.0]]})
+    files.save_landmark("b", "face", {"points": []})
+
+    assert import_landmark_dir(lm_dir, tmp_path / "landmarks.db") == 2
+    exported = tmp_path / "exported"
+    assert export_landmark_dir(tmp_path / "landmarks.db", exported) == 2
+    for asset_id in "ab":
+        original = (lm_dir / asset_id / "face.ljson").read_text()
+        assert (exported / asset_id / "face.ljson").read_text() == original
@@ -0,0 +1,100 @@
+import asyncio
+from functools import partial
+from pathlib import Path
+
+from landmarkerio import MANIFEST_FILENAME, CacheFile
+from landmarkerio.asset import LazyImageCacheAdapter, LazyMeshCacheAdapter
+from landmarkerio.lazy import LazyCacher
+
+
+def _copy_asset(cache_dir, path, asset_id):
+    # module level so that it can be sent to the worker processes
+    asset_cache_dir = Path(cache_dir) / asset_id
+    asset_cache_dir.mkdir()
+    (asset_cache_dir / "asset").write_bytes(Path(path).read_bytes())
+
+
+def _cache_mesh(cache_dir, path, asset_id):
+    asset_cache_dir = Path(cache_dir) / asset_id
+    asset_cache_dir.mkdir()
+    (asset_cache_dir / (CacheFile.mesh_raw + ".gz")).write_bytes(b"")
+    if "textured" in asset_id:
+        (asset_cache_dir / CacheFile.image).write_text("{}")
+
+
+def test_lazy_cacher_caches_on_demand(tmp_path):
+    paths = []
+    for asset_id in ("a", "b", "c"):
+        path = tmp_path / asset_id
+        path.write_bytes(asset_id.encode())
+        paths.append((path, asset_id))
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    cacher = LazyCacher(cache_dir, n_jobs=1)
+    assert list(cacher.defer(partial(_copy_asset, cache_dir), paths)) == []
+    assert all(cacher.is_pending(a) for _, a in paths)
+
+    async def run():
+        # concurrent requests for the same asset share one job
+        await asyncio.gather(*[cacher.ensure("b") for _ in range(3)])
+        assert not cacher.is_pending("b") and cacher.is_pending("a")
+        await cacher.warm(["c", "a"])
+        cacher.close()
+
+    asyncio.run(run())
+    assert (cache_dir / "b" / "asset").read_bytes() == b"b"
+    assert not any(cacher.is_pending(a) for _, a in paths)
+    assert (cache_dir / MANIFEST_FILENAME).is_file()
+
+
+def test_lazy_adapters_only_list_their_kind_of_asset(tmp_path):
+    cache_dir = tmp_path / "cache"
+    for asset_id in ("plain", "textured"):
+        (cache_dir / asset_id).mkdir(parents=True)
+        (cache_dir / asset_id / (CacheFile.mesh_raw + ".gz")).write_bytes(b"")
+    (cache_dir / "textured" / CacheFile.image).write_text("{}")
+    cacher = LazyCacher(cache_dir, n_jobs=1)
+    cacher.asset_ids = ["plain", "pending", "textured"]
+
+    images = LazyImageCacheAdapter(cache_dir, cacher, "mesh")
+    meshes = LazyMeshCacheAdapter(cache_dir, cacher, "mesh")
+    assert meshes.asset_ids() == ["plain", "pending", "textured"]
+    assert images.asset_ids() == ["textured"]
+
+    # once the watcher has cached a new textured mesh, it has an image too
+    (cache_dir / "new").mkdir()
+    (cache_dir / "new" / (CacheFile.mesh_raw + ".gz")).write_bytes(b"")
+    (cache_dir / "new" / CacheFile.image).write_text("{}")
+    for adapter in (images, meshes):
+        adapter.update_assets({"new": tmp_path / "new.obj"}, ["plain"])
+    assert images.asset_ids() == ["textured", "new"]
+    assert meshes.asset_ids() == ["pending", "textured", "new"]
+
+    # and in image mode there are no meshes
+    assert LazyMeshCacheAdapter(tmp_path / "empty", cacher, "image").asset_ids() == []
+    images = LazyImageCacheAdapter(tmp_path / "empty", cacher, "image")
+    assert images.asset_ids() == ["plain", "pending", "textured"]
+
+
+def test_textured_meshes_are_listed_as_images_once_cached(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    paths = [(tmp_path / f"{a}.obj", a) for a in ("plain", "textured")]
+    for path, _ in paths:
+        path.write_bytes(b"")
+    cacher = LazyCacher(cache_dir, n_jobs=1)
+    cacher.defer(partial(_cache_mesh, cache_dir), paths)
+    cacher.asset_ids = ["plain", "textured"]
+    images = LazyImageCacheAdapter(cache_dir, cacher, "mesh")
+    assert images.asset_ids() == []
+    revision = images.revision()
+
+    async def run():
+        await cacher.ensure("plain")
+        await cacher.ensure("textured")
+        cacher.close()
+
+    asyncio.run(run())
+    assert images.asset_ids() == ["textured"]
+    assert images.revision() != revision
@@ -0,0 +1,42 @@
+from landmarkerio.lru import ByteLRU, FileCache, FileKind
+
+
+def test_lru_is_bounded_by_bytes():
+    lru = ByteLRU(budget=80)
+    for i in range(4):
+        lru.put(("a", i), "etag", bytes(10))
+    assert lru.get(("a", 0), "etag") is not None
+    lru.put(("b", 0), "etag", bytes(10))
+    # too big to be kept
+    lru.put(("c", 0), "etag", bytes(11))
+    assert lru.size == 50 and len(lru) == 5
+
+    for i in range(4):
+        lru.put(("d", i), "etag", bytes(10))
+    assert lru.size == 80
+    # the least recently used entry went first
+    assert lru.get(("a", 1), "etag") is None
+    assert lru.get(("a", 0), "etag") is not None
+    assert lru.evictions == 1
+
+
+def test_lru_only_serves_the_current_version():
+    lru = ByteLRU(budget=80)
+    lru.put(("a", 0), "old", b"old")
+    assert lru.get(("a", 0), "new") is None
+    assert (lru.hits, lru.misses) == (0, 1)
+
+
+def test_file_cache_budgets_kinds_separately_and_invalidates():
+    cache = FileCache({FileKind.thumbnail: 80, FileKind.mesh: 800})
+    thumbnail = cache.slot(FileKind.thumbnail, "a", "thumbnail.jpg")
+    thumbnail.put("etag", bytes(10))
+    for i in range(10):
+        cache.slot(FileKind.mesh, f"m{i}", "mesh.raw.gz").put("etag", bytes(100))
+    assert thumbnail.get("etag") is not None
+
+    cache.update_assets({"a": None}, [])
+    assert thumbnail.get("etag") is None
+    assert cache.stats()[FileKind.thumbnail]["entries"] == 0
+    assert cache.slot(FileKind.tile, "a", "tile") is not None
+    assert FileCache({FileKind.tile: 0}).slot(FileKind.tile, "a", "tile") is None
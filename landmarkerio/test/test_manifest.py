@@ -0,0 +1,90 @@
+import os
+
+from landmarkerio import MANIFEST_FILENAME, CacheFile
+from landmarkerio.manifest import CacheManifest, source_entry
+from landmarkerio.shard import Shard
+
+
+def _setup(tmp_path):
+    asset_dir = tmp_path / "assets"
+    cache_dir = tmp_path / "cache"
+    asset_dir.mkdir()
+    cache_dir.mkdir()
+    paths = {}
+    for asset_id in ("a", "b"):
+        path = asset_dir / f"{asset_id}.jpg"
+        path.write_bytes(asset_id.encode())
+        paths[asset_id] = path
+    return cache_dir, paths
+
+
+def _cache(cache_dir, asset_id):
+    (cache_dir / asset_id).mkdir(exist_ok=True)
+    (cache_dir / asset_id / CacheFile.texture).write_bytes(b"")
+
+
+def test_manifest_plans_new_changed_and_orphaned(tmp_path):
+    cache_dir, paths = _setup(tmp_path)
+    manifest = CacheManifest(cache_dir)
+    assert set(manifest.plan(paths, [CacheFile.texture]).stale) == {"a", "b"}
+
+    for asset_id, path in paths.items():
+        _cache(cache_dir, asset_id)
+        manifest.record(asset_id, source_entry(path))
+    manifest.save()
+
+    manifest = CacheManifest(cache_dir)
+    assert len(manifest) == 2
+    assert not manifest.plan(paths, [CacheFile.texture]).stale
+
+    paths["a"].write_bytes(b"changed")
+    st = os.stat(paths["a"])
+    os.utime(paths["a"], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    del paths["b"]
+    plan = manifest.plan(paths, [CacheFile.texture])
+    assert set(plan.stale) == {"a"}
+    assert plan.orphaned == ["b"]
+
+
+def test_manifest_adopts_complete_legacy_cache(tmp_path):
+    cache_dir, paths = _setup(tmp_path)
+    _cache(cache_dir, "a")
+    # a half written asset directory is not adopted
+    (cache_dir / "b").mkdir()
+
+    manifest = CacheManifest(cache_dir)
+    plan = manifest.plan(paths, [CacheFile.texture])
+    assert set(plan.stale) == {"b"}
+    assert "a" in manifest
+
+
+def test_manifest_content_hash_skips_touched_assets(tmp_path):
+    cache_dir, paths = _setup(tmp_path)
+    manifest = CacheManifest(cache_dir)
+    for asset_id, path in paths.items():
+        _cache(cache_dir, asset_id)
+        manifest.record(asset_id, source_entry(path, content_hash=True))
+
+    st = os.stat(paths["a"])
+    os.utime(paths["a"], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert not manifest.plan(paths, [CacheFile.texture], content_hash=True).stale
+
+
+def test_shard_manifests_are_merged(tmp_path):
+    cache_dir, paths = _setup(tmp_path)
+    shards = [Shard(i, 2) for i in range(2)]
+    assert sum(asset_id in shard for shard in shards for asset_id in paths) == 2
+
+    for shard in shards:
+        manifest = CacheManifest(cache_dir, shard=shard)
+        for asset_id, path in paths.items():
+            if asset_id in shard:
+                _cache(cache_dir, asset_id)
+                manifest.record(asset_id, source_entry(path))
+        manifest.save()
+
+    manifest = CacheManifest(cache_dir)
+    assert len(manifest) == 2
+    assert not manifest.plan(paths, [CacheFile.texture]).stale
+    manifest.save()
+    assert [p.name for p in cache_dir.glob(".lmiomanifest*")] == [MANIFEST_FILENAME]
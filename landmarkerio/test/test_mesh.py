@@ -0,0 +1,86 @@
+import io
+import struct
+
+import numpy as np
+
+from landmarkerio import mesh as mesh_module
+from landmarkerio.mesh import (
+    RawMesh,
+    cluster_vertices,
+    decimate,
+    read_indexed_mesh,
+    write_expanded_mesh,
+    write_indexed_mesh,
+)
+
+
+def _grid_mesh(n: int, textured: bool = True) -> RawMesh:
+    xs, ys = np.meshgrid(np.arange(n, dtype=np.float64), np.arange(n))
+    points = np.stack([xs.ravel(), ys.ravel(), np.zeros(n * n)], axis=1)
+    idx = np.arange(n * n).reshape(n, n)
+    a, b, c, d = idx[:-1, :-1], idx[:-1, 1:], idx[1:, :-1], idx[1:, 1:]
+    trilist = np.concatenate(
+        [np.stack([a, b, c], -1).reshape(-1, 3), np.stack([b, d, c], -1).reshape(-1, 3)]
+    )
+    tcoords = points[:, :2] / (n - 1) if textured else None
+    return RawMesh(points, trilist, tcoords)
+
+
+def _tetrahedron() -> RawMesh:
+    points = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+    trilist = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+    return RawMesh(points, trilist)
+
+
+def test_indexed_mesh_round_trip():
+    mesh = _grid_mesh(5)
+    f = io.BytesIO()
+    write_indexed_mesh(f, mesh)
+    f.seek(0)
+    loaded = read_indexed_mesh(f)
+    assert loaded.trilist.dtype == np.uint16
+    np.testing.assert_array_equal(loaded.trilist, mesh.trilist)
+    np.testing.assert_allclose(loaded.points, mesh.points)
+    np.testing.assert_allclose(loaded.tcoords, mesh.tcoords)
+
+
+def test_indexed_mesh_is_smaller_than_expanded():
+    mesh = _grid_mesh(50, textured=False)
+    expanded, indexed = io.BytesIO(), io.BytesIO()
+    write_expanded_mesh(expanded, mesh)
+    write_indexed_mesh(indexed, mesh)
+    n_tris, is_textured, _, _ = struct.unpack("IIII", expanded.getvalue()[:16])
+    assert n_tris == mesh.n_tris and not is_textured
+    assert len(expanded.getvalue()) == 16 + mesh.n_tris * 9 * 4
+    assert len(indexed.getvalue()) < len(expanded.getvalue()) / 2
+
+
+def test_decimate_reduces_triangles_to_fraction():
+    mesh = _grid_mesh(40)
+    for fraction in (0.05, 0.25):
+        lod = decimate(mesh, fraction)
+        assert 0 < lod.n_tris <= mesh.n_tris * fraction
+        assert lod.trilist.max() < lod.n_points
+        assert lod.tcoords.shape == (lod.n_points, 2)
+    assert decimate(mesh, 1.0) is mesh
+
+
+def test_decimate_can_leave_no_triangles():
+    # every vertex of a tetrahedron is in its own cell of the coarsest grid
+    # that keeps any triangles, so there is no quarter of it to keep
+    assert decimate(_tetrahedron(), 0.25).n_tris == 0
+    assert decimate(_tetrahedron(), 1.0).n_tris == 4
+
+
+def test_decimate_keeps_to_the_max_resolution(monkeypatch):
+    resolutions = []
+
+    def recording_cluster_vertices(mesh, resolution):
+        resolutions.append(resolution)
+        return cluster_vertices(mesh, resolution)
+
+    monkeypatch.setattr(mesh_module, "MAX_CLUSTER_RESOLUTION", 4)
+    monkeypatch.setattr(mesh_module, "cluster_vertices", recording_cluster_vertices)
+    lod = decimate(_grid_mesh(40), 0.9)
+    assert max(resolutions) == 4
+    assert 0 < lod.n_tris <= 40 * 40 * 2 * 0.9
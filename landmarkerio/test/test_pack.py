@@ -0,0 +1,74 @@
+import json
+import shutil
+
+import pytest
+
+from landmarkerio import CacheFile, MeshFormat
+from landmarkerio.asset import MeshCacheAdapter, PackedMeshAdapter
+from landmarkerio.mesh import lod_file
+from landmarkerio.pack import Pack, pack_cache, read_packed, segment_path
+from landmarkerio.pyramid import tile_file
+
+
+def _cache(cache_dir, asset_id, texture):
+    asset_cache_dir = cache_dir / asset_id
+    (asset_cache_dir / CacheFile.tiles_dir / "0").mkdir(parents=True)
+    (asset_cache_dir / CacheFile.texture).write_bytes(texture)
+    (asset_cache_dir / CacheFile.thumbnail).write_bytes(b"thumbnail " + texture)
+    (asset_cache_dir / CacheFile.tiles_dir / tile_file(0, 0, 0)).write_bytes(b"tile")
+
+
+def test_pack_serves_files_at_offsets(tmp_path):
+    cache_dir, pack_dir = tmp_path / "cache", tmp_path / "pack"
+    _cache(cache_dir, "a", b"a" * 20)
+    _cache(cache_dir, "b", b"b" * 20)
+    pack_cache(cache_dir, pack_dir, segment_size=40)
+    assert segment_path(pack_dir, 1).is_file()
+
+    pack = Pack(pack_dir)
+    assert pack.asset_ids() == ["a", "b"]
+    assert pack.read("b", CacheFile.texture) == b"b" * 20
+    assert pack.read("a", CacheFile.thumbnail) == b"thumbnail " + b"a" * 20
+    tile_name = f"{CacheFile.tiles_dir}/{tile_file(0, 0, 0)}"
+    assert pack.read("a", tile_name) == b"tile"
+    assert pack.locate("a", CacheFile.texture).size == 20
+
+
+def test_repacking_appends_only_changed_assets(tmp_path):
+    cache_dir, pack_dir = tmp_path / "cache", tmp_path / "pack"
+    _cache(cache_dir, "a", b"a")
+    _cache(cache_dir, "b", b"b")
+    pack_cache(cache_dir, pack_dir)
+    size = segment_path(pack_dir, 0).stat().st_size
+
+    shutil.rmtree(cache_dir / "a")
+    _cache(cache_dir, "a", b"changed")
+    shutil.rmtree(cache_dir / "b")
+    pack_cache(cache_dir, pack_dir)
+
+    pack = Pack(pack_dir)
+    assert pack.asset_ids() == ["a"]
+    assert pack.read("a", CacheFile.texture) == b"changed"
+    assert segment_path(pack_dir, 0).stat().st_size > size
+
+
+def test_mesh_lods_are_found_in_caches_and_packs(tmp_path):
+    cache_dir, pack_dir = tmp_path / "cache", tmp_path / "pack"
+    (cache_dir / "m").mkdir(parents=True)
+    for raw_name in (CacheFile.mesh_raw, CacheFile.mesh_indexed_raw):
+        (cache_dir / "m" / (raw_name + ".gz")).write_bytes(raw_name.encode())
+        lod_name = lod_file(raw_name, 0) + ".gz"
+        (cache_dir / "m" / lod_name).write_bytes(lod_name.encode())
+    lods = [{"lod": 0, "fraction": 0.1}, {"lod": 1, "fraction": 1.0}]
+    (cache_dir / "m" / CacheFile.mesh_lods).write_text(json.dumps(lods))
+    pack_cache(cache_dir, pack_dir)
+
+    cached, packed = MeshCacheAdapter(cache_dir), PackedMeshAdapter(pack_dir)
+    for lod, mesh_format in [(0, MeshFormat.indexed), (1, MeshFormat.expanded)]:
+        path = cached.lod_mesh_path("m", lod, mesh_format)
+        assert read_packed(packed.lod_mesh_path("m", lod, mesh_format)) == (
+            path.read_bytes()
+        )
+    assert cached.lod_mesh_path("m", 1).name == CacheFile.mesh_raw + ".gz"
+    with pytest.raises(FileNotFoundError):
+        packed.lod_mesh_path("m", 2)
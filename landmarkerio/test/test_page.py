@@ -0,0 +1,47 @@
+import pytest
+
+from landmarkerio.page import (
+    InvalidPageQuery,
+    PageQuery,
+    paginate,
+    parse_page_query,
+)
+
+ASSET_IDS = [f"{letter}{i}" for letter in "ab" for i in range(5)]
+
+
+def test_cursors_walk_the_whole_list():
+    pages, cursor = [], None
+    while True:
+        page = paginate(ASSET_IDS, PageQuery(limit=3, cursor=cursor))
+        pages.append(list(page.asset_ids))
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert sum(pages, []) == ASSET_IDS
+    assert [len(p) for p in pages] == [3, 3, 3, 1]
+
+
+def test_offset_and_prefix():
+    page = paginate(ASSET_IDS, PageQuery(offset=1, limit=2, prefix="b"))
+    assert list(page.asset_ids) == ["b1", "b2"]
+    rest = paginate(ASSET_IDS, PageQuery(prefix="b", cursor=page.next_cursor))
+    assert list(rest.asset_ids) == ["b3", "b4"]
+    assert rest.next_cursor is None
+
+
+def test_cursors_survive_changes_before_them():
+    page = paginate(ASSET_IDS, PageQuery(limit=4))
+    changed = ["new"] + ASSET_IDS[2:]
+    assert paginate(changed, PageQuery(limit=1, cursor=page.next_cursor))[0] == ["a4"]
+    with pytest.raises(InvalidPageQuery):
+        paginate(ASSET_IDS[4:], PageQuery(cursor=page.next_cursor))
+
+
+def test_parse_page_query():
+    assert parse_page_query({}) is None
+    assert parse_page_query({"limit": "5"}) == PageQuery(limit=5)
+    with pytest.raises(InvalidPageQuery):
+        parse_page_query({"offset": "-1"})
+    with pytest.raises(InvalidPageQuery):
+        paginate(ASSET_IDS, PageQuery(cursor="not a cursor!"))
@@ -0,0 +1,35 @@
+import json
+import os
+import time
+
+from landmarkerio.pool import pool_cacher
+
+
+def _cache_or_die(path, asset_id):
+    if asset_id == "bad":
+        time.sleep(0.2)
+        os._exit(1)
+    time.sleep(0.5)
+
+
+def test_only_the_asset_that_kills_a_worker_is_charged(tmp_path):
+    asset_ids = ["bad", "a", "b", "c"]
+    path_asset_id = [(tmp_path / f"{a}.jpg", a) for a in asset_ids]
+    report_path = tmp_path / "failures.json"
+
+    cached = list(
+        pool_cacher(
+            _cache_or_die,
+            path_asset_id,
+            n_jobs=4,
+            retries=0,
+            chunk_size=1,
+            report_path=report_path,
+        )
+    )
+
+    # the others were in flight when the worker died, but are cached after all
+    assert sorted(cached) == ["a", "b", "c"]
+    failures = json.loads(report_path.read_text())
+    assert list(failures) == ["bad"]
+    assert failures["bad"]["attempts"] == 1
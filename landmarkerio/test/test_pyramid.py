@@ -0,0 +1,80 @@
+import math
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+from landmarkerio import CacheFile
+from landmarkerio.image import probe_image
+from landmarkerio.pyramid import build_pyramid, build_pyramid_from_file, tile_file
+
+
+def _noise(size):
+    return Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+
+
+def _halved_tiles(image, tiles_dir, tile_size):
+    # the pyramid as cut from each whole level in turn
+    level = math.ceil(math.log2(max(image.size) / tile_size))
+    while level >= 0:
+        (tiles_dir / str(level)).mkdir(parents=True)
+        w, h = image.size
+        for x in range(math.ceil(w / tile_size)):
+            for y in range(math.ceil(h / tile_size)):
+                box = (
+                    x * tile_size,
+                    y * tile_size,
+                    (x + 1) * tile_size,
+                    (y + 1) * tile_size,
+                )
+                box = (box[0], box[1], min(w, box[2]), min(h, box[3]))
+                image.crop(box).save(
+                    tiles_dir / tile_file(level, x, y), quality=85, format="jpeg"
+                )
+        image = image.reduce(2)
+        level -= 1
+
+
+def test_pyramid_built_in_bands_matches_halving_whole_levels(tmp_path):
+    image = _noise((301, 203))
+    metadata = build_pyramid(image, tmp_path / "bands", tile_size=32)
+    _halved_tiles(image, tmp_path / "whole", 32)
+
+    assert metadata["levels"] == 5
+    assert metadata["level_sizes"][0] == [19, 13]
+    assert metadata["level_sizes"][-1] == [301, 203]
+    bands = tmp_path / "bands" / CacheFile.tiles_dir
+    whole = sorted(
+        p.relative_to(tmp_path / "whole") for p in (tmp_path / "whole").rglob("*.jpg")
+    )
+    assert sorted(p.relative_to(bands) for p in bands.rglob("*.jpg")) == whole
+    for tile in whole:
+        assert (bands / tile).read_bytes() == (tmp_path / "whole" / tile).read_bytes()
+
+
+@pytest.mark.parametrize("vips", [False, True])
+def test_images_above_the_pil_pixel_limit_are_tiled(tmp_path, monkeypatch, vips):
+    if vips:
+        pytest.importorskip("pyvips")
+    else:
+        monkeypatch.setitem(sys.modules, "pyvips", None)
+    path = tmp_path / "scan.jpg"
+    _noise((600, 400)).save(path, format="jpeg")
+    # the strips read are within the limit, but the image is not
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 50000)
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(path)
+
+    assert probe_image(path).shape == (400, 600)
+    metadata = build_pyramid_from_file(path, tmp_path, tile_size=64)
+    assert metadata["level_sizes"] == [
+        [38, 25],
+        [75, 50],
+        [150, 100],
+        [300, 200],
+        [600, 400],
+    ]
+    with Image.open(tmp_path / CacheFile.tiles_dir / tile_file(4, 9, 6)) as tile:
+        assert tile.size == (600 - 9 * 64, 400 - 6 * 64)
+    assert Image.MAX_IMAGE_PIXELS == 50000
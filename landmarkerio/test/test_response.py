@@ -0,0 +1,187 @@
+import asyncio
+import gzip
+import threading
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+from sanic.exceptions import SanicException
+
+from landmarkerio.response import (
+    ByteRange,
+    JSONCache,
+    Validators,
+    accepted_encoding,
+    file_validators,
+    is_not_modified,
+    parse_range,
+    prepare_json,
+    read_file,
+    requested_range,
+    serve_compressed_file,
+    serve_file,
+)
+from landmarkerio.codec import compress, get_codec
+from landmarkerio.types import PackedFile
+
+
+def _request(**headers):
+    return SimpleNamespace(headers={k.replace("_", "-"): v for k, v in headers.items()})
+
+
+def test_etag_changes_when_a_file_is_replaced(tmp_path):
+    path = tmp_path / "texture.jpg"
+    path.write_bytes(b"a")
+    validators = file_validators(path)
+    assert file_validators(path) == validators
+
+    replacement = tmp_path / "new.jpg"
+    replacement.write_bytes(b"b")
+    replacement.replace(path)
+    assert file_validators(path).etag != validators.etag
+
+
+def test_conditional_requests():
+    validators = Validators('"abc"', last_modified=1000.0)
+    assert not is_not_modified(None, validators)
+    assert not is_not_modified(_request(), validators)
+    assert is_not_modified(_request(If_None_Match='"xyz", W/"abc"'), validators)
+    assert not is_not_modified(_request(If_None_Match='"xyz"'), validators)
+    assert is_not_modified(_request(If_None_Match="*"), validators)
+
+    assert is_not_modified(_request(If_Modified_Since=formatdate(1000)), validators)
+    assert not is_not_modified(_request(If_Modified_Since=formatdate(999)), validators)
+    assert not is_not_modified(_request(If_Modified_Since="garbage"), validators)
+    # If-None-Match takes precedence
+    request = _request(If_None_Match='"xyz"', If_Modified_Since=formatdate(1000))
+    assert not is_not_modified(request, validators)
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == ByteRange(0, 9, 100)
+    assert parse_range("bytes=90-", 100) == ByteRange(90, 99, 100)
+    assert parse_range("bytes=90-200", 100) == ByteRange(90, 99, 100)
+    assert parse_range("bytes=-10", 100) == ByteRange(90, 99, 100)
+    assert parse_range("bytes=-200", 100) == ByteRange(0, 99, 100)
+    # unsupported or invalid ranges are ignored
+    for header in ("bytes=0-1,5-6", "items=0-1", "bytes=5-1", "bytes=-", "bytes=a-"):
+        assert parse_range(header, 100) is None
+    for header in ("bytes=100-", "bytes=-0"):
+        with pytest.raises(SanicException) as e:
+            parse_range(header, 100)
+        assert e.value.status_code == 416
+
+
+def test_if_range_only_resumes_the_same_version():
+    validators = Validators('"abc"', last_modified=1000.0)
+    assert requested_range(_request(Range="bytes=1-"), validators, 10).start == 1
+    for if_range in ('"abc"', formatdate(1000)):
+        request = _request(Range="bytes=1-", If_Range=if_range)
+        assert requested_range(request, validators, 10) is not None
+    for if_range in ('"xyz"', 'W/"abc"', formatdate(999)):
+        request = _request(Range="bytes=1-", If_Range=if_range)
+        assert requested_range(request, validators, 10) is None
+
+
+def test_prepared_json_is_compressed():
+    prepared = prepare_json([f"asset_{i}" for i in range(1000)])
+    assert gzip.decompress(prepared.bodies["gzip"]) == prepared.bodies["identity"]
+    assert list(prepare_json("small").bodies) == ["identity"]
+
+
+def test_accepted_encoding():
+    available = ["identity", "br", "gzip"]
+    assert accepted_encoding(_request(Accept_Encoding="gzip, br"), available) == "br"
+    request = _request(Accept_Encoding="br;q=0, gzip;q=0.5")
+    assert accepted_encoding(request, available) == "gzip"
+    assert accepted_encoding(_request(), available) == "identity"
+
+
+def test_json_is_prepared_once_per_revision():
+    calls = []
+
+    def data():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        cache = JSONCache()
+        first = await cache.get("k", 0, data)
+        assert await cache.get("k", 0, data) is first
+        assert (await cache.get("k", 1, data)).bodies["identity"] == b"2"
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_json_cache_awaits_data():
+    async def data():
+        return [1]
+
+    async def run():
+        return await JSONCache().get("k", 0, data)
+
+    assert asyncio.run(run()).bodies["identity"] == b"[1]"
+
+
+def test_packed_files_are_read_off_the_event_loop(tmp_path, monkeypatch):
+    segment = tmp_path / "segment"
+    segment.write_bytes(b"headtexturetail")
+    packed = PackedFile(segment, 4, 7, "texture.jpg")
+    threads = []
+
+    def read_packed(packed):
+        threads.append(threading.get_ident())
+        return segment.read_bytes()[packed.offset : packed.offset + packed.size]
+
+    monkeypatch.setattr("landmarkerio.response.read_packed", read_packed)
+
+    async def run():
+        assert await read_file(packed) == b"texture"
+        request = _request(Range="bytes=0-3")
+        res = await serve_file("image/jpeg", packed, request=request)
+        assert res.status == 206 and res.body == b"text"
+
+    asyncio.run(run())
+    assert len(threads) == 2
+    assert threading.get_ident() not in threads
+
+
+def test_compressed_files_are_served_in_an_accepted_encoding(tmp_path):
+    data = b"mesh" * 1000
+    path = tmp_path / "mesh.raw.zst"
+    path.write_bytes(compress(data, get_codec("zstd")))
+
+    async def serve(accept_encoding):
+        request = _request(Accept_Encoding=accept_encoding)
+        return await serve_compressed_file("application/octet-stream", path, request)
+
+    async def run():
+        return [await serve(e) for e in ("zstd, gzip", "gzip, deflate", "deflate")]
+
+    as_stored, recompressed, decompressed = asyncio.run(run())
+    assert as_stored.headers["Content-Encoding"] == "zstd"
+    assert recompressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(recompressed.body) == data
+    assert "Content-Encoding" not in decompressed.headers
+    assert decompressed.body == data
+    responses = (as_stored, recompressed, decompressed)
+    assert all(r.headers["Vary"] == "Accept-Encoding" for r in responses)
+    assert len({r.headers["ETag"] for r in responses}) == 3
+
+
+def test_files_are_stated_off_the_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "texture.jpg"
+    path.write_bytes(b"texture")
+    validators = file_validators(path)
+    threads = []
+
+    def stat_file(path):
+        threads.append(threading.get_ident())
+        return validators, 7
+
+    monkeypatch.setattr("landmarkerio.response.stat_file", stat_file)
+    request = _request(If_None_Match=validators.etag)
+    response = asyncio.run(serve_file("image/jpeg", path, request=request))
+    assert response.status == 304
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,99 @@
+import asyncio
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+
+from landmarkerio.lazy import LazyCacher
+from landmarkerio.watch import AssetWatcher
+
+
+def _copy_asset(cache_dir, path, asset_id):
+    asset_cache_dir = Path(cache_dir) / asset_id
+    asset_cache_dir.mkdir()
+    (asset_cache_dir / "asset").write_bytes(Path(path).read_bytes())
+
+
+def _discover(asset_dir):
+    return {p.stem: p for p in Path(asset_dir).glob("*.txt")}
+
+
+def test_watcher_caches_new_assets_and_notifies(tmp_path):
+    asset_dir = tmp_path / "assets"
+    cache_dir = tmp_path / "cache"
+    asset_dir.mkdir()
+    cache_dir.mkdir()
+    (asset_dir / "a.txt").write_text("a")
+    (asset_dir / "b.txt").write_text("b")
+
+    cacher = LazyCacher(cache_dir, n_jobs=1)
+    cacher.defer(partial(_copy_asset, cache_dir), [])
+    watcher = AssetWatcher(
+        partial(_discover, asset_dir), cacher, _discover(asset_dir), [asset_dir]
+    )
+    updates = []
+
+    async def rescan():
+        await watcher.rescan([lambda added, removed: updates.append((added, removed))])
+
+    (asset_dir / "a.txt").unlink()
+    (asset_dir / "c.txt").write_text("c")
+    asyncio.run(rescan())
+    cacher.close()
+
+    assert updates == [({"c": asset_dir / "c.txt"}, ["a"])]
+    assert (cache_dir / "c" / "asset").read_text() == "c"
+
+
+def test_watcher_only_looks_at_changed_paths(tmp_path):
+    asset_dir = tmp_path / "assets"
+    cache_dir = tmp_path / "cache"
+    asset_dir.mkdir()
+    cache_dir.mkdir()
+    for asset_id in ("a", "b"):
+        (asset_dir / f"{asset_id}.txt").write_text(asset_id)
+
+    def rediscover():
+        raise AssertionError("assets were rediscovered")
+
+    def identify(path):
+        return path.stem if path.suffix == ".txt" else None
+
+    cacher = LazyCacher(cache_dir, n_jobs=1)
+    cacher.defer(partial(_copy_asset, cache_dir), [])
+    watcher = AssetWatcher(
+        rediscover, cacher, _discover(asset_dir), [asset_dir], identify=identify
+    )
+    updates = []
+
+    def event(event_type, src_path, dest_path="", is_directory=False):
+        return SimpleNamespace(
+            event_type=event_type,
+            src_path=str(src_path),
+            dest_path=str(dest_path),
+            is_directory=is_directory,
+        )
+
+    (asset_dir / "a.txt").rename(asset_dir / "c.txt")
+    (asset_dir / "b.txt").write_text("bb")
+    (asset_dir / "d.tmp").write_text("d")
+    watcher._note_event(event("moved", asset_dir / "a.txt", asset_dir / "c.txt"))
+    watcher._note_event(event("modified", asset_dir / "b.txt"))
+    watcher._note_event(event("created", asset_dir / "d.tmp"))
+    watcher._note_event(event("modified", asset_dir, is_directory=True))
+    paths = watcher._changed_paths
+
+    async def rescan():
+        await watcher.rescan(
+            [lambda added, removed: updates.append((added, removed))], paths=paths
+        )
+
+    asyncio.run(rescan())
+    cacher.close()
+
+    assert updates == [({"b": asset_dir / "b.txt", "c": asset_dir / "c.txt"}, ["a"])]
+    assert (cache_dir / "b" / "asset").read_text() == "bb"
+    assert sorted(watcher._known) == ["b", "c"]
+
+    # a new directory's files have no events of their own
+    watcher._note_event(event("created", asset_dir / "sub", is_directory=True))
+    assert watcher._changed_paths is None
@@ -1,4 +1,17 @@
 import os
-from typing import Union
+from pathlib import Path
+from typing import NamedTuple, Union
 
 PathLike = Union[os.PathLike, str]
+
+
+class PackedFile(NamedTuple):
+    segment: Path
+    offset: int
+    size: int
+    # the name of the file within its asset, e.g. 'mesh.raw.gz'
+    name: str
+
+
+# a file of an asset, either on disk or at an offset within a packed cache
+AssetFile = Union[Path, PackedFile]
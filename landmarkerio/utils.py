@@ -1,7 +1,7 @@
 import os
 import os.path as p
 from pathlib import Path
-from typing import Tuple
+from typing import Iterable, List, Sequence, Tuple
 
 from landmarkerio.types import PathLike
 
@@ -13,4 +13,17 @@ def parse_username_and_password_file(path: PathLike) -> Tuple[str, str]:
     return user_pass[0], user_pass[1]
 
 
+def updated_asset_ids(
+    asset_ids: Sequence[str], added: Iterable[str], removed: Iterable[str]
+) -> List[str]:
+    r"""
+    A new list of asset ids with some added and removed, for adapters to swap
+    in place of their old list so that readers never see a partial update.
+    """
+    removed = set(removed)
+    present = set(asset_ids)
+    new_ids = [a for a in added if a not in present]
+    return [a for a in asset_ids if a not in removed] + new_ids
+
+
 DIMS = {"image": 2, "mesh": 3}
@@ -0,0 +1,226 @@
+import asyncio
+import os
+from os.path import abspath, expanduser
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from loguru import logger
+
+from landmarkerio.lazy import LazyCacher
+from landmarkerio.types import PathLike
+
+DiscoverF = Callable[[], Mapping[str, Path]]
+# called with the assets added (and the paths of their source files) and removed
+AssetsListener = Callable[[Mapping[str, Path], Sequence[str]], None]
+SourceState = Tuple[Path, Optional[Tuple[int, int]]]
+# the id of the asset whose source file is at a path, or None if it isn't one
+IdentifyF = Callable[[Path], Optional[str]]
+
+DEFAULT_POLL_INTERVAL = 10.0
+# How long a burst of filesystem events is given to settle before rescanning
+SETTLE_INTERVAL = 1.0
+# The watchdog events that don't change anything
+IGNORED_EVENTS = ("opened", "closed_no_write")
+
+
+def _source_state(path: PathLike) -> SourceState:
+    try:
+        st = os.stat(path)
+        return Path(path), (st.st_size, st.st_mtime_ns)
+    except OSError:
+        return Path(path), None
+
+
+def _snapshot(discover: DiscoverF) -> Dict[str, SourceState]:
+    return {asset_id: _source_state(path) for asset_id, path in discover().items()}
+
+
+class AssetChanges(NamedTuple):
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    # the current state of the added and changed assets
+    states: Dict[str, SourceState]
+
+
+class AssetWatcher:
+    r"""
+    Watches the asset directory of a running server. New and changed source
+    files are cached as they appear and the listeners passed to :meth:`run`
+    (typically the adapters' update_assets) are told which assets have been
+    added and removed.
+
+    When the optional watchdog package is installed, inotify (or the
+    platform's equivalent) is used so that only the files that have changed
+    are looked at, given identify to tell which asset (if any) each is.
+    Otherwise - or when whole directories are created, moved or removed - all
+    of the assets are rediscovered, every poll_interval seconds when polling.
+    """
+
+    def __init__(
+        self,
+        discover: DiscoverF,
+        cacher: LazyCacher,
+        asset_id_to_paths: Mapping[str, PathLike],
+        watch_dirs: Sequence[PathLike],
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        identify: Optional[IdentifyF] = None,
+    ) -> None:
+        self.discover = discover
+        self.cacher = cacher
+        self.watch_dirs = [Path(abspath(expanduser(d))) for d in watch_dirs]
+        self.poll_interval = poll_interval
+        self.identify = identify
+        self._known = {a: _source_state(p) for a, p in asset_id_to_paths.items()}
+        # the files changed since the last rescan, or None if everything
+        # needs to be rediscovered
+        self._changed_paths: Optional[Set[Path]] = set()
+
+    async def run(self, listeners: Sequence[AssetsListener]) -> None:
+        changed = asyncio.Event()
+        observer = self._start_observer(changed)
+        try:
+            while True:
+                if observer is None:
+                    await asyncio.sleep(self.poll_interval)
+                else:
+                    await changed.wait()
+                    await asyncio.sleep(SETTLE_INTERVAL)
+                    changed.clear()
+                paths, self._changed_paths = self._changed_paths, set()
+                if observer is None or self.identify is None:
+                    paths = None
+                try:
+                    await self.rescan(listeners, paths=paths)
+                except Exception:
+                    logger.exception("Unable to rescan assets")
+        finally:
+            if observer is not None:
+                observer.stop()
+
+    def _start_observer(self, changed: asyncio.Event):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.info(
+                "watchdog is not installed - polling for new assets every {}s",
+                self.poll_interval,
+            )
+            return None
+
+        loop = asyncio.get_running_loop()
+
+        def note_event(event) -> None:
+            self._note_event(event)
+            changed.set()
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # called on the observer's thread
+                if event.event_type not in IGNORED_EVENTS:
+                    loop.call_soon_threadsafe(note_event, event)
+
+        observer = Observer()
+        for watch_dir in self.watch_dirs:
+            observer.schedule(Handler(), str(watch_dir), recursive=True)
+        observer.daemon = True
+        observer.start()
+        logger.info("watching {} for new assets", ", ".join(map(str, self.watch_dirs)))
+        return observer
+
+    def _note_event(self, event) -> None:
+        # on the event loop
+        if event.is_directory:
+            # a modified directory has events of its own for its files, but
+            # the files of one that is created, moved or removed don't
+            if event.event_type != "modified":
+                self._changed_paths = None
+        elif self._changed_paths is not None:
+            self._changed_paths.add(Path(os.fsdecode(event.src_path)))
+            dest_path = getattr(event, "dest_path", "")
+            if dest_path:
+                self._changed_paths.add(Path(os.fsdecode(dest_path)))
+
+    def _rediscover(self) -> AssetChanges:
+        # on a thread of the default executor
+        current = _snapshot(self.discover)
+        known = self._known
+        return AssetChanges(
+            added=[a for a in current if a not in known],
+            changed=[a for a in current if a in known and current[a] != known[a]],
+            removed=[a for a in known if a not in current],
+            states=current,
+        )
+
+    def _restat(self, paths: Iterable[Path]) -> AssetChanges:
+        # on a thread of the default executor
+        assert self.identify is not None
+        changes = AssetChanges([], [], [], {})
+        for path in sorted(paths):
+            asset_id = self.identify(path)
+            if asset_id is None:
+                continue
+            state = _source_state(path)
+            known = self._known.get(asset_id)
+            if state[1] is None:
+                if known is not None and known[0] == path:
+                    changes.removed.append(asset_id)
+            elif known is None:
+                changes.added.append(asset_id)
+            elif state != known:
+                changes.changed.append(asset_id)
+            changes.states[asset_id] = state
+        return changes
+
+    async def rescan(
+        self,
+        listeners: Sequence[AssetsListener],
+        paths: Optional[Iterable[Path]] = None,
+    ) -> None:
+        r"""
+        Update the assets from the source files at paths, or rediscover all of
+        them if paths is None.
+        """
+        loop = asyncio.get_running_loop()
+        if paths is None:
+            changes = await loop.run_in_executor(None, self._rediscover)
+        else:
+            changes = await loop.run_in_executor(None, self._restat, paths)
+        added, changed, removed, current = changes
+        for asset_id in removed:
+            del self._known[asset_id]
+        for asset_id in added + changed:
+            self._known[asset_id] = current[asset_id]
+        if added or removed or changed:
+            logger.info(
+                "{} new, {} changed and {} removed assets",
+                len(added),
+                len(changed),
+                len(removed),
+            )
+        if removed:
+            self.cacher.remove(removed)
+        if added or changed:
+            self.cacher.add({a: current[a][0] for a in added + changed})
+            await self.cacher.cache_all(added + changed)
+            self.cacher.save()
+        # a failed asset is announced once a later change caches it
+        cached = {
+            a: current[a][0] for a in added + changed if not self.cacher.is_failed(a)
+        }
+        # listeners are told even if no assets changed, as e.g. collection
+        # files may have been edited
+        for listener in listeners:
+            listener(cached, removed)
@@ -47,10 +47,18 @@ setup(
     package_data={"landmarkerio": ["default_templates/*"]},
     packages=find_packages(),
     install_requires=install_requires,
+    extras_require={
+        "zstd": ["zstandard"],
+        "brotli": ["brotli"],
+        "watch": ["watchdog"],
+        "vips": ["pyvips"],
+    },
     scripts=[
         join("landmarkerio", "lmio"),
         join("landmarkerio", "lmioserve"),
         join("landmarkerio", "lmiocache"),
         join("landmarkerio", "lmioconvert"),
+        join("landmarkerio", "lmiopack"),
+        join("landmarkerio", "lmiolandmarks"),
     ],
 )